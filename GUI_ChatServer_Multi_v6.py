@@ -1,121 +1,2029 @@
-import os
-from socket import *
-from threading import *
-
-class MultiChatServer:
-    def __init__(self):
-        self.clients = []  # 접속된 클라이언트 소켓 목록
-        self.s_sock = socket(AF_INET, SOCK_STREAM) # TCP 소켓 생성
-        self.ip = '' # 모든 IP로부터 연결을 허용
-        self.port = 2500  # 서버 포트 번호
-        self.s_sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1) # 소켓 재사용 옵션 설정
-        self.s_sock.bind((self.ip, self.port)) # IP와 포트를 소켓에 바인딩
-        print("클라이언트 대기 중 ...")
-        self.s_sock.listen(100) # 최대 100명의 클라이언트 연결 허용
-        self.accept_client() # 클라이언트 연결을 수락하는 메서드 호출
-
-    def accept_client(self):
-        """클라이언트의 연결을 수락하고, 각 클라이언트와 통신할 스레드를 생성합니다."""
-        while True:
-            c_socket, (ip, port) = self.s_sock.accept() # 클라이언트 연결 수락
-            if c_socket not in self.clients: # 연결 수락한 클라이언트가 현재 clients에 없으면 
-                self.clients.append(c_socket) # 새로운 클라이언트 추가
-                print(ip, ':', str(port), '가 연결되었습니다.')
-                cth = Thread(target=self.receive_messages, args=(c_socket,)) # 클라이언트와 통신할 스레드 생성
-                cth.start() # 스레드 시작
-
-    def receive_messages(self, c_socket):
-        while True:
-            try:
-                incoming_message = c_socket.recv(1024).decode('utf-8') # 1024 바이트 데이터 수신 및 UTF-8 디코딩
-                if not incoming_message: # 클라이언트 연결이 끊어졌다면
-                    break 
-                                # 이미지 전송 요청 처리
-                if incoming_message.startswith("IMAGE:"):
-                    filename = incoming_message[6:]
-                    self.receive_image(c_socket, filename)
-                    
-                # 파일 전송 요청 처리
-                if incoming_message.startswith("FILE:"):
-                    filename = incoming_message[5:] # "FILE:" 이후의 파일명 추출
-                    self.receive_file(c_socket, filename) # 파일 수신 시작
-                # 파일 다운로드 요청 처리
-                elif incoming_message.startswith("DOWNLOAD:"):
-                    filename = incoming_message[9:] # "DOWNLOAD:" 이후의 파일명 추출
-                    self.send_file(c_socket, filename) # 파일 전송 시작
-                # 타이핑 상태 처리
-                elif incoming_message.startswith("TYPING:"):
-                    self.broadcast_message(c_socket, incoming_message)  # 타이핑 상태 브로드캐스트
-                elif incoming_message.startswith("TYPING_STOP:"):
-                    self.broadcast_message(c_socket, incoming_message)  # 타이핑 중단 브로드캐스트
-                # 일반 메시지 처리
-                else:
-                    self.broadcast_message(c_socket, incoming_message) # 일반 메시지를 브로드캐스트
-            except Exception as e:
-                print(f"오류 발생: {e}")
-                continue
-        c_socket.close()
-
-    def receive_image(self, c_socket, filename):
-        """클라이언트로부터 이미지를 수신한 뒤 모든 클라이언트에게 재전송"""
-        image_data = b""
-        # 이미지 바이너리 데이터 수신
-        while True:
-            data = c_socket.recv(1024)
-            if b"END_OF_FILE" in data:
-                image_data += data.split(b"END_OF_FILE")[0]
-                break
-            image_data += data
-        
-        # 수신한 이미지 데이터를 모든 클라이언트에게 전송
-        # "IMAGE_START:<filename>"를 전송하고, 바이너리 전송 후 "END_OF_FILE"
-        for client in self.clients:
-            try:
-                client.sendall(f"IMAGE_START:{filename}".encode('utf-8'))
-                # 이미지 데이터 전송
-                client.sendall(image_data)
-                client.sendall(b"END_OF_FILE")
-            except:
-                self.clients.remove(client)
-
-    def receive_file(self, c_socket, filename):
-        try:
-            with open(filename, "wb") as f: # 파일을 바이너리 모드로 엽니다.
-                while True:
-                    data = c_socket.recv(1024) # 1024 바이트씩 수신
-                    if b"END_OF_FILE" in data: # 파일 전송 종료 신호 확인
-                        f.write(data.split(b"END_OF_FILE")[0])  # 종료 신호 이전 데이터 저장
-                        break
-                    f.write(data)
-            print(f"{filename} 파일이 저장되었습니다.")
-            self.broadcast_message(c_socket, f"NEW_FILE:{filename}") # 새로운 파일이 생성되었음을 알림
-        except Exception as e:
-            print(f"파일 수신 중 오류 발생: {e}") # 오류 메시지 출력
-
-    def send_file(self, c_socket, filename):
-        if os.path.exists(filename): # 파일이 존재하면
-            try:
-                c_socket.send(f"FILE_START:{filename}".encode('utf-8')) # 파일 전송 시작 신호 전송
-                with open(filename, "rb") as f: # 파일을 바이너리 모드로 엽니다.
-                    while chunk := f.read(1024): # 1024 바이트씩 읽기
-                        c_socket.send(chunk) # 파일 조각 전송
-                c_socket.send(b"END_OF_FILE")  # 파일 전송 종료 신호 전송
-                print(f"{filename} 파일이 클라이언트에 전송되었습니다.")
-            except Exception as e:
-                print(f"파일 전송 중 오류 발생: {e}")
-        else:
-            c_socket.send(b"FILE_NOT_FOUND")
-
-
-
-    def broadcast_message(self, senders_socket, message):
-        """한 클라이언트가 보낸 메시지를 모든 클라이언트에게 브로드캐스트합니다."""
-        for client in self.clients:  # 연결된 모든 클라이언트에 대해
-            if client is not senders_socket: # 메시지를 보낸 클라이언트는 제외
-                try:
-                    client.sendall(message.encode()) # 메시지를 전송
-                except:
-                    self.clients.remove(client) # 연결이 끊어진 클라이언트를 제거
-
-if __name__ == "__main__":
-    MultiChatServer() # 서버 인스턴스 생성 및 실행
\ No newline at end of file
+import os
+import time
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from select import select
+from socket import *
+from threading import *
+from chat_protocol import (HEADER, FRAME_TEXT, FRAME_DATA, FRAME_STREAM, TRANSFER_CHUNK_SIZE, ProtocolError, ChecksumError,
+                           encode_frame, end_frame, text_frame, read_frame, read_frame_async,
+                           iter_body, iter_body_async, iter_chunks, iter_chunks_async,
+                           skip_body, skip_body_async, iter_bytes_frames)
+from chat_transfer import (TRANSFER_WINDOW, TransferStats, StreamRelay, AsyncStreamRelay, UploadCredit,
+                           AsyncUploadCredit, send_file_body, send_file_body_async,
+                           send_file_chunks, send_file_chunks_async,
+                           send_file_chunks_deflated, send_file_chunks_deflated_async, chunk_range)
+from chat_blobstore import BlobStore, valid_digest
+from chat_delta import DELTA_BLOCK_SIZE, DELTA_MIN_SIZE, DeltaPatcher
+from chat_diskio import IO_WORKERS, DiskPool
+from chat_thumbnails import THUMBNAILS_AVAILABLE, THUMBNAIL_WORKERS, ThumbnailCache, make_thumbnail
+from chat_connection import (ClientConnection, AsyncClientConnection, WriteStats, OVERFLOW_POLICIES,
+                             OVERFLOW_DROP_TYPING, DEFAULT_QUEUE_SIZE, DEFAULT_BLOCK_TIMEOUT, DEFAULT_FLUSH_INTERVAL,
+                             DEFAULT_FLUSH_BYTES)
+from chat_cluster import BusClient, run_cluster
+from chat_rooms import DEFAULT_ROOM, RoomIndex, valid_room_name
+from chat_history import HISTORY_SIZE, MessageHistory
+from chat_typing import TYPING_TICK, TypingTracker, typing_state_message
+from chat_metrics import ServerMetrics, is_local_address, serve_metrics
+from chat_compression import (COMPRESSION_MODES, COMPRESSION_TEXT, Deflater, Inflater, InflatingSocket,
+                              AsyncInflatingReader, accept_offer, is_compressed_file)
+from chat_presence import REMOTE, PresenceDirectory, users_message, valid_user_name
+from chat_heartbeat import (HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, IDLE_TIMEOUT, REAP_REASONS, REAP_TIMEOUT,
+                            Reaper, set_keepalive)
+from chat_ratelimit import (MAX_CONNECTIONS, ACCEPT_RATE, MESSAGE_RATE, MESSAGE_BURST, UPLOAD_RATE,
+                            THROTTLE_MESSAGES, UNTHROTTLED_COMMANDS, BODY_COMMANDS, REPLY_COMMANDS, AdmissionControl,
+                            throttled_message)
+from chat_streams import AsyncStreamReader, OutboundStream, file_body_pieces, file_chunk_pieces, set_stream_lowat
+from chat_reload import (RELOAD_TIMEOUT, RELOAD_POLL, listen_reload, connection_state, send_handoff,
+                         request_handoff)
+
+def create_thumbnail_pool(workers):
+    """미리보기를 만들 프로세스 풀을 만듭니다. Pillow가 없거나 workers가 0이면 None (원본 중계 방식)."""
+    if not THUMBNAILS_AVAILABLE or workers <= 0:
+        return None
+    # 스레드가 여럿 떠 있는 서버 프로세스를 fork하지 않도록 spawn 방식 사용
+    return ProcessPoolExecutor(workers, mp_context=get_context('spawn'))
+
+
+class MultiChatServer:
+    def __init__(self, port=2500, queue_size=DEFAULT_QUEUE_SIZE, overflow_policy=OVERFLOW_DROP_TYPING,
+                 storage_dir='uploads', thumbnail_workers=THUMBNAIL_WORKERS, history_size=HISTORY_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, flush_bytes=DEFAULT_FLUSH_BYTES,
+                 transfer_window=TRANSFER_WINDOW, compression=COMPRESSION_TEXT, heartbeat_interval=HEARTBEAT_INTERVAL,
+                 heartbeat_timeout=HEARTBEAT_TIMEOUT, idle_timeout=IDLE_TIMEOUT, io_workers=IO_WORKERS,
+                 max_connections=MAX_CONNECTIONS, accept_rate=ACCEPT_RATE, message_rate=MESSAGE_RATE,
+                 message_burst=MESSAGE_BURST, upload_rate=UPLOAD_RATE, stats_interval=0, metrics_port=0, reuse_port=False, bus_path=None,
+                 reload_path=None, takeover=False):
+        self.clients = []  # 접속된 클라이언트 연결(ClientConnection) 목록
+        self.rooms = RoomIndex()  # 방 이름 -> 참여 연결 (브로드캐스트는 보낸 사람의 방에만)
+        self.history = MessageHistory(os.path.join(storage_dir, 'history'), history_size)  # 방별 최근 대화
+        self.history_lock = Lock()  # 기록 추가와 입장 시 기록 전송의 순서를 맞춤
+        self.typing = TypingTracker()  # 방별 입력 중 상태 (TYPING_TICK마다 바뀐 방에만 알림)
+        self.presence = PresenceDirectory()  # 사용자 이름 -> 연결 (DM 전달과 접속자 목록)
+        self.presence_lock = Lock()  # 접속자 목록 스냅샷과 ONLINE/OFFLINE 알림의 순서를 맞춤
+        self.store = BlobStore(storage_dir)  # 업로드 파일 저장소 (내용 해시 기준, 중복 저장 없음)
+        self.disk = DiskPool(io_workers)  # 업로드 본문을 디스크에 쓰는 I/O 스레드들 (수신 스레드는 큐에 넣기만 함)
+        self.thumbnails = ThumbnailCache(os.path.join(storage_dir, 'thumbs'))  # 내용 해시 -> 미리보기
+        self.thumbnail_pool = create_thumbnail_pool(thumbnail_workers)  # 미리보기 생성용 프로세스 풀
+        self.clients_lock = Lock()  # 여러 수신 스레드가 clients 목록을 함께 수정하므로 보호
+        self.queue_size = queue_size  # 연결마다 송신 큐에 쌓을 수 있는 메시지 수
+        self.overflow_policy = overflow_policy  # 송신 큐가 가득 찼을 때의 처리 방식
+        self.flush_interval = flush_interval  # 작은 프레임을 모아서 쓰는 시간(초)
+        self.flush_bytes = flush_bytes  # 모은 크기가 이만큼 되면 바로 씀 (0 이하면 묶지 않음)
+        self.write_stats = WriteStats()  # 모든 연결의 송신 메시지 수 / 소켓 쓰기 수
+        self.transfer_window = transfer_window  # 업로드 크레딧과 이미지 중계 창의 크기(바이트)
+        self.compression = compression  # 클라이언트가 제안하면 허용할 압축 (off, text, files)
+        self.reaper = Reaper(heartbeat_interval, heartbeat_timeout, idle_timeout)  # PING을 보내고 응답 없는 연결을 정리
+        self.stats_interval = stats_interval  # 송신 통계를 출력하는 간격(초). 0이면 출력하지 않음
+        self.metrics = ServerMetrics()  # 명령별 메시지 수, 전송/브로드캐스트 지연 시간 등
+        # 동시 접속 수와 초당 새 연결 수 제한, 연결마다 붙이는 메시지/업로드 속도 제한
+        self.admission = AdmissionControl(max_connections, accept_rate, message_rate, message_burst, upload_rate,
+                                          observer=self.metrics.count_throttled)
+        self.reloading = False  # 새 프로세스로 연결을 넘기는 중이면 True (새 연결을 받지 않고 연결 점검도 쉼)
+        self.parked = set()  # 재시작 중 RELOAD_OK까지 읽고 수신을 멈춘 연결 (새 프로세스로 넘길 것)
+        self.accept_lock = Lock()  # 수락한 연결을 마저 추가하기 전에 넘기기 시작하지 않도록
+        self.wakeup_r, self.wakeup_w = os.pipe()  # 재시작할 때 연결을 기다리는 수락 스레드들을 깨움
+        self.ip = '' # 모든 IP로부터 연결을 허용
+        self.port = port  # 서버 포트 번호
+        handed = []
+        if takeover: # 실행 중인 서버의 리스닝 소켓과 연결들을 넘겨받음 (포트를 다시 바인딩하지 않음)
+            self.listeners, handed = request_handoff(reload_path)
+        else:
+            self.s_sock = socket(AF_INET, SOCK_STREAM) # TCP 소켓 생성
+            self.s_sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1) # 소켓 재사용 옵션 설정
+            if reuse_port: # 멀티 프로세스 모드: 여러 워커가 같은 포트에 바인딩
+                self.s_sock.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+            self.s_sock.bind((self.ip, self.port)) # IP와 포트를 소켓에 바인딩
+            self.s_sock.listen(100) # 최대 100명의 클라이언트 연결 허용
+            self.listeners = [self.s_sock]
+        # 멀티 프로세스 모드에서 다른 워커의 클라이언트와 메시지를 주고받는 버스 (단일 프로세스면 None)
+        self.bus = BusClient(bus_path, self.receive_bus) if bus_path else None
+        print("클라이언트 대기 중 ..." if self.bus is None else f"클라이언트 대기 중 ... (워커 {os.getpid()})")
+        Thread(target=self.typing_loop, daemon=True).start() # 타이핑 상태를 모아 보내는 스레드
+        if self.reaper.enabled: # 조용한 연결에 PING을 보내고 응답 없는 연결을 닫는 스레드
+            Thread(target=self.reap_loop, daemon=True).start()
+        if metrics_port: # 계측 값을 Prometheus 텍스트로 읽어 갈 로컬 HTTP 포트
+            serve_metrics(metrics_port, self.render_metrics)
+        if self.stats_interval > 0:
+            Thread(target=self.stats_loop, daemon=True).start()
+        for c_socket, state in handed: # 넘겨받은 연결은 방, 이름, 압축을 되살려 이어서 처리
+            c_socket.setblocking(True) # asyncio 서버에서 넘어온 소켓은 논블로킹
+            self.add_client(c_socket, tuple(state['addr']), state)
+        if reload_path: # 다음 재시작 요청을 기다리는 스레드
+            Thread(target=self.reload_loop, args=(listen_reload(reload_path),), daemon=True).start()
+        for listener in self.listeners[1:]: # 넘겨받은 리스닝 소켓이 여럿이면 (IPv4/IPv6) 소켓마다 수락 스레드
+            Thread(target=self.accept_client, args=(listener,), daemon=True).start()
+        self.accept_client(self.listeners[0]) # 클라이언트 연결을 수락하는 메서드 호출
+
+    def accept_client(self, listener):
+        """클라이언트의 연결을 수락하고, 각 클라이언트와 통신할 스레드를 생성합니다.
+
+        재시작이 시작되면 더 받지 않고 돌아갑니다. 기다리던 연결은 커널 대기열에 남아 새 프로세스가 받습니다.
+        """
+        listener.setblocking(True)
+        while True:
+            select([listener, self.wakeup_r], [], []) # 연결이 오거나 재시작으로 깨울 때까지 대기
+            with self.accept_lock:
+                if self.reloading:
+                    return
+                c_socket, addr = listener.accept() # 클라이언트 연결 수락
+                refusal = self.admission.admit(len(self.clients)) # 접속 수나 수락 속도 제한에 걸리면 바로 닫음
+                if refusal is not None:
+                    self.reject_client(c_socket, refusal)
+                    continue
+                self.add_client(c_socket, addr)
+
+    def reject_client(self, c_socket, refusal):
+        """받지 않을 연결에 THROTTLED 프레임을 보내고 닫습니다. 송신 큐와 스레드는 만들지 않음."""
+        try:
+            c_socket.setblocking(False) # 새 연결의 송신 버퍼는 비어 있으므로 짧은 프레임 하나는 바로 들어감
+            c_socket.send(refusal)
+            c_socket.shutdown(SHUT_WR)
+        except OSError:
+            pass
+        c_socket.close()
+
+    def add_client(self, c_socket, addr, state=None):
+        """연결을 clients 목록에 추가하고 통신할 스레드를 생성합니다. state는 이전 프로세스에서 넘겨받은 연결의 상태."""
+        if state is None:
+            set_keepalive(c_socket, self.reaper.timeout) # 상대가 사라진 연결을 커널도 알아채도록
+        else: # 송신 스레드가 생기기 전에 압축하지 않고 보냄. 클라이언트는 이것을 받고 새 압축 스트림으로 보내기 시작
+            c_socket.sendall(text_frame("RELOADED"))
+        conn = ClientConnection(c_socket, addr, self.queue_size, self.overflow_policy, # 송신 큐와 송신 스레드 생성
+                                flush_interval=self.flush_interval, flush_bytes=self.flush_bytes,
+                                stats=self.write_stats)
+        # 업로드 본문을 읽은 만큼 CREDIT으로 허락 (업로드 속도 제한을 넘으면 늦게 읽음)
+        conn.credit = UploadCredit(conn, self.transfer_window, self.admission.upload_limit())
+        conn.message_limit = self.admission.message_limit()
+        with self.clients_lock:
+            self.clients.append(conn) # 새로운 클라이언트 추가
+        if state is None:
+            self.enter_room(conn, DEFAULT_ROOM) # 처음에는 기본 방에 입장 (최근 대화도 함께 전송)
+            print(addr[0], ':', str(addr[1]), '가 연결되었습니다.')
+        else:
+            self.restore_client(conn, state)
+        cth = Thread(target=self.receive_messages, args=(conn,)) # 클라이언트와 통신할 스레드 생성
+        cth.start() # 스레드 시작
+
+    def restore_client(self, conn, state):
+        """넘겨받은 연결의 압축, 업로드 제안, 방, 이름을 되살립니다. 다른 클라이언트에게는 다시 알리지 않음."""
+        self.enable_compression(conn, state['compression'])
+        if state.get('streams'): # 다중화는 이전 버전의 스냅샷에는 없음
+            conn.multiplexed = True
+            set_stream_lowat(conn.sock)
+        conn.offers.update(state['offers'])
+        if state['room'] is not None:
+            self.rooms.join(conn, state['room'])
+        if state['name'] is not None:
+            self.presence.register(conn, state['name'])
+
+    def remove_client(self, conn):
+        """연결을 닫고 clients 목록에서 제거합니다."""
+        conn.close()
+        if conn.deflater is not None:
+            print(f"{conn.addr} 압축: {conn.compression.summary()}")
+        self.stop_typing(conn) # 입력 중으로 남아 있지 않도록
+        self.rooms.leave(conn)
+        self.leave_presence(conn)
+        with self.clients_lock:
+            if conn in self.clients:
+                self.clients.remove(conn)
+
+    def receive_messages(self, conn):
+        while not conn.closed:
+            try:
+                conn.liveness.handling = False # 다음 명령을 기다리는 동안은 하트비트 점검 대상
+                frame = read_frame(conn.inbound) # 프레임 하나를 헤더의 길이만큼 정확히 수신 (압축된 프레임은 풀어서)
+                if frame is None: # 클라이언트 연결이 끊어졌다면
+                    break
+                ftype, payload = frame
+                if ftype == FRAME_STREAM: # 다중화된 업로드 조각은 그 스트림을 받는 스레드에 넘기고 바로 다음 프레임으로
+                    conn.liveness.streamed()
+                    conn.bytes_in += HEADER.size + len(payload) # 본문을 읽는 스트림 스레드는 세지 않음
+                    conn.streams.feed(payload)
+                    continue
+                if ftype != FRAME_TEXT: # 명령/채팅이 아닌 프레임은 전송 중이 아닐 때 올 수 없음
+                    raise ProtocolError(f"예상하지 못한 프레임 타입: {ftype}")
+                incoming_message = payload.decode('utf-8') # UTF-8 디코딩
+                conn.bytes_in += HEADER.size + len(payload)
+                conn.liveness.received(incoming_message) # 받은 시각 기록 (명령을 처리하는 동안은 점검하지 않음)
+                self.metrics.count_command(incoming_message) # 명령 종류별 메시지 수
+                delay = self.throttle_message(conn, incoming_message)
+                if delay is None: # 속도 제한을 넘은 메시지는 처리하지 않음
+                    continue
+                if delay and not incoming_message.startswith("STREAM:"): # 본문이 이 연결로 곧바로 뒤따르는 업로드
+                    time.sleep(delay)
+                # 이미지 전송 요청 처리
+                if incoming_message.startswith("IMAGE:"):
+                    filename = incoming_message[6:]
+                    self.receive_image(conn, filename)
+                # 원본 이미지 요청 처리 ("IMAGE_FETCH:해시")
+                elif incoming_message.startswith("IMAGE_FETCH:"):
+                    self.send_image(conn, incoming_message[12:])
+                # 파일 업로드 제안 처리 ("FILE_OFFER:해시:크기:파일명")
+                elif incoming_message.startswith("FILE_OFFER:"):
+                    digest, size, filename = incoming_message[11:].split(":", 2)
+                    self.offer_file(conn, filename, digest, int(size))
+                # 변경분 업로드 제안 처리 ("DELTA_OFFER:해시:크기:파일명", 이전 내용이 없으면 FILE_OFFER와 같음)
+                elif incoming_message.startswith("DELTA_OFFER:"):
+                    digest, size, filename = incoming_message[12:].split(":", 2)
+                    self.offer_delta(conn, filename, digest, int(size))
+                # 끊긴 업로드 이어서 올리기 요청 ("FILE_RESUME:전송id")
+                elif incoming_message.startswith("FILE_RESUME:"):
+                    self.resume_file(conn, incoming_message[12:])
+                # 이어받기 업로드 본문 ("FILE_CHUNKS:전송id:위치" 뒤에 CHUNK 프레임들)
+                elif incoming_message.startswith("FILE_CHUNKS:"):
+                    transfer_id, offset = incoming_message[12:].split(":")
+                    self.receive_chunks(conn, transfer_id, int(offset))
+                # 변경분 업로드 본문 ("FILE_DELTA:이전해시:해시:크기:파일명" 뒤에 명령 DATA 프레임들)
+                elif incoming_message.startswith("FILE_DELTA:"):
+                    base, digest, size, filename = incoming_message[11:].split(":", 3)
+                    self.receive_delta(conn, base, digest, int(size), filename)
+                # 파일 전송 요청 처리 (위치/체크섬 없이 한 번에 올리는 방식)
+                elif incoming_message.startswith("FILE:"):
+                    filename = incoming_message[5:] # "FILE:" 이후의 파일명 추출
+                    self.receive_file(conn, filename) # 파일 수신 시작
+                # 파일 다운로드 요청 처리
+                elif incoming_message.startswith("DOWNLOAD:"):
+                    filename = incoming_message[9:] # "DOWNLOAD:" 이후의 파일명 추출
+                    self.send_file(conn, filename) # 파일 전송 시작
+                # 끊긴 다운로드 이어받기 요청 ("DOWNLOAD_RESUME:해시:위치:파일명")
+                elif incoming_message.startswith("DOWNLOAD_RESUME:"):
+                    digest, offset, filename = incoming_message[16:].split(":", 2)
+                    self.send_file(conn, filename, digest, int(offset))
+                # 병렬 다운로드 준비: 내용 해시와 크기만 알려 줌 ("DOWNLOAD_INFO:파일명")
+                elif incoming_message.startswith("DOWNLOAD_INFO:"):
+                    self.send_file_info(conn, incoming_message[14:])
+                # 병렬 다운로드의 구간 하나 ("DOWNLOAD_RANGE:해시:위치:길이", 보조 연결에서)
+                elif incoming_message.startswith("DOWNLOAD_RANGE:"):
+                    digest, offset, length = incoming_message[15:].split(":")
+                    self.send_range(conn, digest, int(offset), int(length))
+                # 구간 다운로드 전용 보조 연결: 방에서 빼서 채팅과 방 기록을 보내지 않음
+                elif incoming_message == "RANGES":
+                    self.rooms.leave(conn)
+                # 타이핑 상태 처리 (바로 중계하지 않고 모아 두었다가 TYPING_TICK마다 TYPING_STATE로 알림)
+                elif incoming_message.startswith(("TYPING:", "TYPING_STOP:")):
+                    self.update_typing(conn, incoming_message)
+                # 방 입장/퇴장 ("JOIN:방이름", "LEAVE"는 기본 방으로 돌아감)
+                elif incoming_message.startswith("JOIN:"):
+                    self.join_room(conn, incoming_message[5:])
+                elif incoming_message == "LEAVE":
+                    self.join_room(conn, DEFAULT_ROOM)
+                # 관리 명령: 계측 값 조회 (같은 컴퓨터에서 접속한 경우만)
+                elif incoming_message == "METRICS":
+                    self.send_metrics(conn)
+                # 압축 협상 ("COMPRESS:deflate,files", 접속 직후 한 번)
+                elif incoming_message.startswith("COMPRESS:"):
+                    self.negotiate_compression(conn, incoming_message[9:])
+                # 다중화 협상 (이후 본문은 STREAM 프레임으로 채팅과 번갈아 주고받음)
+                elif incoming_message == "STREAMS":
+                    self.enable_streams(conn)
+                # 다중화된 업로드 ("STREAM:스트림id:IMAGE:..." 등). 본문은 스트림마다 따로 스레드가 받음
+                elif incoming_message.startswith("STREAM:"):
+                    sid, command = incoming_message[7:].split(":", 1)
+                    self.open_stream(conn, int(sid), command, delay)
+                # PING에 대한 응답 (받은 시각은 위에서 기록함)
+                elif incoming_message.startswith("PONG:"):
+                    pass
+                # 이름 등록 ("NAME:이름"). 접속자 목록은 USERS 하나로 받고, 다른 클라이언트에게는 ONLINE으로 알림
+                elif incoming_message.startswith("NAME:"):
+                    self.register_name(conn, incoming_message[5:])
+                # 접속자 목록 요청
+                elif incoming_message == "USERS":
+                    conn.send(text_frame(users_message(self.presence.online())), wait=True)
+                # 개인 메시지 ("DM:받는 사람:내용")는 받는 사람의 연결에만 보냄
+                elif incoming_message.startswith("DM:"):
+                    target, text = incoming_message[3:].split(":", 1)
+                    self.send_direct(conn, target, text)
+                # 재시작: 클라이언트가 보내던 것을 마치고 멈춤. 새 프로세스로 넘길 연결이므로 정리하지 않고 수신만 끝냄
+                elif incoming_message == "RELOAD_OK":
+                    if self.reloading:
+                        self.parked.add(conn)
+                        return
+                # 일반 메시지 처리
+                else:
+                    self.broadcast_message(conn, incoming_message) # 일반 메시지를 브로드캐스트
+            except (ConnectionError, OSError): # 프레임 도중에 연결이 끊어졌거나 소켓이 닫혔다면
+                break
+            except ProtocolError as e: # 프레임 경계를 잃었으므로 계속 읽지 않고 연결을 끊음
+                print(f"{conn.addr} 규약 오류로 연결을 끊습니다: {e}")
+                break
+            except Exception as e:
+                print(f"오류 발생: {e}")
+                continue
+        self.remove_client(conn)
+
+    def throttle_message(self, conn, message):
+        """메시지 속도 제한을 적용해 처리하기 전에 기다릴 시간(초)을 돌려줍니다. 처리하지 않을 메시지면 None.
+
+        채팅은 제한을 넘으면 버리고, 제한에 걸리기 시작할 때 한 번만 "THROTTLED:messages:밀리초"로 알립니다.
+        답을 기다리는 명령은 버리는 대신 "THROTTLED:messages:밀리초:명령"으로 답해 클라이언트가 다시 보내게 합니다.
+        본문이 뒤따르는 명령은 버리면 다음 본문 프레임에서 연결이 끊기므로, 토큰을 빚으로 꺼내고 그만큼 늦게 처리합니다.
+        기다리는 일은 부르는 쪽이 명령마다 합니다. (다중화된 업로드는 그 스트림을 받는 스레드에서)
+        """
+        if conn.message_limit is None or message.startswith(UNTHROTTLED_COMMANDS):
+            return 0
+        if message.startswith(BODY_COMMANDS):
+            delay, notice = conn.message_limit.charge(1)
+        else:
+            delay, notice = conn.message_limit.take()
+            if delay > 0 and message.startswith(REPLY_COMMANDS):
+                conn.send(throttled_message(THROTTLE_MESSAGES, delay, message), wait=True)
+                return None
+        if notice is not None:
+            conn.send(notice, droppable=True)
+        if delay > 0 and not message.startswith(BODY_COMMANDS):
+            return None
+        return delay
+
+    def receive_image(self, conn, filename, inbound=None):
+        """이미지를 저장하고, 미리보기를 한 번만 만들어 다른 클라이언트들에게 보냅니다.
+
+        inbound는 본문을 읽을 곳입니다. (다중화된 업로드면 그 스트림, 아니면 연결)
+        """
+        inbound = conn.inbound if inbound is None else inbound
+        if self.thumbnail_pool is None: # 미리보기를 만들 수 없으면 원본을 그대로 중계
+            self.relay_image(conn, filename, inbound)
+            return
+        writer = self.store.open_writer()
+        channel = self.disk.channel() # 파일 쓰기와 해시 계산은 I/O 스레드가 맡음
+        try:
+            with self.metrics.transfer('upload'):
+                for data in iter_body(inbound, conn.credit):
+                    if inbound is conn.inbound: # 스트림 조각은 수신 스레드가 STREAM 프레임을 받을 때 셈
+                        conn.bytes_in += len(data)
+                    channel.write(writer.write, data)
+            digest = channel.call(writer.commit) # 디스크에 기록한 뒤 내용 경로로 옮김
+            channel.call(self.store.link, filename, digest)
+        except BaseException:
+            channel.wait()
+            writer.abort()
+            raise
+        room = conn.room # 미리보기가 나오기 전에 업로더가 방을 옮겨도 올린 방에 보냄
+        thumbnail = self.thumbnails.get(digest) # 같은 이미지를 전에 받은 적이 있으면 캐시 사용
+        if thumbnail is not None:
+            self.broadcast_thumbnail(conn, room, digest, filename, thumbnail)
+            return
+        future = self.thumbnail_pool.submit(make_thumbnail, self.store.path_for(digest))
+
+        def done(future):
+            """프로세스 풀의 결과를 받는 스레드에서 호출됩니다."""
+            try:
+                thumbnail = future.result()
+            except Exception as e: # 이미지가 아니거나 손상된 파일
+                print(f"{filename} 미리보기 생성 실패: {e}")
+                self.broadcast_message(conn, f"NEW_FILE:{filename}", room=room) # 일반 파일처럼 다운로드할 수 있게 알림
+                return
+            self.thumbnails.put(digest, thumbnail)
+            self.broadcast_thumbnail(conn, room, digest, filename, thumbnail)
+        future.add_done_callback(done) # 업로더의 수신 스레드는 기다리지 않고 다음 메시지를 처리
+
+    def broadcast_thumbnail(self, senders_conn, room, digest, filename, thumbnail):
+        """미리보기와 이미지 id(해시)를 업로더를 제외한 방 참여자들에게 보냅니다."""
+        message = text_frame(f"IMAGE_THUMB:{digest}:{filename}") + b"".join(iter_bytes_frames(thumbnail))
+        self.publish(senders_conn, message, room=room)
+
+    def send_image(self, conn, digest):
+        """미리보기를 클릭한 클라이언트에게 원본 이미지를 보냅니다. (해시는 저장소에서 찾기 전에 형식부터 확인)"""
+        if not valid_digest(digest) or not self.store.has(digest):
+            conn.send(text_frame("FILE_NOT_FOUND"), wait=True)
+            return
+        self.send_path(conn, f"IMAGE_FULL:{digest}", self.store.path_for(digest), digest[:12])
+
+    def relay_image(self, conn, filename, inbound):
+        """클라이언트로부터 이미지를 수신하면서 받은 조각을 곧바로 다른 클라이언트들에게 중계"""
+        # 업로더는 이미지를 이미 가지고 있으므로 제외합니다.
+        # 각 수신자의 송신 큐에는 중계 작업 하나만 들어가므로 이미지 중간에 다른 메시지가 끼지 않습니다.
+        # 창이 가득 차면 push가 기다리고, 그동안 본문을 읽지 않으므로 업로더의 크레딧도 늘지 않습니다.
+        relay = StreamRelay(self.transfer_window, name=filename)
+        room = conn.room
+        for client in self.rooms.members(room): # 업로더와 같은 방의 참여자에게만 중계
+            if client is not conn:
+                relay.add_reader(client)
+                if not client.send(relay.reader(client)):
+                    relay.remove_reader(client)
+        # 다른 워커의 클라이언트에게는 본문을 모아 두지 않고 저장소에 쓴 뒤 파일 참조만 버스로 알림
+        spool = self.store.open_writer() if self.bus else None
+        channel = self.disk.channel()
+        header = f"IMAGE_START:{filename}"
+        try:
+            relay.push(text_frame(header))
+            for data in iter_body(inbound, conn.credit): # DATA 프레임을 받는 즉시 창(window)에 추가
+                if inbound is conn.inbound:
+                    conn.bytes_in += len(data)
+                relay.push(encode_frame(FRAME_DATA, data))
+                if spool is not None:
+                    channel.write(spool.write, data)
+        except BaseException:
+            if spool is not None:
+                channel.wait()
+                spool.abort()
+            raise
+        finally:
+            relay.push(end_frame()) # 업로드가 중간에 끊겨도 수신자의 프레임 흐름은 닫아 줌
+            relay.finish()
+        if spool is not None:
+            digest = channel.call(spool.commit) # 다른 워커가 읽기 전에 디스크에 기록
+            self.bus.publish(f"{digest}:{header}".encode('utf-8'), room=room, blob=True)
+
+    def offer_file(self, conn, filename, digest, size):
+        """업로드 전에 해시를 확인해, 이미 가진 내용이면 본문을 받지 않고 파일명만 연결합니다.
+
+        없는 내용이면 staging에 업로드를 만들고(같은 내용을 받다가 끊긴 것이 있으면 재사용)
+        "FILE_ACCEPT:전송id:위치:파일명"으로 어디서부터 보내면 되는지 알려 줍니다.
+        해시 형식이 아니면(저장소 밖 경로 등) "FILE_FAILED:파일명"으로 거절합니다.
+        """
+        if not valid_digest(digest):
+            conn.send(text_frame(f"FILE_FAILED:{filename}"), wait=True)
+            return
+        if self.store.has(digest):
+            self.store.link(filename, digest)
+            conn.send(text_frame(f"FILE_EXISTS:{filename}"), wait=True) # 본문을 보낼 필요 없음
+            print(f"{filename} 파일은 이미 저장되어 있어 전송을 생략했습니다.")
+            self.broadcast_message(conn, f"NEW_FILE:{filename}")
+        else:
+            conn.offers[filename] = digest # "FILE:파일명" 방식으로 올릴 때 본문의 해시를 검증할 때 사용
+            upload = self.store.staging.begin(digest, size, filename)
+            self.accept_chunks(conn, upload)
+
+    def offer_delta(self, conn, filename, digest, size):
+        """offer_file과 같되, 같은 이름의 이전 내용이 있으면 그 블록 서명을 보내 바뀐 블록만 받습니다. (chat_delta)"""
+        if not valid_digest(digest):
+            conn.send(text_frame(f"FILE_FAILED:{filename}"), wait=True)
+            return
+        base = self.delta_base(filename, digest, size)
+        if base is None:
+            self.offer_file(conn, filename, digest, size)
+            return
+        path = self.store.signatures(base) # 처음 한 번만 이전 내용을 읽어 .sig 파일로 저장함
+        self.send_path(conn, f"DELTA_BASE:{base}:{DELTA_BLOCK_SIZE}:{filename}", path, f"{filename} 블록 서명")
+
+    def delta_base(self, filename, digest, size):
+        """변경분 업로드의 기준이 될 이전 내용의 해시. 같은 내용이 이미 있거나 둘 중 하나가 작으면 None."""
+        base = self.store.lookup(filename)
+        if base is None or base == digest or size < DELTA_MIN_SIZE or self.store.has(digest):
+            return None
+        if not valid_digest(base): # 색인에 잘못 들어간 해시로는 저장소 밖 파일을 읽지 않음
+            return None
+        try:
+            if os.path.getsize(self.store.path_for(base)) < DELTA_MIN_SIZE:
+                return None
+        except FileNotFoundError:
+            return None
+        return base
+
+    def accept_chunks(self, conn, upload):
+        """업로더에게 받을 준비가 된 위치를 알려 줍니다."""
+        conn.send(text_frame(f"FILE_ACCEPT:{upload.transfer_id}:{upload.offset}:{upload.name}"), wait=True)
+
+    def resume_file(self, conn, transfer_id):
+        """다시 접속한 클라이언트가 끊긴 업로드를 이어서 올리려고 할 때 현재 위치를 알려 줍니다."""
+        upload = self.store.staging.get(transfer_id)
+        if upload is None: # 이미 끝났거나 서버가 모르는 전송 (처음부터 FILE_OFFER로 다시 시작)
+            conn.send(text_frame(f"FILE_UNKNOWN:{transfer_id}"), wait=True)
+        else:
+            self.accept_chunks(conn, upload)
+
+    def receive_chunks(self, conn, transfer_id, offset, inbound=None):
+        """CHUNK 프레임들을 검증하며 staging 파일 끝에 이어 붙이고, 다 받으면 저장소로 옮깁니다.
+
+        체크섬이 틀리거나 위치가 맞지 않으면 남은 본문은 버리고 마지막으로 제대로 받은 위치를 다시 알려 줍니다.
+        """
+        inbound = conn.inbound if inbound is None else inbound
+        staging = self.store.staging
+        upload = staging.get(transfer_id)
+        if upload is None:
+            skip_body(inbound, conn.credit)
+            conn.send(text_frame(f"FILE_UNKNOWN:{transfer_id}"), wait=True)
+            return
+        if not staging.claim(upload): # 같은 내용을 다른 연결이 올리고 있음
+            skip_body(inbound, conn.credit)
+            conn.send(text_frame(f"FILE_BUSY:{transfer_id}"), wait=True)
+            return
+        channel = self.disk.channel() # staging 파일 쓰기는 I/O 스레드가 맡음
+        try:
+            with self.metrics.transfer('upload'), open(upload.path, "ab") as f:
+                try:
+                    position = upload.offset # 다음에 받을 위치 (쓰기가 밀려 있어도 받은 만큼 앞으로)
+                    if offset != position:
+                        raise ChecksumError(offset)
+                    for chunk_offset, data in iter_chunks(inbound, conn.credit):
+                        if chunk_offset != position: # 중간 조각이 빠졌음
+                            raise ChecksumError(chunk_offset)
+                        if inbound is conn.inbound:
+                            conn.bytes_in += len(data)
+                        position += len(data)
+                        channel.write(f.write, data)
+                    channel.call(f.flush) # 연결이 끊겨도 받은 만큼은 staging 파일에 남도록
+                except ChecksumError as e:
+                    skip_body(inbound, conn.credit)
+                    channel.call(f.flush) # 받은 조각을 모두 쓴 뒤의 위치를 알려 줌
+                    print(f"{upload.name} 업로드 {e} {upload.offset} 위치부터 다시 받습니다.")
+                    self.accept_chunks(conn, upload)
+                    return
+                finally:
+                    channel.wait() # 밀린 쓰기가 끝난 뒤에 파일을 닫음
+        finally:
+            staging.release(upload)
+        if not upload.complete: # 클라이언트가 나머지를 다음 FILE_CHUNKS로 보냄
+            return
+        try:
+            # 전체 해시 확인, fsync 후 내용 경로로 옮김 (다 쓰고 디스크에 기록된 뒤에만 NEW_FILE을 알림)
+            digest = channel.call(staging.finish, upload, self.store)
+            channel.call(self.store.link, upload.name, digest)
+        except ValueError as e:
+            print(f"파일 수신 중 오류 발생: {e}")
+            conn.send(text_frame(f"FILE_FAILED:{upload.name}"), wait=True)
+            return
+        print(f"{upload.name} 파일이 저장되었습니다. ({digest[:12]})")
+        conn.send(text_frame(f"FILE_STORED:{transfer_id}:{upload.name}"), wait=True)
+        self.broadcast_message(conn, f"NEW_FILE:{upload.name}") # 새로운 파일이 생성되었음을 알림
+
+    def receive_delta(self, conn, base, digest, size, filename, inbound=None):
+        """이전 내용 base에 받은 변경분 명령을 적용해 새 내용을 만들고, 해시가 맞으면 filename으로 저장합니다.
+
+        명령의 적용(이전 내용 복사와 쓰기)은 I/O 스레드가 맡습니다. 해시가 맞지 않거나 이전 내용이 없으면
+        "DELTA_FAILED:파일명"으로 알리고, 클라이언트는 FILE_OFFER로 처음부터 다시 올립니다.
+        두 해시 중 하나라도 형식이 맞지 않아도 본문을 버리고 DELTA_FAILED로 답합니다.
+        """
+        inbound = conn.inbound if inbound is None else inbound
+        base_file = None
+        if valid_digest(base) and valid_digest(digest):
+            try:
+                base_file = open(self.store.path_for(base), "rb")
+            except FileNotFoundError:
+                pass
+        if base_file is None:
+            skip_body(inbound, conn.credit)
+            conn.send(text_frame(f"DELTA_FAILED:{filename}"), wait=True)
+            return
+        received = 0 # 실제로 받은 명령 바이트 수
+        writer = self.store.open_writer()
+        channel = self.disk.channel()
+        try:
+            with self.metrics.transfer('upload'), base_file:
+                patcher = DeltaPatcher(base_file, os.fstat(base_file.fileno()).st_size, writer)
+                try:
+                    for payload in iter_body(inbound, conn.credit):
+                        patcher.check(payload)
+                        if inbound is conn.inbound:
+                            conn.bytes_in += len(payload)
+                        received += len(payload)
+                        channel.write(patcher.apply, payload)
+                    # 밀린 명령을 마치고 전체 해시 확인, fsync 후 내용 경로로 옮김
+                    digest = channel.call(writer.commit, digest)
+                    channel.call(self.store.link, filename, digest)
+                finally:
+                    channel.wait() # 이전 내용 파일을 닫기 전에 복사를 마침
+        except ValueError as e:
+            print(f"변경분 업로드 중 오류 발생: {e}")
+            conn.send(text_frame(f"DELTA_FAILED:{filename}"), wait=True)
+            return
+        except BaseException:
+            writer.abort()
+            raise
+        saved = writer.size - received
+        self.metrics.count_delta(received, saved)
+        print(f"{filename} 파일을 변경분으로 저장했습니다. ({digest[:12]}, {received} 바이트 수신, {saved} 바이트 절약)")
+        conn.send(text_frame(f"DELTA_STORED:{received}:{saved}:{filename}"), wait=True)
+        self.broadcast_message(conn, f"NEW_FILE:{filename}") # 새로운 파일이 생성되었음을 알림
+
+    def receive_file(self, conn, filename, inbound=None):
+        """"FILE:파일명" 뒤의 본문을 저장합니다. 해시가 맞지 않거나 디스크 오류가 나면 알리기만 하고 연결은 유지하고,
+        프레임이 잘못되었으면(ProtocolError) 본문의 경계를 잃었으므로 그대로 올려 보내 연결을 끊게 합니다.
+        """
+        inbound = conn.inbound if inbound is None else inbound
+        try:
+            writer = self.store.open_writer() # 임시 파일에 쓰면서 해시 계산
+            channel = self.disk.channel() # 쓰기는 I/O 스레드가 맡고 이 스레드는 소켓 읽기만 함
+            try:
+                with self.metrics.transfer('upload'):
+                    for data in iter_body(inbound, conn.credit): # END 프레임이 올 때까지 DATA 프레임 수신
+                        if inbound is conn.inbound:
+                            conn.bytes_in += len(data)
+                        channel.write(writer.write, data)
+                # 밀린 쓰기를 마치고 fsync한 뒤 내용 경로로 옮김 (같은 내용이면 버림)
+                digest = channel.call(writer.commit, conn.offers.pop(filename, None))
+                channel.call(self.store.link, filename, digest)
+            except BaseException:
+                channel.wait()
+                writer.abort()
+                raise
+            print(f"{filename} 파일이 저장되었습니다. ({digest[:12]})")
+            self.broadcast_message(conn, f"NEW_FILE:{filename}") # 새로운 파일이 생성되었음을 알림
+        except ConnectionError:
+            raise
+        except (ValueError, OSError) as e: # 해시 불일치, 디스크 오류
+            print(f"파일 수신 중 오류 발생: {e}") # 오류 메시지 출력
+
+    def open_stream(self, conn, sid, command, delay=0):
+        """다중화된 업로드의 본문을 스트림마다 스레드 하나가 받게 하고, 수신 스레드는 곧바로 다음 프레임을 읽습니다."""
+        stream = conn.streams.open(sid)
+        Thread(target=self.receive_stream, args=(conn, sid, stream, command, delay), daemon=True).start()
+
+    def receive_stream(self, conn, sid, stream, command, delay=0):
+        """스트림 하나로 온 업로드 명령을 다중화하지 않은 업로드와 같은 메서드로 처리합니다. (본문만 stream에서 읽음)
+
+        delay는 속도 제한으로 늦출 시간입니다. 그동안 이 스트림의 조각은 버퍼에 쌓이고(크레딧이 양을 묶음)
+        다른 스트림과 채팅은 그대로 처리됩니다. 스트림의 프레임 경계를 잃으면 다른 스트림도 믿을 수 없으므로 연결을 끊습니다.
+        """
+        try:
+            if delay:
+                time.sleep(delay)
+            if command.startswith("IMAGE:"):
+                self.receive_image(conn, command[6:], stream)
+            elif command.startswith("FILE_CHUNKS:"):
+                transfer_id, offset = command[12:].split(":")
+                self.receive_chunks(conn, transfer_id, int(offset), stream)
+            elif command.startswith("FILE_DELTA:"):
+                base, digest, size, filename = command[11:].split(":", 3)
+                self.receive_delta(conn, base, digest, int(size), filename, stream)
+            elif command.startswith("FILE:"):
+                self.receive_file(conn, command[5:], stream)
+            else:
+                raise ProtocolError(f"스트림으로 받을 수 없는 명령: {command}")
+        except (ConnectionError, OSError):
+            conn.close()
+        except Exception as e:
+            print(f"{conn.addr} {sid}번 스트림 오류로 연결을 끊습니다: {e}")
+            conn.close()
+        finally:
+            conn.streams.finish(sid, stream)
+
+    def send_file(self, conn, filename, digest=None, offset=0):
+        """파일을 "FILE_START:해시:크기:위치:파일명" 뒤에 CHUNK 프레임들로 보냅니다.
+
+        이어받기 요청(digest, offset)은 파일명이 여전히 같은 내용을 가리킬 때만 그 위치부터 보냅니다.
+        이어받기 요청의 해시가 형식에 맞지 않으면 FILE_NOT_FOUND로 답합니다.
+        """
+        path = self.store.resolve(filename) # 파일명 색인으로 내용 파일 경로 찾기
+        if path is None or (digest is not None and not valid_digest(digest)): # 파일이 없거나 잘못된 해시
+            conn.send(text_frame("FILE_NOT_FOUND"), wait=True)
+            return
+        current = self.store.lookup(filename)
+        size = os.path.getsize(path)
+        if digest != current: # 그 사이 같은 이름으로 다른 내용이 올라왔으면 처음부터
+            offset = 0
+        offset = min(offset - offset % TRANSFER_CHUNK_SIZE, size) # 체크섬 조각 경계에 맞춤
+        deflater = conn.deflater if conn.deflater is not None and conn.deflater.body is not None else None
+        if deflater is not None and is_compressed_file(path):
+            deflater = None
+        if conn.multiplexed: # 송신 스레드가 채팅, 다른 전송과 조각씩 번갈아 보냄
+            checksums = self.store.checksums(current)
+            stats = TransferStats(filename)
+
+            def pieces():
+                with self.metrics.transfer('download'), open(path, "rb") as f:
+                    yield from file_chunk_pieces(f, checksums, offset)
+                stats.finish()
+                conn.bytes_out += stats.bytes_sent
+                print(f"{filename} 파일이 클라이언트에 전송되었습니다. ({offset} 위치부터, {stats.summary()})")
+            self.send_stream(conn, f"FILE_START:{current}:{size}:{offset}:{filename}",
+                             OutboundStream(pieces(), stats, compress=deflater is not None))
+            return
+
+        def transfer(c_socket):
+            """송신 스레드에서 실행됩니다. 전송 중에 다른 메시지가 끼어들지 않습니다."""
+            try:
+                checksums = self.store.checksums(current) # 처음 한 번만 계산되어 .crc 파일로 저장됨
+                stats = TransferStats(filename)
+                c_socket.sendall(text_frame(f"FILE_START:{current}:{size}:{offset}:{filename}"))
+                with self.metrics.transfer('download'), open(path, "rb") as f:
+                    if deflater is not None: # 파일 본문 압축을 협상했고 이미 압축된 형식이 아님
+                        send_file_chunks_deflated(c_socket, f, stats, checksums, offset, deflater)
+                    else:
+                        send_file_chunks(c_socket, f, stats, checksums, offset)
+                conn.bytes_out += stats.bytes_sent
+                print(f"{filename} 파일이 클라이언트에 전송되었습니다. ({offset} 위치부터, {stats.summary()})")
+            except OSError:
+                raise # 소켓 오류는 송신 스레드가 연결을 닫도록 전달
+            except Exception as e:
+                print(f"파일 전송 중 오류 발생: {e}")
+        conn.send(transfer, wait=True) # 요청한 클라이언트의 송신 큐에 파일 전송 작업 추가
+
+    def send_file_info(self, conn, filename):
+        """"FILE_INFO:해시:크기:파일명"으로 내려받을 내용을 알려 줍니다. 큰 파일은 클라이언트가 구간으로 나누어 받습니다."""
+        digest = self.store.lookup(filename)
+        if digest is None or not self.store.has(digest):
+            conn.send(text_frame("FILE_NOT_FOUND"), wait=True)
+            return
+        size = os.path.getsize(self.store.path_for(digest))
+        conn.send(text_frame(f"FILE_INFO:{digest}:{size}:{filename}"), wait=True)
+
+    def send_range(self, conn, digest, offset, length):
+        """내용 해시로 찾은 파일의 한 구간을 "RANGE_START:해시:위치:길이" 뒤에 CHUNK 프레임들로 보냅니다.
+
+        병렬 다운로드의 보조 연결들이 구간을 나누어 요청합니다. 구간의 양 끝은 체크섬 조각 경계로 맞추고,
+        본문은 압축하지 않고 sendfile로 보냅니다. 해시 형식이 아니면 저장소에서 찾지 않고 RANGE_NOT_FOUND로 답합니다.
+        """
+        if not valid_digest(digest) or not self.store.has(digest):
+            conn.send(text_frame(f"RANGE_NOT_FOUND:{digest}"), wait=True)
+            return
+        path = self.store.path_for(digest)
+        start, end = chunk_range(offset, length, os.path.getsize(path))
+
+        def transfer(c_socket):
+            """송신 스레드에서 실행됩니다."""
+            try:
+                checksums = self.store.checksums(digest)
+                stats = TransferStats(digest[:12])
+                c_socket.sendall(text_frame(f"RANGE_START:{digest}:{start}:{end - start}"))
+                with self.metrics.transfer('download'), open(path, "rb") as f:
+                    send_file_chunks(c_socket, f, stats, checksums, start, end)
+                conn.bytes_out += stats.bytes_sent
+            except OSError:
+                raise
+            except Exception as e:
+                print(f"파일 전송 중 오류 발생: {e}")
+        conn.send(transfer, wait=True)
+
+    def send_path(self, conn, header, path, filename, wait=True):
+        """header 메시지 뒤에 path 파일의 본문을 보내는 작업을 송신 큐에 넣습니다.
+
+        wait가 False면 다른 메시지처럼 송신 큐 정책을 따릅니다. (요청한 클라이언트가 아닌 수신자에게 보낼 때)
+        """
+        if conn.multiplexed:
+            stats = TransferStats(filename)
+
+            def pieces():
+                with self.metrics.transfer('download'), open(path, "rb") as f:
+                    yield from file_body_pieces(f)
+                stats.finish()
+                conn.bytes_out += stats.bytes_sent
+                print(f"{filename} 파일이 클라이언트에 전송되었습니다. ({stats.summary()})")
+            self.send_stream(conn, header, OutboundStream(pieces(), stats), wait=wait)
+            return
+
+        def transfer(c_socket):
+            """송신 스레드에서 실행됩니다. 전송 중에 다른 메시지가 끼어들지 않습니다."""
+            try:
+                stats = TransferStats(filename) # 전송 속도와 시스템 호출 수 기록
+                c_socket.sendall(text_frame(header)) # 파일 전송 시작 신호 전송
+                with self.metrics.transfer('download'), open(path, "rb") as f: # 파일을 바이너리 모드로 엽니다.
+                    send_file_body(c_socket, f, stats) # 본문은 sendfile로 커널에서 바로 전송
+                conn.bytes_out += stats.bytes_sent
+                print(f"{filename} 파일이 클라이언트에 전송되었습니다. ({stats.summary()})")
+            except OSError:
+                raise # 소켓 오류는 송신 스레드가 연결을 닫도록 전달
+            except Exception as e:
+                print(f"파일 전송 중 오류 발생: {e}")
+        conn.send(transfer, wait=wait) # 요청한 클라이언트의 송신 큐에 파일 전송 작업 추가
+
+    def send_stream(self, conn, header, stream, wait=True):
+        """"STREAM:스트림id:header"로 스트림을 열고, 본문을 보낼 OutboundStream을 송신 큐에 넣습니다."""
+        stream.sid = next(conn.stream_ids)
+        if conn.send(text_frame(f"STREAM:{stream.sid}:{header}"), wait=wait): # 헤더를 버렸으면 본문도 보내지 않음
+            conn.send(stream, wait=True)
+
+    def join_room(self, conn, room):
+        """conn을 room으로 옮기고 "JOINED:방이름"으로 알려 줍니다."""
+        if not valid_room_name(room):
+            conn.send(text_frame(f"JOIN_FAILED:{room}"), wait=True)
+            return
+        self.enter_room(conn, room)
+
+    def enter_room(self, conn, room):
+        """conn을 room에 넣고 "JOINED:방이름"과 최근 대화("HISTORY:개수" 뒤에 메시지들), 입력 중 상태를 한 번에 보냅니다."""
+        self.stop_typing(conn) # 이전 방에서 입력 중이었다면 지움
+        with self.history_lock: # 입장과 기록 사이에 온 메시지가 빠지거나 두 번 가지 않도록
+            self.rooms.join(conn, room)
+            count, frames = self.history.replay(room)
+            message = text_frame(f"JOINED:{room}")
+            if count:
+                message += text_frame(f"HISTORY:{count}") + frames
+            typers = self.typing.names(room)
+            if typers:
+                message += text_frame(typing_state_message(typers))
+            conn.send(message) # 송신 큐 항목 하나 = 소켓 쓰기 한 번
+
+    def broadcast_message(self, senders_conn, message, droppable=False, room=None):
+        """한 클라이언트가 보낸 메시지를 같은 방의 모든 클라이언트에게 브로드캐스트합니다.
+
+        타이핑 이벤트처럼 버려도 되는 메시지가 아니면 방 기록에도 남깁니다.
+        """
+        self.publish(senders_conn, text_frame(message), droppable, room, record=not droppable) # 한 번만 인코딩해 공유
+
+    def publish(self, senders_conn, data, droppable=False, room=None, record=False):
+        """인코딩된 프레임을 room(기본은 보낸 사람의 방)의 참여자들에게 보냅니다.
+
+        멀티 프로세스 모드라면 다른 워커들의 같은 방 참여자에게도 버스로 전달합니다.
+        """
+        room = room or senders_conn.room
+        if room is None: # 보낸 사람이 이미 연결을 끊었음
+            return
+        started = time.perf_counter()
+        self.deliver(data, droppable, room, record, exclude=senders_conn, persist=True)
+        if self.bus is not None:
+            self.bus.publish(data, droppable, room, record)
+        self.metrics.broadcast_latency.observe(time.perf_counter() - started) # 송신 큐에 다 넣기까지 걸린 시간
+
+    def deliver(self, data, droppable=False, room=DEFAULT_ROOM, record=False, exclude=None, persist=False):
+        """이 워커에서 room에 들어 있는 클라이언트들의 송신 큐에 넣습니다. (버스로 받은 메시지도 여기로 옴)
+
+        record면 방 기록에 추가하고, persist면 로그 파일에도 씁니다. (버스로 받은 메시지는 보낸 워커가 씀)
+        """
+        if record:
+            with self.history_lock:
+                self.history.record(room, data, persist)
+                members = self.rooms.members(room) # 이 뒤에 입장한 연결은 기록으로 받음
+        else:
+            members = self.rooms.members(room)
+        for client in members:  # 방 참여자 수만큼만 반복
+            if client is not exclude: # 메시지를 보낸 클라이언트는 제외
+                client.send(data, droppable) # 각 클라이언트의 송신 큐에 넣기 (소켓에는 송신 스레드가 씀)
+
+    def receive_bus(self, data, droppable, room, record, typing, blob, direct, presence):
+        """다른 워커가 버스로 보낸 메시지를 처리합니다. (버스 수신 스레드)"""
+        if typing:
+            self.apply_typing(room, data.decode('utf-8'))
+        elif blob:
+            self.deliver_blob(room, data.decode('utf-8'))
+        elif direct: # room 자리에 받는 사람 이름
+            receiver = self.presence.lookup(room)
+            if receiver is not None and receiver is not REMOTE:
+                receiver.send(data)
+        elif presence:
+            self.apply_presence(data.decode('utf-8'))
+        else:
+            self.deliver(data, droppable, room, record)
+
+    def register_name(self, conn, name):
+        """conn의 이름을 등록하고 "NAME_OK:이름"과 접속자 목록 스냅샷을 한 번에 보냅니다.
+
+        다른 연결이 쓰는 이름이거나 쓸 수 없는 이름이면 "NAME_REJECTED:이름"으로 답합니다.
+        """
+        with self.presence_lock: # 스냅샷과 그 뒤의 ONLINE/OFFLINE 알림 사이에 빠지는 변경이 없도록
+            ok, previous = self.presence.register(conn, name) if valid_user_name(name) else (False, None)
+            if ok:
+                conn.send(text_frame(f"NAME_OK:{name}") + text_frame(users_message(self.presence.online())))
+                if previous is not None and previous != name: # 이름을 바꿈
+                    self.announce_presence(f"OFFLINE:{previous}", exclude=conn)
+                if previous != name:
+                    self.announce_presence(f"ONLINE:{name}", exclude=conn)
+        if not ok:
+            conn.send(text_frame(f"NAME_REJECTED:{name}"), wait=True)
+
+    def leave_presence(self, conn):
+        """연결이 끊길 때 이름을 지우고 다른 클라이언트들에게 OFFLINE으로 알립니다."""
+        with self.presence_lock:
+            name = self.presence.unregister(conn)
+            if name is not None:
+                self.announce_presence(f"OFFLINE:{name}")
+
+    def announce_presence(self, event, exclude=None):
+        """"ONLINE:이름"/"OFFLINE:이름"을 이름을 등록한 이 워커의 클라이언트들과 다른 워커들에게 알립니다."""
+        data = text_frame(event)
+        for client in self.presence.connections():
+            if client is not exclude:
+                client.send(data)
+        if self.bus is not None:
+            self.bus.publish(event.encode('utf-8'), presence=True)
+
+    def apply_presence(self, event):
+        """다른 워커의 접속자 변경을 반영하고 이 워커의 클라이언트들에게 알립니다."""
+        kind, name = event.split(":", 1)
+        with self.presence_lock:
+            if kind == "ONLINE":
+                self.presence.add_remote(name)
+            else:
+                self.presence.remove_remote(name)
+            data = text_frame(event)
+            for client in self.presence.connections():
+                client.send(data)
+
+    def send_direct(self, conn, target, text):
+        """개인 메시지를 받는 사람의 연결 하나에만 "DM_FROM:보낸 사람:내용"으로 보냅니다. (방 참여자를 훑지 않음)"""
+        sender = self.presence.name_of(conn)
+        receiver = self.presence.lookup(target)
+        if sender is None or receiver is None: # 이름을 등록하지 않았거나 받는 사람이 접속 중이 아님
+            conn.send(text_frame(f"DM_FAILED:{target}"), wait=True)
+            return
+        data = text_frame(f"DM_FROM:{sender}:{text}")
+        if receiver is REMOTE: # 다른 워커에 접속한 사람
+            self.bus.publish(data, room=target, direct=True)
+        else:
+            receiver.send(data)
+
+    def deliver_blob(self, room, reference):
+        """다른 워커가 저장소에 쓴 파일("해시:헤더 메시지")을 이 워커의 room 참여자들에게 헤더와 함께 보냅니다."""
+        digest, header = reference.split(":", 1)
+        path = self.store.path_for(digest)
+        for client in self.rooms.members(room):
+            self.send_path(client, header, path, header.split(":", 1)[1], wait=False)
+
+    def apply_typing(self, room, message, owner=None):
+        """"TYPING:이름" 또는 "TYPING_STOP:이름"을 room의 타이핑 상태에 반영합니다."""
+        kind, name = message.split(":", 1)
+        return self.typing.update(room, name, kind == "TYPING", owner)
+
+    def update_typing(self, conn, message):
+        """클라이언트의 타이핑 이벤트를 반영하고, 상태가 바뀌었으면 다른 워커에게도 알립니다."""
+        room = conn.room
+        if room is not None and self.apply_typing(room, message, conn) and self.bus is not None:
+            self.bus.publish(message.encode('utf-8'), room=room, typing=True)
+
+    def stop_typing(self, conn):
+        """연결이 끊기거나 방을 옮길 때 그 연결의 입력 중 상태를 지웁니다."""
+        previous = self.typing.drop(conn)
+        if previous is not None and self.bus is not None:
+            room, name = previous
+            self.bus.publish(f"TYPING_STOP:{name}".encode('utf-8'), room=room, typing=True)
+
+    def typing_loop(self):
+        """TYPING_TICK마다 상태가 바뀐 방에만 TYPING_STATE를 보냅니다. (TYPING 이벤트 수와 상관없이 방마다 틱당 1개)"""
+        while True:
+            time.sleep(TYPING_TICK)
+            for room, names in self.typing.tick():
+                self.deliver(text_frame(typing_state_message(names)), droppable=True, room=room)
+
+    def render_metrics(self):
+        """계측 값을 Prometheus 텍스트 형식으로 돌려줍니다. (HTTP 스레드와 METRICS 명령에서 사용)"""
+        with self.clients_lock:
+            connections = list(self.clients)
+        return self.metrics.render(connections, self.write_stats)
+
+    def send_metrics(self, conn):
+        """관리 명령 "METRICS"에 "METRICS:" 뒤에 계측 값을 붙여 응답합니다. 다른 컴퓨터에서 온 요청은 거절."""
+        if not is_local_address(conn.addr):
+            conn.send(text_frame("METRICS_DENIED"), wait=True)
+            return
+        conn.send(text_frame("METRICS:" + self.render_metrics()), wait=True)
+
+    def negotiate_compression(self, conn, offer):
+        """클라이언트가 제안한 압축 방식 중 허용할 것을 "COMPRESS_OK:..."로 답하고 양방향 압축을 켭니다.
+
+        읽는 쪽을 먼저 바꿔 두므로 클라이언트는 응답을 받은 직후부터 압축해 보낼 수 있습니다.
+        서버는 클라이언트가 제안했다는 것만으로 풀 수 있다고 보고 바로 압축해 보냅니다.
+        """
+        accepted = accept_offer(self.compression, offer)
+        self.enable_compression(conn, accepted)
+        conn.send(text_frame("COMPRESS_OK:" + ",".join(accepted)), wait=True)
+
+    def enable_compression(self, conn, accepted):
+        """허용한 압축 방식(accept_offer의 결과)으로 양방향 압축을 켭니다. 비어 있으면 그대로 둠."""
+        if accepted and conn.deflater is None:
+            conn.inbound = InflatingSocket(conn.sock, Inflater(conn.compression))
+            conn.deflater = Deflater(conn.compression, files="files" in accepted)
+
+    def enable_streams(self, conn):
+        """다중화를 켜고 "STREAMS_OK"로 답합니다. 이후의 다운로드와 원본 이미지는 스트림으로 보냅니다."""
+        conn.multiplexed = True
+        set_stream_lowat(conn.sock) # 커널 송신 버퍼에 본문이 쌓여 채팅이 그 뒤에서 기다리지 않도록
+        conn.send(text_frame("STREAMS_OK"), wait=True)
+
+    def reap_loop(self):
+        """heartbeat_interval마다 조용한 연결에 PING을 보내고, 응답이 없거나 오래 쉰 연결을 닫습니다.
+
+        닫은 연결은 수신 스레드가 끊긴 연결과 똑같이 목록에서 지우고 정리합니다.
+        """
+        while True:
+            time.sleep(self.reaper.interval)
+            if self.reloading: # 멈춘 연결은 보내지도 읽지도 않으므로 점검하지 않음
+                continue
+            with self.clients_lock:
+                connections = list(self.clients)
+            now = time.monotonic()
+            for conn in connections:
+                action = self.reaper.check(conn.liveness, now)
+                if action in REAP_REASONS:
+                    self.reap(conn, action)
+                elif action is not None:
+                    conn.send(text_frame(action), droppable=True)
+
+    def reap(self, conn, reason):
+        print(f"{conn.addr} {'응답이 없어' if reason == REAP_TIMEOUT else '오래 사용하지 않아'} 연결을 닫습니다.")
+        self.metrics.count_reaped(reason)
+        conn.close() # 소켓을 shutdown하므로 수신 스레드가 recv에서 깨어나 remove_client를 부름
+
+    def reload_loop(self, r_sock):
+        """새 프로세스의 재시작 요청을 기다렸다가 연결들을 넘깁니다."""
+        peer, _ = r_sock.accept()
+        # 수락 스레드가 끝나면 주 스레드도 끝나므로 넘기는 동안 프로세스가 남아 있도록 데몬이 아닌 스레드에서
+        Thread(target=self.hand_over, args=(peer,), daemon=False).start()
+
+    def hand_over(self, peer):
+        """새 연결을 받지 않고 모든 연결에 RELOAD를 보낸 뒤, 멈춘 연결들의 송신 큐를 비우고 소켓과 상태를 넘긴 다음 종료합니다.
+
+        RELOAD_TIMEOUT이 지나도록 RELOAD_OK로 답하지 않은 연결은 닫습니다. (클라이언트는 다시 접속해 이어받음)
+        """
+        print("재시작 요청을 받았습니다. 연결들을 멈추는 중 ...")
+        with self.accept_lock: # 수락하던 연결은 목록에 추가된 뒤에 시작
+            self.reloading = True
+        os.write(self.wakeup_w, b'!')
+        with self.clients_lock:
+            connections = list(self.clients)
+        for conn in connections:
+            conn.send(text_frame("RELOAD"), wait=True)
+        deadline = time.monotonic() + RELOAD_TIMEOUT
+        while time.monotonic() < deadline:
+            with self.clients_lock: # 멈춘 뒤에도 받아 둔 업로드 스트림은 끝까지 처리
+                if all(conn in self.parked and not conn.streams for conn in self.clients):
+                    break
+            time.sleep(RELOAD_POLL)
+        with self.clients_lock:
+            connections = list(self.clients)
+        handed = []
+        for conn in connections:
+            sock = conn.detach() if conn in self.parked else None # 큐에 남은 메시지와 다운로드까지 보낸 뒤 멈춤
+            if sock is None:
+                conn.close()
+                continue
+            handed.append((sock, connection_state(conn, self.presence.name_of(conn))))
+        try:
+            send_handoff(peer, self.listeners, handed)
+        except OSError as e:
+            print(f"새 프로세스로 연결을 넘기지 못했습니다: {e}", flush=True)
+            os._exit(1)
+        print(f"연결 {len(handed)}개를 새 프로세스로 넘기고 종료합니다.", flush=True)
+        os._exit(0)
+
+    def stats_loop(self):
+        """stats_interval마다 송신 통계(메시지당 소켓 쓰기 횟수)를 출력합니다. 보낸 것이 없으면 건너뜀."""
+        last = None
+        while True:
+            time.sleep(self.stats_interval)
+            if self.write_stats.messages != last:
+                last = self.write_stats.messages
+                print(f"송신 통계: {self.write_stats.summary()}")
+
+class AsyncMultiChatServer:
+    """MultiChatServer와 같은 명령 집합을 하나의 asyncio 이벤트 루프에서 처리하는 서버.
+
+    클라이언트마다 스레드를 만드는 대신 연결마다 코루틴(StreamReader/StreamWriter)을 사용합니다.
+    """
+    def __init__(self, port=2500, queue_size=DEFAULT_QUEUE_SIZE, overflow_policy=OVERFLOW_DROP_TYPING,
+                 storage_dir='uploads', thumbnail_workers=THUMBNAIL_WORKERS, history_size=HISTORY_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, flush_bytes=DEFAULT_FLUSH_BYTES,
+                 transfer_window=TRANSFER_WINDOW, compression=COMPRESSION_TEXT, heartbeat_interval=HEARTBEAT_INTERVAL,
+                 heartbeat_timeout=HEARTBEAT_TIMEOUT, idle_timeout=IDLE_TIMEOUT, io_workers=IO_WORKERS,
+                 max_connections=MAX_CONNECTIONS, accept_rate=ACCEPT_RATE, message_rate=MESSAGE_RATE,
+                 message_burst=MESSAGE_BURST, upload_rate=UPLOAD_RATE, stats_interval=0, metrics_port=0, reuse_port=False, bus_path=None,
+                 reload_path=None, takeover=False):
+        self.clients = []  # 접속된 클라이언트 연결(AsyncClientConnection) 목록
+        self.rooms = RoomIndex()
+        self.history = MessageHistory(os.path.join(storage_dir, 'history'), history_size)
+        self.typing = TypingTracker()
+        self.presence = PresenceDirectory()
+        self.store = BlobStore(storage_dir)
+        self.disk = DiskPool(io_workers)  # 이벤트 루프 대신 디스크 쓰기와 fsync를 맡음
+        self.thumbnails = ThumbnailCache(os.path.join(storage_dir, 'thumbs'))
+        self.thumbnail_pool = create_thumbnail_pool(thumbnail_workers)
+        self.background_tasks = set()  # 미리보기 생성처럼 따로 돌리는 태스크 (참조 유지용)
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.write_stats = WriteStats()
+        self.transfer_window = transfer_window
+        self.compression = compression
+        self.reaper = Reaper(heartbeat_interval, heartbeat_timeout, idle_timeout)
+        self.stats_interval = stats_interval
+        self.metrics = ServerMetrics()
+        self.admission = AdmissionControl(max_connections, accept_rate, message_rate, message_burst, upload_rate,
+                                          observer=self.metrics.count_throttled)
+        self.metrics_port = metrics_port
+        self.ip = '' # 모든 IP로부터 연결을 허용
+        self.port = port  # 서버 포트 번호
+        self.reuse_port = reuse_port
+        self.bus_path = bus_path
+        self.bus = None
+        self.reload_path = reload_path
+        self.takeover = takeover
+        self.reloading = False
+        self.parked = set()
+        self.servers = []
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        """리스닝 소켓을 열고(또는 실행 중인 서버에서 넘겨받고) 이벤트 루프에서 클라이언트 연결을 수락합니다."""
+        handed = []
+        if self.takeover:
+            listeners, handed = await asyncio.to_thread(request_handoff, self.reload_path)
+            for sock in listeners:
+                self.servers.append(await asyncio.start_server(self.accept_client, sock=sock, backlog=100))
+        else:
+            self.servers.append(await asyncio.start_server(self.accept_client, self.ip or None, self.port,
+                                                           reuse_address=True, reuse_port=self.reuse_port or None,
+                                                           backlog=100))
+        if self.bus_path:
+            loop = asyncio.get_running_loop()
+            # 버스 수신 스레드에서 받은 메시지는 이벤트 루프로 넘겨서 전달
+            self.bus = BusClient(self.bus_path, lambda *message: asyncio.run_coroutine_threadsafe(
+                self.receive_bus(*message), loop))
+        print("클라이언트 대기 중 ... (asyncio)" if self.bus is None else f"클라이언트 대기 중 ... (asyncio, 워커 {os.getpid()})")
+        self.background_tasks.add(asyncio.create_task(self.typing_loop()))  # 타이핑 상태를 모아 보내는 태스크
+        if self.reaper.enabled:
+            self.background_tasks.add(asyncio.create_task(self.reap_loop()))
+        if self.metrics_port: # HTTP 응답은 별도 스레드에서 만듦 (값을 읽기만 함)
+            serve_metrics(self.metrics_port, self.render_metrics)
+        if self.stats_interval > 0:
+            self.background_tasks.add(asyncio.create_task(self.stats_loop()))
+        for sock, state in handed: # 넘겨받은 연결도 새 연결처럼 코루틴 하나가 담당
+            reader, writer = await asyncio.open_connection(sock=sock)
+            self.background_tasks.add(asyncio.create_task(self.accept_client(reader, writer, state)))
+        if self.reload_path:
+            self.background_tasks.add(asyncio.create_task(self.reload_loop(listen_reload(self.reload_path))))
+        await asyncio.gather(*(server.serve_forever() for server in self.servers))
+
+    async def accept_client(self, reader, writer, state=None):
+        """새 연결마다 호출되는 콜백. 스레드 대신 이 코루틴이 클라이언트를 담당합니다.
+
+        state는 이전 프로세스에서 넘겨받은 연결의 상태입니다.
+        """
+        sock = writer.get_extra_info('socket')
+        refusal = self.admission.admit(len(self.clients)) if state is None else None
+        if refusal is not None:
+            writer.write(refusal)
+            writer.close()
+            return
+        if state is not None: # 송신 태스크가 생기기 전에 압축하지 않고 보냄
+            writer.write(text_frame("RELOADED"))
+        elif sock is not None:
+            set_keepalive(sock, self.reaper.timeout)
+        conn = AsyncClientConnection(writer, self.queue_size, self.overflow_policy,
+                                     flush_interval=self.flush_interval, flush_bytes=self.flush_bytes,
+                                     stats=self.write_stats)
+        conn.credit = AsyncUploadCredit(conn, self.transfer_window, self.admission.upload_limit())
+        conn.message_limit = self.admission.message_limit()
+        self.clients.append(conn) # 새로운 클라이언트 추가
+        if state is None:
+            await self.enter_room(conn, DEFAULT_ROOM)
+            print(conn.addr[0], ':', str(conn.addr[1]), '가 연결되었습니다.')
+        else:
+            reader = self.restore_client(reader, conn, state)
+        if self.reloading: # 수락을 멈추기 직전에 받은 연결
+            await conn.send(text_frame("RELOAD"))
+        try:
+            await self.receive_messages(reader, conn)
+        finally:
+            if conn not in self.parked: # 새 프로세스로 넘길 연결은 정리하지 않음
+                await self.remove_client(conn)
+
+    def restore_client(self, reader, conn, state):
+        """MultiChatServer.restore_client와 같음. 이후 이 연결에서 읽을 때 쓸 reader를 돌려줍니다."""
+        reader = self.enable_compression(reader, conn, state['compression'])
+        if state.get('streams'):
+            self.multiplex(conn)
+        conn.offers.update(state['offers'])
+        if state['room'] is not None:
+            self.rooms.join(conn, state['room'])
+        if state['name'] is not None:
+            self.presence.register(conn, state['name'])
+        return reader
+
+    async def remove_client(self, conn):
+        conn.close()
+        if conn.deflater is not None:
+            print(f"{conn.addr} 압축: {conn.compression.summary()}")
+        self.stop_typing(conn)
+        self.rooms.leave(conn)
+        await self.leave_presence(conn)
+        if conn in self.clients:
+            self.clients.remove(conn)
+
+    async def receive_messages(self, reader, conn):
+        while not conn.closed:
+            try:
+                conn.liveness.handling = False
+                frame = await read_frame_async(reader) # 프레임 하나 수신
+                if frame is None: # 클라이언트 연결이 끊어졌다면
+                    break
+                ftype, payload = frame
+                if ftype == FRAME_STREAM: # 다중화된 업로드 조각은 그 스트림을 받는 태스크에 넘김
+                    conn.liveness.streamed()
+                    conn.bytes_in += HEADER.size + len(payload)
+                    conn.streams.feed(payload)
+                    continue
+                if ftype != FRAME_TEXT:
+                    raise ProtocolError(f"예상하지 못한 프레임 타입: {ftype}")
+                incoming_message = payload.decode('utf-8')
+                conn.bytes_in += HEADER.size + len(payload)
+                conn.liveness.received(incoming_message)
+                self.metrics.count_command(incoming_message)
+                delay = await self.throttle_message(conn, incoming_message)
+                if delay is None:
+                    continue
+                if delay and not incoming_message.startswith("STREAM:"):
+                    await asyncio.sleep(delay)
+                # 이미지 전송 요청 처리
+                if incoming_message.startswith("IMAGE:"):
+                    await self.receive_image(reader, conn, incoming_message[6:])
+                # 원본 이미지 요청 처리
+                elif incoming_message.startswith("IMAGE_FETCH:"):
+                    await self.send_image(conn, incoming_message[12:])
+                # 파일 업로드 제안 처리
+                elif incoming_message.startswith("FILE_OFFER:"):
+                    digest, size, filename = incoming_message[11:].split(":", 2)
+                    await self.offer_file(conn, filename, digest, int(size))
+                # 변경분 업로드 제안 처리
+                elif incoming_message.startswith("DELTA_OFFER:"):
+                    digest, size, filename = incoming_message[12:].split(":", 2)
+                    await self.offer_delta(conn, filename, digest, int(size))
+                # 끊긴 업로드 이어서 올리기 요청
+                elif incoming_message.startswith("FILE_RESUME:"):
+                    await self.resume_file(conn, incoming_message[12:])
+                # 이어받기 업로드 본문
+                elif incoming_message.startswith("FILE_CHUNKS:"):
+                    transfer_id, offset = incoming_message[12:].split(":")
+                    await self.receive_chunks(reader, conn, transfer_id, int(offset))
+                # 변경분 업로드 본문
+                elif incoming_message.startswith("FILE_DELTA:"):
+                    base, digest, size, filename = incoming_message[11:].split(":", 3)
+                    await self.receive_delta(reader, conn, base, digest, int(size), filename)
+                # 파일 전송 요청 처리
+                elif incoming_message.startswith("FILE:"):
+                    await self.receive_file(reader, conn, incoming_message[5:])
+                # 파일 다운로드 요청 처리
+                elif incoming_message.startswith("DOWNLOAD:"):
+                    await self.send_file(conn, incoming_message[9:])
+                # 끊긴 다운로드 이어받기 요청
+                elif incoming_message.startswith("DOWNLOAD_RESUME:"):
+                    digest, offset, filename = incoming_message[16:].split(":", 2)
+                    await self.send_file(conn, filename, digest, int(offset))
+                # 병렬 다운로드 준비
+                elif incoming_message.startswith("DOWNLOAD_INFO:"):
+                    await self.send_file_info(conn, incoming_message[14:])
+                # 병렬 다운로드의 구간 하나 (보조 연결에서)
+                elif incoming_message.startswith("DOWNLOAD_RANGE:"):
+                    digest, offset, length = incoming_message[15:].split(":")
+                    await self.send_range(conn, digest, int(offset), int(length))
+                # 구간 다운로드 전용 보조 연결
+                elif incoming_message == "RANGES":
+                    self.rooms.leave(conn)
+                # 타이핑 상태 처리
+                elif incoming_message.startswith(("TYPING:", "TYPING_STOP:")):
+                    self.update_typing(conn, incoming_message)
+                # 방 입장/퇴장
+                elif incoming_message.startswith("JOIN:"):
+                    await self.join_room(conn, incoming_message[5:])
+                elif incoming_message == "LEAVE":
+                    await self.join_room(conn, DEFAULT_ROOM)
+                # 관리 명령: 계측 값 조회
+                elif incoming_message == "METRICS":
+                    await self.send_metrics(conn)
+                # 압축 협상 (이후로는 압축된 프레임을 풀어 주는 reader로 읽음)
+                elif incoming_message.startswith("COMPRESS:"):
+                    reader = await self.negotiate_compression(reader, conn, incoming_message[9:])
+                # 다중화 협상
+                elif incoming_message == "STREAMS":
+                    await self.enable_streams(conn)
+                # 다중화된 업로드 (본문은 스트림마다 따로 태스크가 받음)
+                elif incoming_message.startswith("STREAM:"):
+                    sid, command = incoming_message[7:].split(":", 1)
+                    self.open_stream(conn, int(sid), command, delay)
+                # PING에 대한 응답
+                elif incoming_message.startswith("PONG:"):
+                    pass
+                # 이름 등록
+                elif incoming_message.startswith("NAME:"):
+                    await self.register_name(conn, incoming_message[5:])
+                # 접속자 목록 요청
+                elif incoming_message == "USERS":
+                    await conn.send(text_frame(users_message(self.presence.online())), wait=True)
+                # 개인 메시지
+                elif incoming_message.startswith("DM:"):
+                    target, text = incoming_message[3:].split(":", 1)
+                    await self.send_direct(conn, target, text)
+                # 재시작: 수신을 멈추고 새 프로세스로 넘길 때까지 기다림
+                elif incoming_message == "RELOAD_OK":
+                    if self.reloading:
+                        self.parked.add(conn)
+                        return
+                # 일반 메시지 처리
+                else:
+                    await self.broadcast_message(conn, incoming_message)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                break
+            except ProtocolError as e:
+                print(f"{conn.addr} 규약 오류로 연결을 끊습니다: {e}")
+                break
+            except Exception as e:
+                print(f"오류 발생: {e}")
+                continue
+
+    async def throttle_message(self, conn, message):
+        """MultiChatServer.throttle_message와 같음."""
+        if conn.message_limit is None or message.startswith(UNTHROTTLED_COMMANDS):
+            return 0
+        if message.startswith(BODY_COMMANDS):
+            delay, notice = conn.message_limit.charge(1)
+        else:
+            delay, notice = conn.message_limit.take()
+            if delay > 0 and message.startswith(REPLY_COMMANDS):
+                await conn.send(throttled_message(THROTTLE_MESSAGES, delay, message), wait=True)
+                return None
+        if notice is not None:
+            await conn.send(notice, droppable=True)
+        if delay > 0 and not message.startswith(BODY_COMMANDS):
+            return None
+        return delay
+
+    async def receive_image(self, reader, conn, filename):
+        """이미지를 저장하고, 미리보기를 한 번만 만들어 다른 클라이언트들에게 보냅니다."""
+        if self.thumbnail_pool is None:
+            await self.relay_image(reader, conn, filename)
+            return
+        writer = self.store.open_writer()
+        channel = self.disk.channel()
+        try:
+            with self.metrics.transfer('upload'):
+                async for data in iter_body_async(reader, conn.credit):
+                    if not isinstance(reader, AsyncStreamReader):
+                        conn.bytes_in += len(data)
+                    await channel.write_async(writer.write, data)
+            digest = await channel.call_async(writer.commit)
+            await channel.call_async(self.store.link, filename, digest)
+        except BaseException:
+            await channel.wait_async()
+            writer.abort()
+            raise
+        # 미리보기를 기다리는 동안에도 업로더의 다음 메시지를 처리하도록 별도 태스크로 실행
+        task = asyncio.create_task(self.publish_thumbnail(conn, conn.room, digest, filename))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def publish_thumbnail(self, conn, room, digest, filename):
+        thumbnail = self.thumbnails.get(digest)
+        if thumbnail is None:
+            loop = asyncio.get_running_loop()
+            try:
+                thumbnail = await loop.run_in_executor(self.thumbnail_pool, make_thumbnail,
+                                                       self.store.path_for(digest))
+            except Exception as e:
+                print(f"{filename} 미리보기 생성 실패: {e}")
+                await self.broadcast_message(conn, f"NEW_FILE:{filename}", room=room)
+                return
+            self.thumbnails.put(digest, thumbnail)
+        message = text_frame(f"IMAGE_THUMB:{digest}:{filename}") + b"".join(iter_bytes_frames(thumbnail))
+        await self.publish(conn, message, room=room)
+
+    async def send_image(self, conn, digest):
+        """미리보기를 클릭한 클라이언트에게 원본 이미지를 보냅니다."""
+        if not valid_digest(digest) or not self.store.has(digest):
+            await conn.send(text_frame("FILE_NOT_FOUND"), wait=True)
+            return
+        await self.send_path(conn, f"IMAGE_FULL:{digest}", self.store.path_for(digest), digest[:12])
+
+    async def relay_image(self, reader, conn, filename):
+        """클라이언트로부터 이미지를 수신하면서 받은 조각을 곧바로 다른 클라이언트들에게 중계"""
+        relay = AsyncStreamRelay(self.transfer_window, name=filename)
+        room = conn.room
+        for client in self.rooms.members(room):
+            if client is not conn: # 업로더는 이미지를 이미 가지고 있으므로 제외
+                relay.add_reader(client)
+                if not await client.send(relay.reader(client)):
+                    relay.remove_reader(client)
+        spool = self.store.open_writer() if self.bus else None # 다른 워커에는 저장소 파일 참조로 알림
+        channel = self.disk.channel()
+        header = f"IMAGE_START:{filename}"
+        try:
+            await relay.push(text_frame(header))
+            async for data in iter_body_async(reader, conn.credit):
+                if not isinstance(reader, AsyncStreamReader):
+                    conn.bytes_in += len(data)
+                await relay.push(encode_frame(FRAME_DATA, data))
+                if spool is not None:
+                    await channel.write_async(spool.write, data)
+        except BaseException:
+            if spool is not None:
+                await channel.wait_async()
+                spool.abort()
+            raise
+        finally:
+            await relay.push(end_frame())
+            relay.finish()
+        if spool is not None:
+            digest = await channel.call_async(spool.commit)
+            self.bus.publish(f"{digest}:{header}".encode('utf-8'), room=room, blob=True)
+
+    async def offer_file(self, conn, filename, digest, size):
+        """업로드 전에 해시를 확인해, 이미 가진 내용이면 본문을 받지 않고 파일명만 연결합니다."""
+        if not valid_digest(digest):
+            await conn.send(text_frame(f"FILE_FAILED:{filename}"), wait=True)
+            return
+        if self.store.has(digest):
+            self.store.link(filename, digest)
+            await conn.send(text_frame(f"FILE_EXISTS:{filename}"), wait=True)
+            print(f"{filename} 파일은 이미 저장되어 있어 전송을 생략했습니다.")
+            await self.broadcast_message(conn, f"NEW_FILE:{filename}")
+        else:
+            conn.offers[filename] = digest
+            upload = self.store.staging.begin(digest, size, filename)
+            await self.accept_chunks(conn, upload)
+
+    async def offer_delta(self, conn, filename, digest, size):
+        """offer_file과 같되, 같은 이름의 이전 내용이 있으면 그 블록 서명을 보내 바뀐 블록만 받습니다."""
+        if not valid_digest(digest):
+            await conn.send(text_frame(f"FILE_FAILED:{filename}"), wait=True)
+            return
+        base = self.delta_base(filename, digest, size)
+        if base is None:
+            await self.offer_file(conn, filename, digest, size)
+            return
+        path = await asyncio.to_thread(self.store.signatures, base)
+        await self.send_path(conn, f"DELTA_BASE:{base}:{DELTA_BLOCK_SIZE}:{filename}", path, f"{filename} 블록 서명")
+
+    def delta_base(self, filename, digest, size):
+        base = self.store.lookup(filename)
+        if base is None or base == digest or size < DELTA_MIN_SIZE or self.store.has(digest):
+            return None
+        if not valid_digest(base): # 색인에 잘못 들어간 해시로는 저장소 밖 파일을 읽지 않음
+            return None
+        try:
+            if os.path.getsize(self.store.path_for(base)) < DELTA_MIN_SIZE:
+                return None
+        except FileNotFoundError:
+            return None
+        return base
+
+    async def accept_chunks(self, conn, upload):
+        await conn.send(text_frame(f"FILE_ACCEPT:{upload.transfer_id}:{upload.offset}:{upload.name}"), wait=True)
+
+    async def resume_file(self, conn, transfer_id):
+        """다시 접속한 클라이언트가 끊긴 업로드를 이어서 올리려고 할 때 현재 위치를 알려 줍니다."""
+        upload = self.store.staging.get(transfer_id)
+        if upload is None:
+            await conn.send(text_frame(f"FILE_UNKNOWN:{transfer_id}"), wait=True)
+        else:
+            await self.accept_chunks(conn, upload)
+
+    async def receive_chunks(self, reader, conn, transfer_id, offset):
+        """CHUNK 프레임들을 검증하며 staging 파일 끝에 이어 붙이고, 다 받으면 저장소로 옮깁니다."""
+        staging = self.store.staging
+        upload = staging.get(transfer_id)
+        if upload is None:
+            await skip_body_async(reader, conn.credit)
+            await conn.send(text_frame(f"FILE_UNKNOWN:{transfer_id}"), wait=True)
+            return
+        if not staging.claim(upload):
+            await skip_body_async(reader, conn.credit)
+            await conn.send(text_frame(f"FILE_BUSY:{transfer_id}"), wait=True)
+            return
+        channel = self.disk.channel()
+        try:
+            with self.metrics.transfer('upload'), open(upload.path, "ab") as f:
+                try:
+                    position = upload.offset
+                    if offset != position:
+                        raise ChecksumError(offset)
+                    async for chunk_offset, data in iter_chunks_async(reader, conn.credit):
+                        if chunk_offset != position:
+                            raise ChecksumError(chunk_offset)
+                        if not isinstance(reader, AsyncStreamReader):
+                            conn.bytes_in += len(data)
+                        position += len(data)
+                        await channel.write_async(f.write, data)
+                    await channel.call_async(f.flush)
+                except ChecksumError as e:
+                    await skip_body_async(reader, conn.credit)
+                    await channel.call_async(f.flush)
+                    print(f"{upload.name} 업로드 {e} {upload.offset} 위치부터 다시 받습니다.")
+                    await self.accept_chunks(conn, upload)
+                    return
+                finally:
+                    await channel.wait_async()
+        finally:
+            staging.release(upload)
+        if not upload.complete:
+            return
+        try:
+            # 전체 해시 계산과 fsync는 파일 크기만큼 걸리므로 이벤트 루프를 막지 않게 I/O 스레드에서 실행
+            digest = await channel.call_async(staging.finish, upload, self.store)
+            await channel.call_async(self.store.link, upload.name, digest)
+        except ValueError as e:
+            print(f"파일 수신 중 오류 발생: {e}")
+            await conn.send(text_frame(f"FILE_FAILED:{upload.name}"), wait=True)
+            return
+        print(f"{upload.name} 파일이 저장되었습니다. ({digest[:12]})")
+        await conn.send(text_frame(f"FILE_STORED:{transfer_id}:{upload.name}"), wait=True)
+        await self.broadcast_message(conn, f"NEW_FILE:{upload.name}")
+
+    async def receive_delta(self, reader, conn, base, digest, size, filename):
+        """MultiChatServer.receive_delta와 같음."""
+        base_file = None
+        if valid_digest(base) and valid_digest(digest):
+            try:
+                base_file = open(self.store.path_for(base), "rb")
+            except FileNotFoundError:
+                pass
+        if base_file is None:
+            await skip_body_async(reader, conn.credit)
+            await conn.send(text_frame(f"DELTA_FAILED:{filename}"), wait=True)
+            return
+        received = 0
+        writer = self.store.open_writer()
+        channel = self.disk.channel()
+        try:
+            with self.metrics.transfer('upload'), base_file:
+                patcher = DeltaPatcher(base_file, os.fstat(base_file.fileno()).st_size, writer)
+                try:
+                    async for payload in iter_body_async(reader, conn.credit):
+                        patcher.check(payload)
+                        if not isinstance(reader, AsyncStreamReader):
+                            conn.bytes_in += len(payload)
+                        received += len(payload)
+                        await channel.write_async(patcher.apply, payload)
+                    digest = await channel.call_async(writer.commit, digest)
+                    await channel.call_async(self.store.link, filename, digest)
+                finally:
+                    await channel.wait_async()
+        except ValueError as e:
+            print(f"변경분 업로드 중 오류 발생: {e}")
+            await conn.send(text_frame(f"DELTA_FAILED:{filename}"), wait=True)
+            return
+        except BaseException:
+            writer.abort()
+            raise
+        saved = writer.size - received
+        self.metrics.count_delta(received, saved)
+        print(f"{filename} 파일을 변경분으로 저장했습니다. ({digest[:12]}, {received} 바이트 수신, {saved} 바이트 절약)")
+        await conn.send(text_frame(f"DELTA_STORED:{received}:{saved}:{filename}"), wait=True)
+        await self.broadcast_message(conn, f"NEW_FILE:{filename}")
+
+    async def receive_file(self, reader, conn, filename):
+        """MultiChatServer.receive_file과 같음."""
+        try:
+            writer = self.store.open_writer()
+            channel = self.disk.channel()
+            try:
+                with self.metrics.transfer('upload'):
+                    async for chunk in iter_body_async(reader, conn.credit):
+                        if not isinstance(reader, AsyncStreamReader):
+                            conn.bytes_in += len(chunk)
+                        await channel.write_async(writer.write, chunk)
+                digest = await channel.call_async(writer.commit, conn.offers.pop(filename, None))
+                await channel.call_async(self.store.link, filename, digest)
+            except BaseException:
+                await channel.wait_async()
+                writer.abort()
+                raise
+            print(f"{filename} 파일이 저장되었습니다. ({digest[:12]})")
+            await self.broadcast_message(conn, f"NEW_FILE:{filename}") # 새로운 파일이 생성되었음을 알림
+        except ConnectionError:
+            raise
+        except (ValueError, OSError) as e:
+            print(f"파일 수신 중 오류 발생: {e}")
+
+    def open_stream(self, conn, sid, command, delay=0):
+        stream = conn.streams.open(sid)
+        task = asyncio.create_task(self.receive_stream(conn, sid, stream, command, delay))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def receive_stream(self, conn, sid, stream, command, delay=0):
+        """MultiChatServer.receive_stream과 같음."""
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+            if command.startswith("IMAGE:"):
+                await self.receive_image(stream, conn, command[6:])
+            elif command.startswith("FILE_CHUNKS:"):
+                transfer_id, offset = command[12:].split(":")
+                await self.receive_chunks(stream, conn, transfer_id, int(offset))
+            elif command.startswith("FILE_DELTA:"):
+                base, digest, size, filename = command[11:].split(":", 3)
+                await self.receive_delta(stream, conn, base, digest, int(size), filename)
+            elif command.startswith("FILE:"):
+                await self.receive_file(stream, conn, command[5:])
+            else:
+                raise ProtocolError(f"스트림으로 받을 수 없는 명령: {command}")
+        except (ConnectionError, asyncio.IncompleteReadError, OSError):
+            conn.close(abort=True)
+        except Exception as e:
+            print(f"{conn.addr} {sid}번 스트림 오류로 연결을 끊습니다: {e}")
+            conn.close(abort=True)
+        finally:
+            conn.streams.finish(sid, stream)
+
+    async def send_file(self, conn, filename, digest=None, offset=0):
+        """파일을 "FILE_START:해시:크기:위치:파일명" 뒤에 CHUNK 프레임들로 보냅니다."""
+        path = self.store.resolve(filename) # 파일명 색인으로 내용 파일 경로 찾기
+        if path is None or (digest is not None and not valid_digest(digest)): # 파일이 없거나 잘못된 해시
+            await conn.send(text_frame("FILE_NOT_FOUND"), wait=True)
+            return
+        current = self.store.lookup(filename)
+        size = os.path.getsize(path)
+        if digest != current: # 그 사이 같은 이름으로 다른 내용이 올라왔으면 처음부터
+            offset = 0
+        offset = min(offset - offset % TRANSFER_CHUNK_SIZE, size)
+        deflater = conn.deflater if conn.deflater is not None and conn.deflater.body is not None else None
+        if conn.multiplexed:
+            checksums = await asyncio.to_thread(self.store.checksums, current)
+            compress = deflater is not None and not await asyncio.to_thread(is_compressed_file, path)
+            stats = TransferStats(filename)
+
+            def pieces():
+                with self.metrics.transfer('download'), open(path, "rb") as f:
+                    yield from file_chunk_pieces(f, checksums, offset)
+                stats.finish()
+                conn.bytes_out += stats.bytes_sent
+                print(f"{filename} 파일이 클라이언트에 전송되었습니다. ({offset} 위치부터, {stats.summary()})")
+            await self.send_stream(conn, f"FILE_START:{current}:{size}:{offset}:{filename}",
+                                   OutboundStream(pieces(), stats, compress))
+            return
+
+        async def transfer(writer):
+            try:
+                checksums = await asyncio.to_thread(self.store.checksums, current)
+                # 파일 본문 압축을 협상하지 않았거나 이미 압축된 형식이면 그대로 보냄
+                raw = deflater is None or await asyncio.to_thread(is_compressed_file, path)
+                stats = TransferStats(filename)
+                writer.write(text_frame(f"FILE_START:{current}:{size}:{offset}:{filename}"))
+                with self.metrics.transfer('download'), open(path, "rb") as f:
+                    if raw:
+                        await send_file_chunks_async(writer, f, stats, checksums, offset)
+                    else:
+                        await send_file_chunks_deflated_async(writer, f, stats, checksums, offset, deflater)
+                conn.bytes_out += stats.bytes_sent
+                print(f"{filename} 파일이 클라이언트에 전송되었습니다. ({offset} 위치부터, {stats.summary()})")
+            except OSError:
+                raise
+            except Exception as e:
+                print(f"파일 전송 중 오류 발생: {e}")
+        await conn.send(transfer, wait=True)
+
+    async def send_file_info(self, conn, filename):
+        """"FILE_INFO:해시:크기:파일명"으로 내려받을 내용을 알려 줍니다."""
+        digest = self.store.lookup(filename)
+        if digest is None or not self.store.has(digest):
+            await conn.send(text_frame("FILE_NOT_FOUND"), wait=True)
+            return
+        size = os.path.getsize(self.store.path_for(digest))
+        await conn.send(text_frame(f"FILE_INFO:{digest}:{size}:{filename}"), wait=True)
+
+    async def send_range(self, conn, digest, offset, length):
+        """내용 해시로 찾은 파일의 한 구간을 "RANGE_START:해시:위치:길이" 뒤에 CHUNK 프레임들로 보냅니다."""
+        if not valid_digest(digest) or not self.store.has(digest):
+            await conn.send(text_frame(f"RANGE_NOT_FOUND:{digest}"), wait=True)
+            return
+        path = self.store.path_for(digest)
+        start, end = chunk_range(offset, length, os.path.getsize(path))
+
+        async def transfer(writer):
+            try:
+                checksums = await asyncio.to_thread(self.store.checksums, digest)
+                stats = TransferStats(digest[:12])
+                writer.write(text_frame(f"RANGE_START:{digest}:{start}:{end - start}"))
+                with self.metrics.transfer('download'), open(path, "rb") as f:
+                    await send_file_chunks_async(writer, f, stats, checksums, start, end)
+                conn.bytes_out += stats.bytes_sent
+            except OSError:
+                raise
+            except Exception as e:
+                print(f"파일 전송 중 오류 발생: {e}")
+        await conn.send(transfer, wait=True)
+
+    async def send_path(self, conn, header, path, filename, wait=True):
+        """header 메시지 뒤에 path 파일의 본문을 보내는 작업을 송신 큐에 넣습니다."""
+        if conn.multiplexed:
+            stats = TransferStats(filename)
+
+            def pieces():
+                with self.metrics.transfer('download'), open(path, "rb") as f:
+                    yield from file_body_pieces(f)
+                stats.finish()
+                conn.bytes_out += stats.bytes_sent
+                print(f"{filename} 파일이 클라이언트에 전송되었습니다. ({stats.summary()})")
+            await self.send_stream(conn, header, OutboundStream(pieces(), stats), wait=wait)
+            return
+
+        async def transfer(writer):
+            """송신 태스크에서 실행됩니다. 전송 중에 다른 메시지가 끼어들지 않습니다."""
+            try:
+                stats = TransferStats(filename)
+                writer.write(text_frame(header)) # 파일 전송 시작 신호 전송
+                with self.metrics.transfer('download'), open(path, "rb") as f:
+                    await send_file_body_async(writer, f, stats) # 본문은 loop.sendfile로 전송
+                conn.bytes_out += stats.bytes_sent
+                print(f"{filename} 파일이 클라이언트에 전송되었습니다. ({stats.summary()})")
+            except OSError:
+                raise
+            except Exception as e:
+                print(f"파일 전송 중 오류 발생: {e}")
+        await conn.send(transfer, wait=wait)
+
+    async def send_stream(self, conn, header, stream, wait=True):
+        stream.sid = next(conn.stream_ids)
+        if await conn.send(text_frame(f"STREAM:{stream.sid}:{header}"), wait=wait):
+            await conn.send(stream, wait=True)
+
+    async def join_room(self, conn, room):
+        """conn을 room으로 옮기고 "JOINED:방이름"으로 알려 줍니다."""
+        if not valid_room_name(room):
+            await conn.send(text_frame(f"JOIN_FAILED:{room}"), wait=True)
+            return
+        await self.enter_room(conn, room)
+
+    async def enter_room(self, conn, room):
+        """conn을 room에 넣고 "JOINED:방이름"과 최근 대화를 한 번에 보냅니다.
+
+        입장부터 송신 큐에 넣기까지 중간에 양보하지 않으므로 그 사이에 다른 메시지가 끼지 않습니다.
+        """
+        self.stop_typing(conn)
+        self.rooms.join(conn, room)
+        count, frames = self.history.replay(room)
+        message = text_frame(f"JOINED:{room}")
+        if count:
+            message += text_frame(f"HISTORY:{count}") + frames
+        typers = self.typing.names(room)
+        if typers:
+            message += text_frame(typing_state_message(typers))
+        await conn.send(message)
+
+    async def broadcast_message(self, senders_conn, message, droppable=False, room=None):
+        """한 클라이언트가 보낸 메시지를 같은 방의 나머지 클라이언트에게 브로드캐스트하고, 방 기록에 남깁니다."""
+        await self.publish(senders_conn, text_frame(message), droppable, room, record=not droppable)
+
+    async def publish(self, senders_conn, data, droppable=False, room=None, record=False):
+        """인코딩된 프레임을 room(기본은 보낸 사람의 방)의 참여자들과, 멀티 프로세스 모드라면 다른 워커들에게 보냅니다."""
+        room = room or senders_conn.room
+        if room is None:
+            return
+        started = time.perf_counter()
+        await self.deliver(data, droppable, room, record, exclude=senders_conn, persist=True)
+        if self.bus is not None:
+            self.bus.publish(data, droppable, room, record) # 유닉스 소켓으로 보내는 짧은 쓰기
+        self.metrics.broadcast_latency.observe(time.perf_counter() - started)
+
+    async def deliver(self, data, droppable=False, room=DEFAULT_ROOM, record=False, exclude=None, persist=False):
+        if record:
+            self.history.record(room, data, persist)
+        for client in self.rooms.members(room):
+            if client is not exclude: # 메시지를 보낸 클라이언트는 제외
+                await client.send(data, droppable)
+
+    async def receive_bus(self, data, droppable, room, record, typing, blob, direct, presence):
+        if typing:
+            self.apply_typing(room, data.decode('utf-8'))
+        elif blob:
+            await self.deliver_blob(room, data.decode('utf-8'))
+        elif direct:
+            receiver = self.presence.lookup(room)
+            if receiver is not None and receiver is not REMOTE:
+                await receiver.send(data)
+        elif presence:
+            await self.apply_presence(data.decode('utf-8'))
+        else:
+            await self.deliver(data, droppable, room, record)
+
+    async def register_name(self, conn, name):
+        """스냅샷을 만들어 송신 큐에 넣기까지 양보하지 않으므로 그 사이의 ONLINE/OFFLINE이 빠지지 않습니다."""
+        ok, previous = self.presence.register(conn, name) if valid_user_name(name) else (False, None)
+        if not ok:
+            await conn.send(text_frame(f"NAME_REJECTED:{name}"), wait=True)
+            return
+        await conn.send(text_frame(f"NAME_OK:{name}") + text_frame(users_message(self.presence.online())))
+        if previous is not None and previous != name:
+            await self.announce_presence(f"OFFLINE:{previous}", exclude=conn)
+        if previous != name:
+            await self.announce_presence(f"ONLINE:{name}", exclude=conn)
+
+    async def leave_presence(self, conn):
+        name = self.presence.unregister(conn)
+        if name is not None:
+            await self.announce_presence(f"OFFLINE:{name}")
+
+    async def announce_presence(self, event, exclude=None):
+        data = text_frame(event)
+        for client in self.presence.connections():
+            if client is not exclude:
+                await client.send(data)
+        if self.bus is not None:
+            self.bus.publish(event.encode('utf-8'), presence=True)
+
+    async def apply_presence(self, event):
+        kind, name = event.split(":", 1)
+        if kind == "ONLINE":
+            self.presence.add_remote(name)
+        else:
+            self.presence.remove_remote(name)
+        data = text_frame(event)
+        for client in self.presence.connections():
+            await client.send(data)
+
+    async def send_direct(self, conn, target, text):
+        sender = self.presence.name_of(conn)
+        receiver = self.presence.lookup(target)
+        if sender is None or receiver is None:
+            await conn.send(text_frame(f"DM_FAILED:{target}"), wait=True)
+            return
+        data = text_frame(f"DM_FROM:{sender}:{text}")
+        if receiver is REMOTE:
+            self.bus.publish(data, room=target, direct=True)
+        else:
+            await receiver.send(data)
+
+    async def deliver_blob(self, room, reference):
+        digest, header = reference.split(":", 1)
+        path = self.store.path_for(digest)
+        for client in self.rooms.members(room):
+            await self.send_path(client, header, path, header.split(":", 1)[1], wait=False)
+
+    def apply_typing(self, room, message, owner=None):
+        kind, name = message.split(":", 1)
+        return self.typing.update(room, name, kind == "TYPING", owner)
+
+    def update_typing(self, conn, message):
+        """타이핑 이벤트는 상태에 반영만 하므로 기다릴 일이 없음 (버스에는 상태가 바뀐 경우만)"""
+        room = conn.room
+        if room is not None and self.apply_typing(room, message, conn) and self.bus is not None:
+            self.bus.publish(message.encode('utf-8'), room=room, typing=True)
+
+    def stop_typing(self, conn):
+        previous = self.typing.drop(conn)
+        if previous is not None and self.bus is not None:
+            room, name = previous
+            self.bus.publish(f"TYPING_STOP:{name}".encode('utf-8'), room=room, typing=True)
+
+    async def typing_loop(self):
+        while True:
+            await asyncio.sleep(TYPING_TICK)
+            for room, names in self.typing.tick():
+                await self.deliver(text_frame(typing_state_message(names)), droppable=True, room=room)
+
+    def render_metrics(self):
+        return self.metrics.render(list(self.clients), self.write_stats)
+
+    async def send_metrics(self, conn):
+        if not is_local_address(conn.addr):
+            await conn.send(text_frame("METRICS_DENIED"), wait=True)
+            return
+        await conn.send(text_frame("METRICS:" + self.render_metrics()), wait=True)
+
+    async def negotiate_compression(self, reader, conn, offer):
+        """압축을 협상하고, 이후 이 연결에서 읽을 때 쓸 reader를 돌려줍니다."""
+        accepted = accept_offer(self.compression, offer)
+        reader = self.enable_compression(reader, conn, accepted)
+        await conn.send(text_frame("COMPRESS_OK:" + ",".join(accepted)), wait=True)
+        return reader
+
+    def enable_compression(self, reader, conn, accepted):
+        if accepted and conn.deflater is None:
+            reader = AsyncInflatingReader(reader, Inflater(conn.compression))
+            conn.deflater = Deflater(conn.compression, files="files" in accepted)
+        return reader
+
+    async def enable_streams(self, conn):
+        self.multiplex(conn)
+        await conn.send(text_frame("STREAMS_OK"), wait=True)
+
+    def multiplex(self, conn):
+        conn.multiplexed = True
+        sock = conn.writer.get_extra_info('socket')
+        if sock is not None:
+            set_stream_lowat(sock)
+
+    async def reap_loop(self):
+        while True:
+            await asyncio.sleep(self.reaper.interval)
+            if self.reloading:
+                continue
+            now = time.monotonic()
+            for conn in list(self.clients):
+                action = self.reaper.check(conn.liveness, now)
+                if action in REAP_REASONS:
+                    self.reap(conn, action)
+                elif action is not None:
+                    await conn.send(text_frame(action), droppable=True)
+
+    def reap(self, conn, reason):
+        print(f"{conn.addr} {'응답이 없어' if reason == REAP_TIMEOUT else '오래 사용하지 않아'} 연결을 닫습니다.")
+        self.metrics.count_reaped(reason)
+        conn.close(abort=True) # 보내지 못한 데이터를 기다리지 않음. 수신 코루틴이 EOF를 받고 정리함
+
+    async def reload_loop(self, r_sock):
+        r_sock.setblocking(False)
+        peer, _ = await asyncio.get_running_loop().sock_accept(r_sock)
+        peer.setblocking(True) # 넘기기는 스레드에서 블로킹 소켓으로
+        await self.hand_over(peer)
+
+    async def hand_over(self, peer):
+        """MultiChatServer.hand_over와 같음. 리스닝 소켓은 닫지 않고 이벤트 루프에서 빼서 수락만 멈춥니다."""
+        print("재시작 요청을 받았습니다. 연결들을 멈추는 중 ...")
+        self.reloading = True
+        loop = asyncio.get_running_loop()
+        listeners = []
+        for server in self.servers:
+            for sock in server.sockets:
+                loop.remove_reader(sock.fileno())
+                listeners.append(sock)
+        for conn in list(self.clients):
+            await conn.send(text_frame("RELOAD"), wait=True)
+        deadline = time.monotonic() + RELOAD_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(RELOAD_POLL) # 먼저 기다려서 막 수락한 연결도 목록에 들어오게 함
+            if all(conn in self.parked and not conn.streams for conn in self.clients):
+                break
+        handed = []
+        for conn in list(self.clients):
+            sock = await conn.detach() if conn in self.parked else None
+            if sock is None:
+                conn.close(abort=True)
+                continue
+            handed.append((sock, connection_state(conn, self.presence.name_of(conn))))
+        try:
+            await asyncio.to_thread(send_handoff, peer, listeners, handed)
+        except OSError as e:
+            print(f"새 프로세스로 연결을 넘기지 못했습니다: {e}", flush=True)
+            os._exit(1)
+        print(f"연결 {len(handed)}개를 새 프로세스로 넘기고 종료합니다.", flush=True)
+        os._exit(0)
+
+    async def stats_loop(self):
+        last = None
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            if self.write_stats.messages != last:
+                last = self.write_stats.messages
+                print(f"송신 통계: {self.write_stats.summary()}")
+
+
+SERVER_ENGINES = {
+    'thread': MultiChatServer,  # 클라이언트마다 스레드 하나 (기존 방식)
+    'asyncio': AsyncMultiChatServer,  # 모든 연결을 하나의 이벤트 루프에서 처리
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="멀티 채팅 서버")
+    parser.add_argument('--engine', choices=SERVER_ENGINES, default='thread',
+                        help="서버 엔진 선택 (thread: 스레드 방식, asyncio: 이벤트 루프 방식)")
+    parser.add_argument('--port', type=int, default=2500, help="서버 포트 번호")
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="연결마다 송신 큐에 쌓을 수 있는 메시지 수")
+    parser.add_argument('--overflow', choices=OVERFLOW_POLICIES, default=OVERFLOW_DROP_TYPING,
+                        help="송신 큐가 가득 찼을 때 처리 방식 (drop_typing: 타이핑 이벤트만 버리고 나머지는 연결 종료, "
+                             f"disconnect: 연결 종료, block: 큐 밖에 쌓아 두고 {DEFAULT_BLOCK_TIMEOUT:g}초 넘게 밀리면 연결 종료. "
+                             "보내는 쪽은 어느 방식이든 기다리지 않음)")
+    parser.add_argument('--storage', default='uploads', help="업로드 파일 저장소 디렉터리")
+    parser.add_argument('--thumbnail-workers', type=int, default=THUMBNAIL_WORKERS,
+                        help="이미지 미리보기를 만드는 프로세스 수 (0이면 원본을 그대로 중계)")
+    parser.add_argument('--history', type=int, default=HISTORY_SIZE,
+                        help="방마다 보관하고 입장할 때 다시 보내 주는 최근 메시지 수")
+    parser.add_argument('--flush-interval', type=float, default=DEFAULT_FLUSH_INTERVAL,
+                        help="작은 프레임을 모았다가 한 번에 쓰기까지 기다리는 시간(초)")
+    parser.add_argument('--flush-bytes', type=int, default=DEFAULT_FLUSH_BYTES,
+                        help="모은 프레임이 이 크기가 되면 바로 씀 (0이면 묶지 않고 메시지마다 씀)")
+    parser.add_argument('--transfer-window', type=int, default=TRANSFER_WINDOW,
+                        help="업로드 한 건이 서버가 처리하기 전에 보낼 수 있는 양이자 이미지 중계 창의 크기(바이트)")
+    parser.add_argument('--compression', choices=COMPRESSION_MODES, default=COMPRESSION_TEXT,
+                        help="클라이언트가 제안하면 허용할 압축 (off: 안 함, text: 채팅 프레임, files: 파일 본문까지)")
+    parser.add_argument('--heartbeat-interval', type=float, default=HEARTBEAT_INTERVAL,
+                        help="조용한 연결에 PING을 보내고 연결들을 점검하는 간격(초). 0이면 하트비트와 정리를 하지 않음")
+    parser.add_argument('--heartbeat-timeout', type=float, default=HEARTBEAT_TIMEOUT,
+                        help="이 시간(초) 동안 아무것도 받지 못한 연결을 닫음 (TCP keepalive도 이에 맞춤)")
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help="하트비트 말고 보낸 것이 없는 연결을 닫는 시간(초). 0이면 닫지 않음")
+    parser.add_argument('--io-workers', type=int, default=IO_WORKERS,
+                        help="업로드 본문을 디스크에 쓰고 fsync하는 I/O 스레드 수")
+    parser.add_argument('--max-connections', type=int, default=MAX_CONNECTIONS,
+                        help="동시에 받을 최대 연결 수. 넘으면 새 연결은 THROTTLED로 거절 (0이면 제한 없음)")
+    parser.add_argument('--accept-rate', type=float, default=ACCEPT_RATE,
+                        help="초당 받을 새 연결 수. 넘으면 THROTTLED로 거절 (0이면 제한 없음)")
+    parser.add_argument('--message-rate', type=float, default=MESSAGE_RATE,
+                        help="연결마다 초당 처리할 메시지 수. 넘은 채팅은 버리고 THROTTLED로 알리며, 답을 기다리는 명령은 "
+                             "THROTTLED로 다시 보내라고 답하고, 업로드 명령은 늦게 처리함 (0이면 제한 없음)")
+    parser.add_argument('--message-burst', type=int, default=MESSAGE_BURST,
+                        help="연결마다 몰아서 처리할 수 있는 메시지 수")
+    parser.add_argument('--upload-rate', type=int, default=UPLOAD_RATE,
+                        help="연결마다 초당 받을 업로드 본문 바이트 수. 넘으면 늦게 읽어 업로더를 늦춤 (0이면 제한 없음)")
+    parser.add_argument('--stats-interval', type=float, default=0,
+                        help="송신 통계(메시지당 소켓 쓰기 횟수)를 출력하는 간격(초). 0이면 출력하지 않음")
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help="계측 값을 Prometheus 텍스트로 제공할 로컬 포트 (0이면 사용 안 함, 워커마다 1씩 증가)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="같은 포트를 SO_REUSEPORT로 나누어 받는 서버 프로세스 수 (1이면 단일 프로세스)")
+    parser.add_argument('--reload-socket', default=None,
+                        help="무중단 재시작 요청을 받을 유닉스 소켓 경로 (새 서버를 같은 경로와 --takeover로 실행)")
+    parser.add_argument('--takeover', action='store_true',
+                        help="--reload-socket에서 실행 중인 서버의 리스닝 소켓과 연결들을 넘겨받아 시작")
+    args = parser.parse_args()
+    if args.transfer_window <= 0:
+        parser.error("--transfer-window는 1 이상이어야 합니다.")
+    if args.heartbeat_interval > 0 and args.heartbeat_timeout <= args.heartbeat_interval:
+        parser.error("--heartbeat-timeout은 --heartbeat-interval보다 길어야 합니다.")
+    if args.io_workers <= 0:
+        parser.error("--io-workers는 1 이상이어야 합니다.")
+    if min(args.max_connections, args.accept_rate, args.message_rate, args.upload_rate) < 0:
+        parser.error("--max-connections, --accept-rate, --message-rate, --upload-rate는 0 이상이어야 합니다.")
+    if args.message_rate > 0 and args.message_burst <= 0:
+        parser.error("--message-burst는 1 이상이어야 합니다.")
+    if args.takeover and not args.reload_socket:
+        parser.error("--takeover는 --reload-socket과 함께 사용해야 합니다.")
+    if args.reload_socket and args.workers > 1:
+        parser.error("--reload-socket은 단일 프로세스 모드(--workers 1)에서만 사용할 수 있습니다.")
+    options = dict(queue_size=args.queue_size, overflow_policy=args.overflow,
+                   storage_dir=args.storage, thumbnail_workers=args.thumbnail_workers,
+                   history_size=args.history, flush_interval=args.flush_interval,
+                   flush_bytes=args.flush_bytes, transfer_window=args.transfer_window,
+                   compression=args.compression, heartbeat_interval=args.heartbeat_interval,
+                   heartbeat_timeout=args.heartbeat_timeout, idle_timeout=args.idle_timeout,
+                   io_workers=args.io_workers, max_connections=args.max_connections, accept_rate=args.accept_rate,
+                   message_rate=args.message_rate, message_burst=args.message_burst, upload_rate=args.upload_rate,
+                   stats_interval=args.stats_interval, metrics_port=args.metrics_port,
+                   reload_path=args.reload_socket, takeover=args.takeover)
+    if args.workers > 1: # 워커 프로세스들을 띄우고 로컬 버스로 하나의 채팅방처럼 묶음
+        run_cluster(SERVER_ENGINES[args.engine], args.workers, args.port, **options)
+    else: # 선택한 엔진으로 서버 인스턴스 생성 및 실행
+        SERVER_ENGINES[args.engine](args.port, **options)
\ No newline at end of file
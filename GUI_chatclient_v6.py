@@ -1,348 +1,829 @@
-from tkinter import *
-from tkinter.scrolledtext import ScrolledText
-from tkinter.filedialog import askopenfilename, asksaveasfilename
-from threading import *
-from socket import *
-from tkinter.font import Font
-import time
-import os
-from PIL import Image, ImageTk
-import io
-
-# 이모지 코드와 유니코드 매핑
-EMOJI_MAP = {
-    ":thumbs_up:": "👍",
-    ":heart:": "❤️",
-}
-
-class ChatClient:
-    def __init__(self, ip, port):
-        self.client_socket = None  # 클라이언트 소켓
-        self.images = []  # ImageTk PhotoImage 객체를 저장해 가비지 컬렉션 방지
-        self.initialize_socket(ip, port)  # 서버 연결
-        self.initialize_gui()  # GUI 초기화
-        self.listen_thread()  # 서버로부터 메시지를 받는 스레드 시작
-        self.typing_statuses = set()  # 현재 입력 중인 사용자 목록 관리
-        self.downloading = False  # 파일 다운로드 중 상태 관리
-        self.typing_status = False  # 현재 클라이언트의 타이핑 상태
-
-    def initialize_socket(self, ip, port):
-        """서버와 소켓 연결을 초기화합니다."""
-        self.client_socket = socket(AF_INET, SOCK_STREAM) #TCP 소켓 생성
-        self.client_socket.connect((ip, port)) # 서버 연결
-
-    def send_chat(self):
-        """입력한 채팅 메시지를 서버로 전송합니다."""
-        senders_name = self.name_widget.get().strip() #이름 입력
-        data = self.enter_text_widget.get(1.0, 'end').strip() #채팅 입력
-
-        # 이모지 코드 변환
-        for code, emoji in EMOJI_MAP.items(): #이모지 코드 변환
-            data = data.replace(code, emoji)
-
-        # 메시지 전송
-        if data:
-            message = f"{senders_name}: {data}" #메시지 포맷
-            self.client_socket.send(message.encode('utf-8')) # 메시지 서버로 전송
-
-            # 채팅창에 본인이 보낸 메시지 표시
-            self.chat_transcript_area.insert('end', message + '\n')
-            self.chat_transcript_area.yview(END)
-
-            # 입력창 초기화
-            self.enter_text_widget.delete(1.0, 'end')
-
-            # 메시지 전송 후 입력창이 비었으므로 타이핑 중단 메시지 전송 필요 여부 체크
-            current_text = self.enter_text_widget.get(1.0, 'end').strip()
-            if not current_text and self.typing_status:
-                self.typing_status = False
-                sender_name = self.name_widget.get().strip()
-                self.client_socket.send(f"TYPING_STOP:{sender_name}".encode('utf-8'))
-
-    def add_emoji_to_text(self, emoji_code):
-        """텍스트 입력 위젯에 이모지 코드를 추가합니다."""
-        current_text = self.enter_text_widget.get(1.0, 'end').strip()
-        new_text = f"{current_text} {emoji_code}"
-        self.enter_text_widget.delete(1.0, 'end')
-        self.enter_text_widget.insert('end', new_text)
-
-    def send_file(self):
-        """파일을 선택하여 서버로 전송합니다."""
-        filepath = askopenfilename() #파일 탐색기 창을 열어 파일 경로를 선택
-        if not filepath:
-            return
-        filename = filepath.split("/")[-1] #파일 경로에서 파일명만 추출
-        self.client_socket.send(f"FILE:{filename}".encode('utf-8')) #서버에 "FILE:파일명" 메시지를 보냄
-        with open(filepath, "rb") as f: #파일을 이진 모드로 열기(읽기 전용)
-            while chunk := f.read(1024): #파일의 내용을 1024바이트 단위로 읽기 (메모리 효율을 위해 잘라서 보냄)
-                self.client_socket.send(chunk) #서버에 파일 조각을 전송
-        self.client_socket.send(b"END_OF_FILE")  # 서버에 END_OF_FILE 종료 신호 전송
-        self.chat_transcript_area.insert('end', f"파일 {filename} 전송 완료\n")
-        self.chat_transcript_area.yview(END)
-
-    def download_file(self, filename):
-        """서버로부터 파일을 다운로드합니다."""
-        if self.downloading: #이미 다운중이면 리턴
-            return
-        self.downloading = True #아니면 다운로드 상태를 True로 변경
-
-        save_path = asksaveasfilename(initialfile=filename) # 저장할 파일 경로 선택
-        if not save_path: #사용자가 파일 경로를 선택하지 않고 취소를 눌렀다면
-            self.downloading = False #다운로드 상태 해제
-            return # 함수 종료
-
-        self.client_socket.send(f"DOWNLOAD:{filename}".encode('utf-8')) # 서버에 파일 다운로드 요청
-        try:
-            with open(save_path, "wb") as f: # 저장할 파일을 바이너리 모드로 엽니다.
-                buffer = b"" # 파일 데이터를 임시로 보관하는 버퍼
-                while True:
-                    data = self.client_socket.recv(1024) # 서버로부터 1024바이트 데이터 수신
-                    if not data: # 데이터가 없으면 연결 종료
-                        break
-                    buffer += data # 버퍼에 데이터 추가
-                    if b"END_OF_FILE" in buffer: # "END_OF_FILE" 신호가 수신되었다면
-                        idx = buffer.index(b"END_OF_FILE") # END_OF_FILE의 인덱스를 찾고
-                        f.write(buffer[:idx]) # END_OF_FILE 이전의 파일 데이터를 파일에 씁니다.
-                        break
-            self.chat_transcript_area.insert('end', f"파일 {filename} 다운로드 완료\n")
-            self.chat_transcript_area.yview(END)
-        except Exception as e:
-            self.chat_transcript_area.insert('end', f"파일 다운로드 중 오류 발생: {e}\n")
-        finally:
-            self.downloading = False # 다운로드 상태 해제 (다른 파일 다운로드 가능)
-
-    def handle_enter_key(self, event):
-        """엔터키 입력 시 메시지를 전송하고 기본 동작(줄바꿈)을 막습니다."""
-        self.send_chat()
-        return "break"  # 기본 줄바꿈 동작을 방해
-
-    def initialize_gui(self):
-        """클라이언트 GUI를 초기화합니다."""
-        self.root = Tk()
-        self.root.title("Chat Client")
-
-        custom_font = Font(family="Arial Unicode MS", size=12)
-        fr = [Frame(self.root) for _ in range(6)]
-        for f in fr:
-            f.pack(fill=BOTH)
-
-        # 이름 및 메시지 수신 영역
-        self.name_label = Label(fr[0], text='이름:', font=custom_font)
-        self.name_widget = Entry(fr[0], width=15, font=custom_font)
-        self.recv_label = Label(fr[1], text='받은 메시지:', font=custom_font)
-        self.chat_transcript_area = ScrolledText(fr[2], height=20, width=60, font=custom_font)
-
-        # 전송 및 파일 버튼
-        self.send_btn = Button(fr[4], text='전송', command=self.send_chat, font=custom_font)
-        self.file_btn = Button(fr[4], text='파일 전송', command=self.send_file, font=custom_font)
-
-        #이미지 전송 버튼
-        self.image_btn = Button(fr[4], text='이미지 전송', command=self.send_image, font=custom_font)
-        self.image_btn.pack(side=RIGHT, padx=5)
-        
-        # 이모지 버튼 영역
-        self.emoji_frame = Frame(fr[3])
-        self.emoji_frame.pack(fill=BOTH)
-        self.emoji_thumbsup_btn = Button(self.emoji_frame, text="👍", font=custom_font, command=lambda: self.add_emoji_to_text(":thumbs_up:"))
-        self.emoji_heart_btn = Button(self.emoji_frame, text="❤️", font=custom_font, command=lambda: self.add_emoji_to_text(":heart:"))
-        self.emoji_thumbsup_btn.pack(side=LEFT, padx=5)
-        self.emoji_heart_btn.pack(side=LEFT, padx=5)
-
-        # 타이핑 상태 레이블
-        self.typing_status_label = Label(fr[5], text='', font=custom_font, fg="blue")
-        self.typing_status_label.pack(side=TOP, fill=BOTH, padx=5, pady=2)
-
-        # 메시지 입력 영역
-        self.enter_text_widget = ScrolledText(fr[5], height=5, width=60, font=custom_font)
-
-        # 키 입력 시 타이핑 상태 업데이트
-        self.enter_text_widget.bind("<KeyPress>", self.notify_typing) # 위젯.bind(이벤트, 이벤트 발생 시 호출할 함수)
-
-        # **엔터 키를 이용한 메시지 전송**  
-        # 텍스트 위젯에서 엔터 키를 누르면 handle_enter_key가 호출되도록 바인딩
-        self.enter_text_widget.bind("<Return>", self.handle_enter_key) # 위젯.bind(이벤트, 이벤트 발생 시 호출할 함수)
-
-        self.name_label.pack(side=LEFT)
-        self.name_widget.pack(side=LEFT)
-        self.recv_label.pack(side=LEFT)
-        self.send_btn.pack(side=RIGHT, padx=5)
-        self.file_btn.pack(side=RIGHT, padx=5)
-        self.chat_transcript_area.pack(side=LEFT, padx=5, pady=5)
-        self.enter_text_widget.pack(side=LEFT, padx=5, pady=5)
-
-    def notify_typing(self, event=None):
-        """키를 누를 때마다 텍스트 유무를 확인해 타이핑 상태를 갱신합니다."""
-        current_text = self.enter_text_widget.get(1.0, 'end').strip()
-        sender_name = self.name_widget.get().strip()
-
-        # 입력창에 문자가 있고, 현재 타이핑 상태가 아니라면 TYPING 전송
-        if current_text and not self.typing_status:
-            self.typing_status = True
-            self.client_socket.send(f"TYPING:{sender_name}".encode('utf-8'))
-
-        # 입력창이 비어있고, 현재 타이핑 상태라면 TYPING_STOP 전송
-        elif not current_text and self.typing_status:
-            self.typing_status = False
-            self.client_socket.send(f"TYPING_STOP:{sender_name}".encode('utf-8'))
-
-    def listen_thread(self):
-        """서버로부터 수신하는 스레드를 시작합니다."""
-        t = Thread(target=self.receive_message, args=(self.client_socket,))
-        t.daemon = True
-        t.start()
-
-    def send_image(self):
-        """이미지를 선택하여 서버로 전송"""
-        filepath = askopenfilename(filetypes=[("Image Files", "*.png;*.jpg;*.jpeg;*.gif")])
-        if not filepath:
-            return
-        filename = filepath.split("/")[-1]
-        # 서버에 IMAGE:filename 메시지 전송
-        self.client_socket.send(f"IMAGE:{filename}".encode('utf-8'))
-        # 이미지 바이너리 전송
-        with open(filepath, "rb") as f:
-            while chunk := f.read(1024):
-                self.client_socket.send(chunk)
-        self.client_socket.send(b"END_OF_FILE")
-        
-    def receive_file(self, so, filename):
-        """파일 수신 처리 (파일 시작 신호 이후 호출)."""
-        save_path = asksaveasfilename(initialfile=filename) # 사용자에게 파일 저장 경로와 파일명을 선택하게 함
-        if not save_path: # 사용자가 경로를 선택하지 않고 취소를 누르면
-            self.discard_file_data(so) # 서버로부터 더 이상 데이터 받지 않고 버림
-            return
-        try:
-            with open(save_path, "wb") as f: # 저장할 파일을 바이너리 모드로 엽니다.
-                buffer = b"" # 수신한 데이터를 임시로 저장하는 버퍼
-                while True: 
-                    data = so.recv(1024) # 서버로부터 1024 바이트씩 수신
-                    if not data: # 데이터가 없으면 연결이 종료되었다고 판단
-                        break
-                    buffer += data # 수신한 데이터를 버퍼에 추가
-                    if b"END_OF_FILE" in buffer: # END_OF_FILE 신호가 수신되었다면
-                        idx = buffer.index(b"END_OF_FILE") # END_OF_FILE 위치 찾기
-                        f.write(buffer[:idx]) # END_OF_FILE 이전의 데이터만 파일에 씁니다.
-                        break
-                self.chat_transcript_area.insert('end', f"파일 {filename} 다운로드 완료\n")
-                self.chat_transcript_area.yview(END)
-        except Exception as e:
-            self.chat_transcript_area.insert('end', f"파일 다운로드 중 오류 발생: {e}\n")
-        finally:
-            print(f"파일 다운로드 완료: {filename}")
-
-    def discard_file_data(self, so):
-        """파일 저장 취소 시 파일 데이터를 소진하기 위한 함수."""
-        buffer = b"" # 수신한 데이터를 누적할 버퍼
-        while True:
-            data = so.recv(1024) # 1024 바이트씩 수신
-            if not data: # 데이터가 비어 있으면 (서버 연결 종료)
-                break
-            buffer += data # 수신한 데이터를 버퍼에 추가
-            if b"END_OF_FILE" in buffer: # END_OF_FILE 신호가 발견되면
-                break # 루프 종료
-
-    def update_typing_status(self):
-        """현재 입력 중인 클라이언트 목록을 바탕으로 상태 레이블을 업데이트합니다."""
-        if not self.typing_statuses: 
-            self.typing_status_label.config(text="") # 상태 레이블을 비웁니다.
-            return # 함수 종료
-
-        count = len(self.typing_statuses)
-        if count == 1:
-            user = list(self.typing_statuses)[0] # 입력 중인 사용자 중 첫 번째 사용자
-            self.typing_status_label.config(text=f"{user}님이 입력 중...") # 상태 레이블에 메시지 설정
-        elif count <= 3:
-            users = " ".join([f"{u}님" for u in self.typing_statuses]) # 모든 사용자 이름을 "님"으로 포맷
-            self.typing_status_label.config(text=f"{users} 입력 중...") # 상태 레이블에 메시지 설정
-        else:
-            users = list(self.typing_statuses) # 집합(set)을 리스트로 변환
-            first_user = users[0] # 첫 번째 사용자
-            others_count = count - 1 # 나머지 사용자 수
-            self.typing_status_label.config(text=f"{first_user}님 외 {others_count}명 입력 중...") # 상태 메시지
-
-    def receive_message(self, so):
-        """서버로부터 메시지를 수신하고, 그에 따라 UI를 업데이트합니다."""
-        while True:
-            try:
-                buf = so.recv(1024) # 1024 바이트씩 서버로부터 데이터를 수신
-                if not buf: # 서버로부터 받은 데이터가 없으면 (연결이 끊어진 경우)
-                    break
-                
-                # 이미지 수신 시작 신호 확인
-                if buf.startswith(b"IMAGE_START:"):
-                    header, filename = buf.decode('utf-8').split(":")
-                    image_data = self.receive_image_data(so)
-                    if image_data:
-                        # 이미지 데이터를 Pillow를 통해 ImageTk.PhotoImage로 변환
-                        image = Image.open(io.BytesIO(image_data))
-                        
-                        # 여기서 이미지 크기 조정 (10x10)
-                        image = image.resize((150, 150), Image.LANCZOS)  # PIL 9.1.0 이후 ANTIALIAS 대신 LANCZOS 사용
-                        
-                        photo = ImageTk.PhotoImage(image)
-                        self.images.append(photo)  # 참조 유지
-                        self.chat_transcript_area.insert('end', f"{filename} 이미지 수신:\n")
-                        self.chat_transcript_area.image_create('end', image=photo)
-                        self.chat_transcript_area.insert('end', '\n')
-                        self.chat_transcript_area.yview('end')
-                    continue
-
-
-                # 파일 수신 시작 신호 확인
-                elif buf.startswith(b"FILE_START:"):
-                    header, filename = buf.decode('utf-8').split(":")
-                    filename = filename.strip() # 파일명 앞뒤 공백 제거
-                    self.chat_transcript_area.insert('end', f"{filename} 다운로드 중...\n") # 채팅창에 알림
-                    self.chat_transcript_area.yview("end") # 스크롤 아래로 이동
-                    self.receive_file(so, filename) # 파일 다운로드 메서드 호출
-                    # 파일 처리 후 다음 루프로 이동
-                    continue
-
-                # 일반 메시지 처리
-                else:
-                    try:
-                        decoded_msg = buf.decode('utf-8') # 수신한 데이터를 UTF-8로 디코딩
-                        if decoded_msg.startswith("NEW_FILE:"):
-                            filename = decoded_msg.split(":")[1] # NEW_FILE: 파일명
-                            self.chat_transcript_area.insert('end', f"새 파일 수신: {filename} (클릭하여 다운로드)\n")
-                            self.chat_transcript_area.tag_add(filename, "end-2l", "end-1l")
-                            self.chat_transcript_area.tag_bind(
-                                filename, "<Button-1>", lambda e, fname=filename: self.client_socket.send(f"DOWNLOAD:{fname}".encode('utf-8'))
-                            )
-                        elif decoded_msg.startswith("TYPING:"):
-                            sender_name = decoded_msg.split(":")[1] # 입력 중인 사용자 이름 추출
-                            self.typing_statuses.add(sender_name) # 입력 중인 사용자 추가
-                            self.update_typing_status() # UI 상태 업데이트
-                        elif decoded_msg.startswith("TYPING_STOP:"):
-                            sender_name = decoded_msg.split(":")[1]
-                            if sender_name in self.typing_statuses:
-                                self.typing_statuses.remove(sender_name) # 입력 중단
-                            self.update_typing_status()
-                        else: # 일반적인 채팅 메시지는 그대로 채팅창에 출력
-                            self.chat_transcript_area.insert('end', decoded_msg + '\n')
-                            self.chat_transcript_area.yview("end")
-                    except UnicodeDecodeError:
-                        pass
-            except Exception as e:
-                print(f"receive_message 오류: {e}")
-                break
-
-
-    def receive_image_data(self, so):
-        """IMAGE_START 수신 이후 END_OF_FILE 까지 이미지를 수신"""
-        image_buffer = b""
-        while True:
-            data = so.recv(1024)
-            if not data:
-                break
-            if b"END_OF_FILE" in data:
-                image_buffer += data.split(b"END_OF_FILE")[0]
-                break
-            image_buffer += data
-        return image_buffer
-    
-if __name__ == "__main__":
-    ip = '127.0.0.1'
-    port = 2500
-    ChatClient(ip, port)
-    mainloop()
+from tkinter import *
+from tkinter.scrolledtext import ScrolledText
+from tkinter.filedialog import askopenfilename, asksaveasfilename
+from threading import *
+from socket import *
+from tkinter.font import Font
+import time
+import os
+import itertools
+from PIL import Image, ImageTk
+import io
+from chat_protocol import (FRAME_TEXT, FRAME_STREAM, TRANSFER_CHUNK_SIZE, INITIAL_CREDIT, ChecksumError, text_frame,
+                           read_frame, iter_body, iter_chunks, skip_body, iter_file_frames, iter_file_chunks,
+                           iter_stream_frames, body_credit)
+from chat_blobstore import file_digest
+from chat_heartbeat import set_keepalive
+from chat_compression import (COMPRESSION_OFFER, CompressionStats, Deflater, Inflater, InflatingSocket,
+                              compressible, is_compressed_file)
+from chat_ratelimit import THROTTLE_CONNECTIONS, THROTTLE_ACCEPTS, THROTTLE_MESSAGES
+from chat_reload import RELOAD_TIMEOUT
+from chat_streams import StreamTable, set_stream_lowat
+from chat_ranges import PARALLEL_MIN_SIZE, RANGE_CONNECTIONS, ParallelDownload
+from chat_delta import DELTA_MIN_SIZE, compute_delta, iter_delta_frames
+
+RECONNECT_INTERVAL = 2  # 서버 연결이 끊겼을 때 다시 접속을 시도하는 간격(초)
+TYPING_REFRESH = 2  # 입력 중일 때 TYPING을 다시 보내는 간격(초). 서버는 한동안 소식이 없으면 입력 중 표시를 지움
+MAX_SHOWN_USERS = 10  # 접속자 레이블에 이름을 보여 주는 최대 인원
+
+# 이모지 코드와 유니코드 매핑
+EMOJI_MAP = {
+    ":thumbs_up:": "👍",
+    ":heart:": "❤️",
+}
+
+class ChatClient:
+    def __init__(self, ip, port):
+        self.client_socket = None  # 클라이언트 소켓
+        self.images = []  # ImageTk PhotoImage 객체를 저장해 가비지 컬렉션 방지
+        self.send_lock = Lock()  # 여러 스레드가 보내는 프레임이 서로 섞이지 않도록 보호
+        self.credit_cond = Condition()  # 업로드 본문을 보낼 크레딧을 기다림 (서버의 CREDIT은 수신 스레드가 받음)
+        self.credit_sent = 0  # 이 연결에서 보낸 본문 바이트 수 (send_lock을 잡고 바꿈)
+        self.credit_limit = INITIAL_CREDIT  # 서버가 허락한 누적 본문 바이트 수
+        self.compression = CompressionStats()  # 이 연결의 압축 전후 바이트 수와 CPU 시간
+        self.deflater = None  # 서버가 COMPRESS_OK로 압축을 허용하면 보내는 방향의 압축 상태
+        self.reloaded = Event()  # 서버 재시작 중 RELOAD_OK를 보낸 뒤 새 서버의 RELOADED를 기다림
+        self.multiplexed = False  # 서버가 STREAMS_OK로 다중화를 허용하면 업로드 본문을 STREAM 프레임으로 보냄
+        self.streams = StreamTable()  # 받는 중인 다운로드/이미지 스트림 (연결마다 새로)
+        self.stream_ids = itertools.count(1, 2)  # 클라이언트가 여는 스트림의 id (홀수)
+        self.stream_cond = Condition()  # 스트림으로 올리는 중인 업로드 수와 재시작 대기를 함께 보호
+        self.sending_streams = 0  # 스트림으로 본문을 보내는 중인 업로드 수
+        self.reload_pending = False  # RELOAD_OK를 보내려고 업로드가 끝나기를 기다리는 중이면 새 업로드를 시작하지 않음
+        self.sending_texts = 0  # send_lock을 잡으려는 중이거나 잡고 보내는 중인 send_text 수
+        self.held_messages = []  # 재시작 중에 보내려던 문자열 메시지. RELOADED를 받은 뒤 순서대로 보냄
+        self.reconnect_delay = 0  # 서버가 접속을 거절하며(THROTTLED) 알려 준, 다시 접속하기 전에 기다릴 시간(초)
+        self.pending_uploads = {}  # 서버의 응답(FILE_ACCEPT)을 기다리는 파일명 -> (파일 경로, 해시)
+        self.uploads = {}  # 서버가 수락한 업로드: 전송 id -> (파일명, 파일 경로, 해시). 재접속 시 이어서 올림
+        self.downloads = {}  # 받는 중인 다운로드: 파일명 -> (저장 경로, 해시). 재접속 시 이어받음
+        self.typing_statuses = set()  # 현재 입력 중인 사용자 목록 관리
+        self.room = "lobby"  # 지금 들어가 있는 방 (서버의 JOINED 응답으로 갱신)
+        self.user_name = None  # 마지막으로 서버에 등록을 요청한 이름 (NAME:)
+        self.online_users = set()  # 접속 중인 사용자 (USERS 스냅샷 뒤로 ONLINE/OFFLINE으로 갱신)
+        self.typing_status = False  # 현재 클라이언트의 타이핑 상태
+        self.typing_sent_at = 0  # 마지막으로 TYPING을 보낸 시각
+        self.initialize_socket(ip, port)  # 서버 연결
+        self.initialize_gui()  # GUI 초기화
+        self.listen_thread()  # 서버로부터 메시지를 받는 스레드 시작
+
+    def initialize_socket(self, ip, port):
+        """서버와 소켓 연결을 초기화합니다."""
+        self.server_address = (ip, port) # 연결이 끊겼을 때 다시 접속할 주소
+        self.client_socket = socket(AF_INET, SOCK_STREAM) #TCP 소켓 생성
+        set_keepalive(self.client_socket) # 서버가 사라지면 커널이 알아채서 다시 접속하도록
+        self.client_socket.connect((ip, port)) # 서버 연결
+        # 압축과 다중화 제안 (응답은 수신 스레드가 받음)
+        self.client_socket.sendall(text_frame(f"COMPRESS:{COMPRESSION_OFFER}") + text_frame("STREAMS"))
+
+    def reconnect(self):
+        """서버에 다시 접속한 뒤, 끊긴 업로드와 다운로드를 마지막으로 받은 위치부터 이어서 요청합니다.
+
+        크레딧을 기다리며 send_lock을 잡고 있는 업로드가 있으면 예전 소켓에 보내다 실패하고 빠져나가도록 깨웁니다.
+        """
+        try:
+            self.client_socket.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+        with self.credit_cond:
+            self.credit_limit = float('inf')
+            self.credit_cond.notify_all()
+        self.reloaded.set() # 재시작을 기다리며 send_lock을 잡고 있는 스레드도 깨움
+        self.streams.close() # 받던 스트림을 읽는 스레드들은 연결 끊김을 보고 끝남 (재접속 후 이어받음)
+        self.streams = StreamTable()
+        if self.reconnect_delay: # 서버가 바쁘다며 거절했으면 알려 준 만큼 기다렸다가 접속
+            time.sleep(self.reconnect_delay)
+            self.reconnect_delay = 0
+        while True:
+            try:
+                so = socket(AF_INET, SOCK_STREAM)
+                set_keepalive(so)
+                so.connect(self.server_address)
+                break
+            except OSError:
+                so.close()
+                time.sleep(RECONNECT_INTERVAL)
+        print(f"압축: {self.compression.summary()}")
+        self.compression = CompressionStats()
+        messages = [f"COMPRESS:{COMPRESSION_OFFER}", "STREAMS"] # 압축 상태와 다중화는 연결마다 새로 협상
+        if self.user_name: # 이름을 다시 등록하면 접속자 목록도 새로 받음
+            messages.append(f"NAME:{self.user_name}")
+        if self.room != "lobby": # 새 연결은 기본 방에서 시작하므로 있던 방으로 다시 입장
+            messages.append(f"JOIN:{self.room}")
+        for transfer_id in list(self.uploads):
+            messages.append(f"FILE_RESUME:{transfer_id}") # 서버가 받은 위치를 FILE_ACCEPT로 알려 줌
+        for filename, (save_path, digest) in list(self.downloads.items()):
+            try:
+                received = os.path.getsize(save_path + ".part")
+            except OSError:
+                received = 0
+            # 마지막 조각은 덜 받았을 수 있으므로 체크섬 조각 경계로 내려서 요청
+            offset = received - received % TRANSFER_CHUNK_SIZE
+            messages.append(f"DOWNLOAD_RESUME:{digest}:{offset}:{filename}")
+        with self.send_lock: # 예전 소켓으로 보내던 스레드가 빠져나간 뒤에 교체
+            self.client_socket.close()
+            self.client_socket = so
+            self.deflater = None # 서버가 다시 COMPRESS_OK로 답할 때까지 압축하지 않음
+            self.multiplexed = False
+            with self.credit_cond: # 새 연결의 크레딧은 처음부터 다시 셈
+                self.credit_sent, self.credit_limit = 0, INITIAL_CREDIT
+            # 교체와 같은 잠금 안에서 보내, 그 사이 시작된 업로드가 크레딧을 기다리며 수신 스레드를 막지 않게 함
+            so.sendall(b"".join(text_frame(message) for message in messages))
+        self.chat_transcript_area.insert('end', "서버에 다시 연결되었습니다.\n")
+        self.chat_transcript_area.yview(END)
+        return InflatingSocket(so, Inflater(self.compression))
+
+    def send_text(self, message):
+        """문자열 메시지(채팅, 명령)를 TEXT 프레임으로 서버에 전송합니다.
+
+        서버 재시작 중에는 acknowledge_reload가 send_lock을 오래 잡고 있으므로, 기다리지 않고 held_messages에
+        넣어 두었다가 RELOADED를 받은 뒤에 보냅니다. (GUI 스레드가 멈추지 않도록)
+        """
+        with self.stream_cond:
+            if self.reload_pending:
+                self.held_messages.append(message)
+                return
+            self.sending_texts += 1
+        try:
+            with self.send_lock:
+                self.client_socket.sendall(self.pack(text_frame(message)))
+        finally:
+            with self.stream_cond:
+                self.sending_texts -= 1
+                self.stream_cond.notify_all()
+
+    def pack(self, frame):
+        """압축을 협상했고 압축할 만한 크기면 프레임을 압축합니다. (send_lock을 잡은 채 보내는 순서대로 호출)"""
+        if self.deflater is not None and compressible(frame):
+            return self.deflater.pack(frame)
+        return frame
+
+    def send_body(self, message, frames, compress=False):
+        """명령 메시지 뒤에 본문 프레임들을 이어서 보냅니다. 서버가 허락한 양을 다 쓰면 다음 CREDIT을 기다립니다.
+
+        본문 중간에 다른 메시지가 끼면 안 되므로 send_lock을 잡은 채로 기다립니다. 그래서 CREDIT을 받는
+        수신 스레드는 send_lock을 기다리는 일(send_text 직접 호출)이 없어야 합니다.
+        compress면 서버가 파일 본문 압축을 허용했을 때 본문 프레임을 압축합니다. (크레딧은 압축 전 크기로 셈)
+        다중화를 협상했으면 send_stream으로 보냅니다.
+        """
+        if self.multiplexed:
+            self.send_stream(message, frames, compress)
+            return
+        with self.send_lock:
+            so = self.client_socket
+            deflater = self.deflater if compress and self.deflater is not None and self.deflater.body else None
+            so.sendall(self.pack(text_frame(message)))
+            for frame in frames:
+                size = body_credit(frame)
+                if size:
+                    with self.credit_cond:
+                        while self.credit_sent >= self.credit_limit:
+                            self.credit_cond.wait()
+                so.sendall(deflater.pack(frame, body=True) if deflater is not None and size else frame)
+                self.credit_sent += size
+
+    def send_stream(self, message, frames, compress=False):
+        """"STREAM:스트림id:명령"으로 스트림을 열고 본문 프레임들을 STREAM 프레임으로 나누어 보냅니다.
+
+        send_lock은 STREAM 프레임 하나를 보낼 때만 잡으므로 그 사이에 채팅과 다른 업로드의 조각이 끼어들고,
+        크레딧도 send_lock 밖에서 기다립니다. 그동안 다시 접속했으면 예전 연결의 스트림이므로 그만둡니다.
+        """
+        with self.stream_cond:
+            while self.reload_pending: # RELOAD_OK를 보낸 뒤에 새 업로드를 시작하지 않음
+                self.stream_cond.wait()
+            self.sending_streams += 1
+        try:
+            sid = next(self.stream_ids)
+            with self.send_lock:
+                so = self.client_socket
+                deflater = self.deflater if compress and self.deflater is not None and self.deflater.body else None
+                so.sendall(self.pack(text_frame(f"STREAM:{sid}:{message}")))
+            for frame in frames:
+                size = body_credit(frame)
+                if size:
+                    with self.credit_cond: # 여러 업로드가 함께 쓰므로 보내기 전에 크레딧을 차지
+                        while self.credit_sent >= self.credit_limit:
+                            self.credit_cond.wait()
+                        if self.client_socket is not so: # 새 연결의 크레딧을 쓰지 않도록
+                            raise ConnectionError("서버에 다시 접속해 업로드를 멈춥니다.")
+                        self.credit_sent += size
+                for segment in iter_stream_frames(sid, frame):
+                    with self.send_lock:
+                        if self.client_socket is not so:
+                            raise ConnectionError("서버에 다시 접속해 업로드를 멈춥니다.")
+                        so.sendall(deflater.pack(segment, body=True) if deflater is not None else segment)
+        finally:
+            with self.stream_cond:
+                self.sending_streams -= 1
+                self.stream_cond.notify_all()
+
+    def acknowledge_reload(self):
+        """서버 재시작(RELOAD)에 답합니다. 올리던 파일을 마저 보낸 뒤 RELOAD_OK를 보내고,
+        새 서버 프로세스가 RELOADED를 보낼 때까지 send_lock을 잡아 아무것도 보내지 않습니다.
+
+        스트림으로 올리는 업로드는 send_lock을 계속 잡고 있지 않으므로 끝나기를 따로 기다립니다.
+        그동안 send_text로 보내려던 메시지는 held_messages에 모였다가 RELOADED 뒤에 같은 잠금 안에서 먼저 보냅니다.
+        """
+        with self.stream_cond:
+            self.reload_pending = True
+            while self.sending_streams or self.sending_texts:
+                self.stream_cond.wait()
+        with self.send_lock:
+            try:
+                self.reloaded.clear()
+                self.client_socket.sendall(self.pack(text_frame("RELOAD_OK")))
+                self.reloaded.wait(RELOAD_TIMEOUT)
+            finally:
+                with self.stream_cond: # 모아 둔 메시지를 꺼낸 뒤에 오는 메시지는 send_lock을 기다렸다가 뒤에 보냄
+                    held, self.held_messages = self.held_messages, []
+                    self.reload_pending = False
+                    self.stream_cond.notify_all()
+            if held:
+                self.client_socket.sendall(b"".join(self.pack(text_frame(message)) for message in held))
+
+    def add_credit(self, limit):
+        """서버의 "CREDIT:n"을 반영하고 기다리던 업로드를 깨웁니다. (수신 스레드)"""
+        with self.credit_cond:
+            self.credit_limit = max(self.credit_limit, limit)
+            self.credit_cond.notify_all()
+
+    def register_name(self, name):
+        """입력한 이름이 바뀌었으면 서버에 "NAME:이름"으로 등록합니다. (DM을 받고 접속자 목록에 보이려면 필요)"""
+        if name and name != self.user_name:
+            self.user_name = name
+            self.send_text(f"NAME:{name}")
+
+    def send_chat(self):
+        """입력한 채팅 메시지를 서버로 전송합니다."""
+        senders_name = self.name_widget.get().strip() #이름 입력
+        data = self.enter_text_widget.get(1.0, 'end').strip() #채팅 입력
+        self.register_name(senders_name)
+
+        # 이모지 코드 변환
+        for code, emoji in EMOJI_MAP.items(): #이모지 코드 변환
+            data = data.replace(code, emoji)
+
+        # 방 입장/퇴장 명령 ("/join 방이름", "/leave")
+        if data.startswith("/join ") or data == "/leave":
+            if self.typing_status: # 지금 방의 다른 사람들에게 남아 있는 "입력 중" 표시를 지움
+                self.typing_status = False
+                self.send_text(f"TYPING_STOP:{senders_name}")
+            self.send_text(f"JOIN:{data[6:].strip()}" if data != "/leave" else "LEAVE")
+            self.enter_text_widget.delete(1.0, 'end')
+            return
+
+        # 개인 메시지 ("/dm 이름 내용"): 서버가 받는 사람에게만 전달
+        if data.startswith("/dm "):
+            target, _, text = data[4:].strip().partition(" ")
+            if target and text.strip():
+                self.send_text(f"DM:{target}:{text.strip()}")
+                self.chat_transcript_area.insert('end', f"[DM -> {target}] {text.strip()}\n")
+                self.chat_transcript_area.yview(END)
+            self.enter_text_widget.delete(1.0, 'end')
+            return
+
+        # 메시지 전송
+        if data:
+            message = f"{senders_name}: {data}" #메시지 포맷
+            self.send_text(message) # 메시지 서버로 전송
+
+            # 채팅창에 본인이 보낸 메시지 표시
+            self.chat_transcript_area.insert('end', message + '\n')
+            self.chat_transcript_area.yview(END)
+
+            # 입력창 초기화
+            self.enter_text_widget.delete(1.0, 'end')
+
+            # 메시지 전송 후 입력창이 비었으므로 타이핑 중단 메시지 전송 필요 여부 체크
+            current_text = self.enter_text_widget.get(1.0, 'end').strip()
+            if not current_text and self.typing_status:
+                self.typing_status = False
+                sender_name = self.name_widget.get().strip()
+                self.send_text(f"TYPING_STOP:{sender_name}")
+
+    def add_emoji_to_text(self, emoji_code):
+        """텍스트 입력 위젯에 이모지 코드를 추가합니다."""
+        current_text = self.enter_text_widget.get(1.0, 'end').strip()
+        new_text = f"{current_text} {emoji_code}"
+        self.enter_text_widget.delete(1.0, 'end')
+        self.enter_text_widget.insert('end', new_text)
+
+    def send_file(self):
+        """파일을 선택하여 서버로 전송합니다."""
+        filepath = askopenfilename() #파일 탐색기 창을 열어 파일 경로를 선택
+        if not filepath:
+            return
+        filename = filepath.split("/")[-1] #파일 경로에서 파일명만 추출
+        self.offer_file(filename, filepath, file_digest(filepath)) #파일 내용의 SHA-256 해시로 제안
+
+    def offer_file(self, filename, filepath, digest, delta=True):
+        """서버에 "FILE_OFFER:해시:크기:파일명"을 보내 같은 내용이 이미 있는지 먼저 확인합니다.
+
+        큰 파일은 "DELTA_OFFER"로 제안해, 서버에 같은 이름의 이전 내용이 있으면 바뀐 블록만 올립니다. (upload_delta)
+        """
+        size = os.path.getsize(filepath)
+        self.pending_uploads[filename] = (filepath, digest) #서버가 FILE_ACCEPT나 DELTA_BASE로 응답하면 본문 전송
+        command = "DELTA_OFFER" if delta and size >= DELTA_MIN_SIZE else "FILE_OFFER"
+        self.send_text(f"{command}:{digest}:{size}:{filename}")
+
+    def upload_delta(self, filename, base, block_size, signatures):
+        """서버가 보낸 이전 내용의 블록 서명으로 변경분을 만들어 "FILE_DELTA"로 보냅니다. (별도 스레드에서 실행)
+
+        바뀐 곳이 많아 변경분을 만들지 않으면 FILE_OFFER로 전체를 올립니다.
+        """
+        if filename not in self.pending_uploads:
+            return
+        filepath, digest = self.pending_uploads[filename]
+        try:
+            with open(filepath, "rb") as f:
+                ops = compute_delta(f, signatures, block_size)
+                if ops is None:
+                    print(f"{filename} 파일은 바뀐 곳이 많아 전체를 올립니다.")
+                    self.offer_file(filename, filepath, digest, delta=False)
+                    return
+                size = os.fstat(f.fileno()).st_size
+                self.send_body(f"FILE_DELTA:{base}:{digest}:{size}:{filename}", iter_delta_frames(f, ops),
+                               compress=not is_compressed_file(filepath))
+        except OSError as e:
+            print(f"{filename} 업로드가 중단되었습니다: {e}")
+
+    def upload_file(self, transfer_id, offset):
+        """서버가 알려 준 위치부터 파일 본문을 CHUNK 프레임으로 전송합니다. (수신 스레드를 막지 않도록 별도 스레드에서 실행)
+
+        도중에 연결이 끊기면 그냥 멈추고, 재접속 후 FILE_RESUME에 대한 서버의 응답으로 다시 호출됩니다.
+        """
+        filename, filepath, digest = self.uploads[transfer_id]
+        try:
+            with open(filepath, "rb") as f: #파일을 이진 모드로 열기(읽기 전용)
+                #위치와 체크섬이 붙은 조각들, 마지막에 END 프레임 (서버가 허락한 만큼씩)
+                self.send_body(f"FILE_CHUNKS:{transfer_id}:{offset}", iter_file_chunks(f, offset),
+                               compress=not is_compressed_file(filepath)) #이미 압축된 형식(zip, jpg 등)은 그대로
+        except OSError as e:
+            print(f"{filename} 업로드가 중단되었습니다: {e}")
+
+    def download_file(self, filename):
+        """서버에 파일의 내용 해시와 크기를 묻습니다. 응답(FILE_INFO)에 따라 download_ranges가 받는 방법을 고릅니다."""
+        self.send_text(f"DOWNLOAD_INFO:{filename}")
+
+    def download_ranges(self, filename, digest, size):
+        """큰 파일은 보조 연결 여러 개로 구간을 나누어 받고, 작은 파일은 채팅 연결로 받습니다. (별도 스레드에서 실행)
+
+        병렬로 받던 파일은 재접속 후 이어받지 않습니다. (.part 파일은 구간마다 채워지므로 받은 위치를 알 수 없음)
+        """
+        if size < PARALLEL_MIN_SIZE or RANGE_CONNECTIONS < 2:
+            self.send_text(f"DOWNLOAD:{filename}") # 본문은 수신 스레드가 FILE_START 이후에 받음
+            return
+        save_path = asksaveasfilename(initialfile=filename) # 사용자에게 파일 저장 경로와 파일명을 선택하게 함
+        if not save_path:
+            return
+        part_path = save_path + ".part"
+        self.chat_transcript_area.insert('end', f"{filename} 다운로드 중... (연결 {RANGE_CONNECTIONS}개)\n")
+        self.chat_transcript_area.yview("end")
+        download = ParallelDownload(self.server_address, digest, size, part_path)
+        if not download.run():
+            self.chat_transcript_area.insert('end', f"파일 {filename} 다운로드가 완료되지 않았습니다: {download.error}\n")
+            self.chat_transcript_area.yview("end")
+            return
+        os.replace(part_path, save_path)
+        self.chat_transcript_area.insert('end', f"파일 {filename} 다운로드 완료\n")
+        self.chat_transcript_area.yview(END)
+        print(f"파일 다운로드 완료: {filename} ({download.summary()})")
+
+    def handle_enter_key(self, event):
+        """엔터키 입력 시 메시지를 전송하고 기본 동작(줄바꿈)을 막습니다."""
+        self.send_chat()
+        return "break"  # 기본 줄바꿈 동작을 방해
+
+    def initialize_gui(self):
+        """클라이언트 GUI를 초기화합니다."""
+        self.root = Tk()
+        self.root.title("Chat Client")
+
+        custom_font = Font(family="Arial Unicode MS", size=12)
+        fr = [Frame(self.root) for _ in range(6)]
+        for f in fr:
+            f.pack(fill=BOTH)
+
+        # 이름 및 메시지 수신 영역
+        self.name_label = Label(fr[0], text='이름:', font=custom_font)
+        self.name_widget = Entry(fr[0], width=15, font=custom_font)
+        self.users_label = Label(fr[0], text='', font=custom_font, fg="gray") # 접속자 목록
+        self.recv_label = Label(fr[1], text='받은 메시지:', font=custom_font)
+        self.chat_transcript_area = ScrolledText(fr[2], height=20, width=60, font=custom_font)
+
+        # 전송 및 파일 버튼
+        self.send_btn = Button(fr[4], text='전송', command=self.send_chat, font=custom_font)
+        self.file_btn = Button(fr[4], text='파일 전송', command=self.send_file, font=custom_font)
+
+        #이미지 전송 버튼
+        self.image_btn = Button(fr[4], text='이미지 전송', command=self.send_image, font=custom_font)
+        self.image_btn.pack(side=RIGHT, padx=5)
+        
+        # 이모지 버튼 영역
+        self.emoji_frame = Frame(fr[3])
+        self.emoji_frame.pack(fill=BOTH)
+        self.emoji_thumbsup_btn = Button(self.emoji_frame, text="👍", font=custom_font, command=lambda: self.add_emoji_to_text(":thumbs_up:"))
+        self.emoji_heart_btn = Button(self.emoji_frame, text="❤️", font=custom_font, command=lambda: self.add_emoji_to_text(":heart:"))
+        self.emoji_thumbsup_btn.pack(side=LEFT, padx=5)
+        self.emoji_heart_btn.pack(side=LEFT, padx=5)
+
+        # 타이핑 상태 레이블
+        self.typing_status_label = Label(fr[5], text='', font=custom_font, fg="blue")
+        self.typing_status_label.pack(side=TOP, fill=BOTH, padx=5, pady=2)
+
+        # 메시지 입력 영역
+        self.enter_text_widget = ScrolledText(fr[5], height=5, width=60, font=custom_font)
+
+        # 키 입력 시 타이핑 상태 업데이트
+        self.enter_text_widget.bind("<KeyPress>", self.notify_typing) # 위젯.bind(이벤트, 이벤트 발생 시 호출할 함수)
+
+        # **엔터 키를 이용한 메시지 전송**  
+        # 텍스트 위젯에서 엔터 키를 누르면 handle_enter_key가 호출되도록 바인딩
+        self.enter_text_widget.bind("<Return>", self.handle_enter_key) # 위젯.bind(이벤트, 이벤트 발생 시 호출할 함수)
+
+        self.name_label.pack(side=LEFT)
+        self.name_widget.pack(side=LEFT)
+        self.users_label.pack(side=LEFT, padx=5)
+        self.recv_label.pack(side=LEFT)
+        self.send_btn.pack(side=RIGHT, padx=5)
+        self.file_btn.pack(side=RIGHT, padx=5)
+        self.chat_transcript_area.pack(side=LEFT, padx=5, pady=5)
+        self.enter_text_widget.pack(side=LEFT, padx=5, pady=5)
+
+    def notify_typing(self, event=None):
+        """키를 누를 때마다 텍스트 유무를 확인해 타이핑 상태를 갱신합니다."""
+        current_text = self.enter_text_widget.get(1.0, 'end').strip()
+        sender_name = self.name_widget.get().strip()
+        self.register_name(sender_name)
+
+        # 입력창에 문자가 있고, 현재 타이핑 상태가 아니거나 마지막으로 알린 지 오래됐다면 TYPING 전송
+        if current_text and (not self.typing_status or time.monotonic() - self.typing_sent_at >= TYPING_REFRESH):
+            self.typing_status = True
+            self.typing_sent_at = time.monotonic()
+            self.send_text(f"TYPING:{sender_name}")
+
+        # 입력창이 비어있고, 현재 타이핑 상태라면 TYPING_STOP 전송
+        elif not current_text and self.typing_status:
+            self.typing_status = False
+            self.send_text(f"TYPING_STOP:{sender_name}")
+
+    def listen_thread(self):
+        """서버로부터 수신하는 스레드를 시작합니다."""
+        # 압축된 프레임은 풀어서 읽음 (서버는 압축 제안을 받으면 바로 압축해 보낼 수 있음)
+        t = Thread(target=self.receive_message, args=(InflatingSocket(self.client_socket, Inflater(self.compression)),))
+        t.daemon = True
+        t.start()
+
+    def send_image(self):
+        """이미지를 선택하여 서버로 전송"""
+        filepath = askopenfilename(filetypes=[("Image Files", "*.png;*.jpg;*.jpeg;*.gif")])
+        if not filepath:
+            return
+        filename = filepath.split("/")[-1]
+        # 서버의 CREDIT을 기다리는 동안 화면이 멈추지 않도록 본문은 별도 스레드에서 전송
+        Thread(target=self.upload_image, args=(filename, filepath), daemon=True).start()
+        # 서버는 보낸 사람에게 이미지를 되돌려 보내지 않으므로 가지고 있는 파일로 바로 표시
+        self.show_image(f"{filename} 이미지 전송:", filepath)
+
+    def upload_image(self, filename, filepath):
+        """IMAGE:filename 메시지 뒤에 이미지 바이너리를 DATA 프레임들과 END 프레임으로 전송합니다."""
+        try:
+            with open(filepath, "rb") as f:
+                self.send_body(f"IMAGE:{filename}", iter_file_frames(f), compress=not is_compressed_file(filepath))
+        except OSError as e:
+            print(f"{filename} 이미지 전송이 중단되었습니다: {e}")
+
+    def show_image(self, caption, source, resize=True, digest=None):
+        """이미지(파일 경로 또는 파일 객체)를 축소해 채팅창에 표시합니다.
+
+        digest가 주어지면 서버가 만든 미리보기이므로, 클릭하면 원본을 요청하도록 연결합니다.
+        """
+        try:
+            # 이미지 데이터를 Pillow를 통해 ImageTk.PhotoImage로 변환
+            image = Image.open(source)
+
+            # 여기서 이미지 크기 조정 (150x150). 서버가 만든 미리보기는 이미 축소되어 있음
+            if resize:
+                image = image.resize((150, 150), Image.LANCZOS)  # PIL 9.1.0 이후 ANTIALIAS 대신 LANCZOS 사용
+        except Exception as e: # 업로드가 중간에 끊겨 잘린 이미지 등
+            self.chat_transcript_area.insert('end', f"{caption} 이미지를 표시할 수 없습니다 ({e})\n")
+            return
+        photo = ImageTk.PhotoImage(image)
+        self.images.append(photo)  # 참조 유지
+        self.chat_transcript_area.insert('end', caption + '\n')
+        index = self.chat_transcript_area.image_create('end', image=photo)
+        if digest: # 미리보기를 클릭하면 원본 이미지를 서버에 요청
+            tag = f"image-{digest}"
+            self.chat_transcript_area.tag_add(tag, index)
+            self.chat_transcript_area.tag_bind(tag, "<Button-1>", lambda e: self.send_text(f"IMAGE_FETCH:{digest}"))
+        self.chat_transcript_area.insert('end', '\n')
+        self.chat_transcript_area.yview('end')
+
+    def show_full_image(self, image_data):
+        """원본 이미지를 새 창에 표시합니다."""
+        try:
+            image = Image.open(io.BytesIO(image_data))
+            photo = ImageTk.PhotoImage(image)
+        except Exception as e:
+            self.chat_transcript_area.insert('end', f"원본 이미지를 표시할 수 없습니다 ({e})\n")
+            return
+        window = Toplevel(self.root)
+        window.title("원본 이미지")
+        label = Label(window, image=photo)
+        label.image = photo  # 참조 유지
+        label.pack()
+
+    def receive_file(self, so, filename, digest, size, offset):
+        """파일 수신 처리 (파일 시작 신호 이후 호출).
+
+        받은 조각은 "저장경로.part"의 해당 위치에 쓰고, 끝까지 받으면 저장 경로로 이름을 바꿉니다.
+        연결이 끊기면 .part 파일을 남겨 두고 재접속 후 그 위치부터 이어받습니다.
+        """
+        save_path, known_digest = self.downloads.get(filename, (None, None))
+        if save_path is None or known_digest != digest or offset == 0: # 새 다운로드 (또는 내용이 바뀜)
+            if save_path is None:
+                save_path = asksaveasfilename(initialfile=filename) # 사용자에게 파일 저장 경로와 파일명을 선택하게 함
+            if not save_path: # 사용자가 경로를 선택하지 않고 취소를 누르면
+                self.discard_file_data(so) # 서버로부터 더 이상 데이터 받지 않고 버림
+                return
+            offset = 0
+        self.downloads[filename] = (save_path, digest)
+        part_path = save_path + ".part"
+        try:
+            with open(part_path, "r+b" if offset else "wb") as f:
+                f.truncate(offset) # 이어받을 위치 뒤에 남은 (검증되지 않은) 부분은 버림
+                for chunk_offset, data in iter_chunks(so): # END 프레임이 올 때까지 CHUNK 프레임 수신
+                    f.seek(chunk_offset)
+                    f.write(data) # 체크섬을 확인한 조각을 제 위치에 씁니다.
+        except ChecksumError as e: # 손상된 조각부터 다시 요청
+            skip_body(so)
+            # 수신 스레드는 send_lock을 기다리지 않음 (크레딧을 기다리는 업로드가 잡고 있을 수 있음)
+            Thread(target=self.send_text, args=(f"DOWNLOAD_RESUME:{digest}:{e.offset}:{filename}",), daemon=True).start()
+            return
+        except (ConnectionError, OSError):
+            raise # 수신 스레드가 재접속한 뒤 이어받음
+        except Exception as e:
+            self.chat_transcript_area.insert('end', f"파일 다운로드 중 오류 발생: {e}\n")
+            return
+        if os.path.getsize(part_path) != size:
+            self.chat_transcript_area.insert('end', f"파일 {filename} 다운로드가 완료되지 않았습니다.\n")
+            return
+        os.replace(part_path, save_path)
+        del self.downloads[filename]
+        self.chat_transcript_area.insert('end', f"파일 {filename} 다운로드 완료\n")
+        self.chat_transcript_area.yview(END)
+        print(f"파일 다운로드 완료: {filename}")
+
+    def discard_file_data(self, so):
+        """파일 저장 취소 시 파일 데이터를 소진하기 위한 함수."""
+        skip_body(so) # END 프레임까지 본문 프레임을 읽고 버림
+
+    def update_typing_status(self):
+        """현재 입력 중인 클라이언트 목록을 바탕으로 상태 레이블을 업데이트합니다."""
+        if not self.typing_statuses: 
+            self.typing_status_label.config(text="") # 상태 레이블을 비웁니다.
+            return # 함수 종료
+
+        count = len(self.typing_statuses)
+        if count == 1:
+            user = list(self.typing_statuses)[0] # 입력 중인 사용자 중 첫 번째 사용자
+            self.typing_status_label.config(text=f"{user}님이 입력 중...") # 상태 레이블에 메시지 설정
+        elif count <= 3:
+            users = " ".join([f"{u}님" for u in self.typing_statuses]) # 모든 사용자 이름을 "님"으로 포맷
+            self.typing_status_label.config(text=f"{users} 입력 중...") # 상태 레이블에 메시지 설정
+        else:
+            users = list(self.typing_statuses) # 집합(set)을 리스트로 변환
+            first_user = users[0] # 첫 번째 사용자
+            others_count = count - 1 # 나머지 사용자 수
+            self.typing_status_label.config(text=f"{first_user}님 외 {others_count}명 입력 중...") # 상태 메시지
+
+    def update_users(self):
+        """접속자 레이블을 갱신합니다. 이름이 많으면 앞의 MAX_SHOWN_USERS명만 보여 줍니다."""
+        users = sorted(self.online_users)
+        shown = ", ".join(users[:MAX_SHOWN_USERS]) + (" ..." if len(users) > MAX_SHOWN_USERS else "")
+        self.users_label.config(text=f"접속자 {len(users)}명: {shown}" if users else "")
+
+    def receive_message(self, so):
+        """서버로부터 메시지를 수신하고, 그에 따라 UI를 업데이트합니다."""
+        while True:
+            try:
+                frame = read_frame(so) # 서버로부터 프레임 하나를 수신
+                if frame is None: # 서버로부터 받은 데이터가 없으면 (연결이 끊어진 경우)
+                    raise ConnectionError("서버와의 연결이 끊어졌습니다.")
+                ftype, buf = frame
+                if ftype == FRAME_STREAM: # 다중화된 본문 조각은 그 스트림을 받는 스레드에 넘기고 바로 다음 프레임으로
+                    self.streams.feed(buf)
+                    continue
+                if ftype != FRAME_TEXT: # 본문 밖에서 온 DATA/END 프레임은 무시
+                    continue
+
+                # 다중화된 본문의 시작 ("STREAM:스트림id:FILE_START:..." 등). 본문은 스트림마다 따로 스레드가 받음
+                if buf.startswith(b"STREAM:"):
+                    sid, header = buf[7:].split(b":", 1)
+                    stream = self.streams.open(int(sid))
+                    Thread(target=self.receive_stream, args=(int(sid), stream, header), daemon=True).start()
+                    continue
+
+                # 본문이 뒤따르는 메시지는 END 프레임까지 받은 뒤 다음 루프로 이동
+                elif self.receive_body(so, buf):
+                    continue
+
+                # 일반 메시지 처리
+                else:
+                    try:
+                        decoded_msg = buf.decode('utf-8') # 수신한 데이터를 UTF-8로 디코딩
+                        if decoded_msg.startswith("CREDIT:"): # 업로드 본문을 이만큼(누적 바이트)까지 보내도 됨
+                            self.add_credit(int(decoded_msg[7:]))
+                        elif decoded_msg.startswith("PING:"): # 하트비트: 같은 번호로 응답 (send_lock은 다른 스레드에서)
+                            Thread(target=self.send_text, args=("PONG:" + decoded_msg[5:],), daemon=True).start()
+                        elif decoded_msg == "RELOAD": # 서버 재시작 (send_lock은 다른 스레드에서)
+                            Thread(target=self.acknowledge_reload, daemon=True).start()
+                        elif decoded_msg == "RELOADED": # 새 서버 프로세스: 압축 스트림과 크레딧을 새로 시작
+                            so.inflater = Inflater(self.compression)
+                            if self.deflater is not None:
+                                self.deflater = Deflater(self.compression, files=self.deflater.body is not None)
+                            with self.credit_cond: # 올리던 본문은 RELOAD_OK 전에 모두 보냈음
+                                self.credit_sent, self.credit_limit = 0, INITIAL_CREDIT
+                            self.reloaded.set()
+                        elif decoded_msg == "STREAMS_OK": # 이후의 업로드는 STREAM 프레임으로 채팅과 번갈아 보냄
+                            set_stream_lowat(self.client_socket)
+                            self.multiplexed = True
+                        elif decoded_msg.startswith("THROTTLED:"): # 서버의 제한에 걸림 ("THROTTLED:종류:밀리초[:명령]")
+                            kind, delay, *command = decoded_msg[10:].split(":", 2)
+                            seconds = int(delay) / 1000
+                            if command: # 처리되지 않은 명령은 알려 준 시간 뒤에 다시 보냄
+                                Timer(seconds, self.send_text, args=(command[0],)).start()
+                                continue
+                            if kind in (THROTTLE_CONNECTIONS, THROTTLE_ACCEPTS): # 서버가 곧 연결을 닫음
+                                self.reconnect_delay = max(RECONNECT_INTERVAL, seconds)
+                                notice = f"서버에 접속한 사람이 많아 {self.reconnect_delay:.0f}초 뒤에 다시 접속합니다."
+                            elif kind == THROTTLE_MESSAGES:
+                                notice = f"메시지를 너무 빨리 보내 일부가 전달되지 않았습니다. ({seconds:.1f}초 뒤부터 다시 보낼 수 있음)"
+                            else:
+                                notice = "업로드 속도가 제한되어 천천히 전송합니다."
+                            self.chat_transcript_area.insert('end', notice + "\n")
+                            self.chat_transcript_area.yview("end")
+                        elif decoded_msg.startswith("COMPRESS_OK:"): # 서버가 허용한 압축 방식 (비어 있으면 압축 안 함)
+                            accepted = decoded_msg[12:].split(",")
+                            if "deflate" in accepted:
+                                self.deflater = Deflater(self.compression, files="files" in accepted)
+                        elif decoded_msg.startswith("FILE_ACCEPT:"): # "FILE_ACCEPT:전송id:위치:파일명" 위치부터 본문 전송
+                            transfer_id, offset, filename = decoded_msg[12:].split(":", 2)
+                            if filename in self.pending_uploads:
+                                filepath, digest = self.pending_uploads.pop(filename)
+                                self.uploads[transfer_id] = (filename, filepath, digest)
+                            if transfer_id in self.uploads:
+                                Thread(target=self.upload_file, args=(transfer_id, int(offset)), daemon=True).start()
+                        elif decoded_msg.startswith("FILE_INFO:"): # "FILE_INFO:해시:크기:파일명" 다운로드할 내용
+                            digest, size, filename = decoded_msg[10:].split(":", 2)
+                            Thread(target=self.download_ranges, args=(filename, digest, int(size)), daemon=True).start()
+                        elif decoded_msg.startswith("FILE_STORED:"): # 서버가 전체 해시까지 확인하고 저장함
+                            transfer_id, filename = decoded_msg[12:].split(":", 1)
+                            self.uploads.pop(transfer_id, None)
+                            self.chat_transcript_area.insert('end', f"파일 {filename} 전송 완료\n")
+                            self.chat_transcript_area.yview("end")
+                        elif decoded_msg.startswith("FILE_UNKNOWN:"): # 서버에 업로드 기록이 없으면 처음부터 다시 제안
+                            upload = self.uploads.pop(decoded_msg[13:], None)
+                            if upload:
+                                filename, filepath, digest = upload
+                                self.offer_file(filename, filepath, digest)
+                        elif decoded_msg.startswith("FILE_BUSY:"): # 같은 내용을 다른 연결이 올리는 중이면 잠시 뒤 다시 확인
+                            transfer_id = decoded_msg[10:]
+                            Timer(RECONNECT_INTERVAL, self.send_text, args=(f"FILE_RESUME:{transfer_id}",)).start()
+                        elif decoded_msg.startswith("FILE_SKIPPED:"): # 수신이 밀려 서버가 이 파일의 중계를 건너뜀
+                            self.chat_transcript_area.insert('end', f"{decoded_msg[13:]} 파일은 수신이 밀려 받지 못했습니다.\n")
+                            self.chat_transcript_area.yview("end")
+                        elif decoded_msg.startswith("FILE_FAILED:"):
+                            self.chat_transcript_area.insert('end', f"파일 {decoded_msg[12:]} 전송 실패 (해시 불일치)\n")
+                            self.chat_transcript_area.yview("end")
+                        elif decoded_msg.startswith("DELTA_STORED:"): # "DELTA_STORED:받은바이트:절약한바이트:파일명"
+                            received, saved, filename = decoded_msg[13:].split(":", 2)
+                            self.pending_uploads.pop(filename, None)
+                            self.chat_transcript_area.insert(
+                                'end', f"파일 {filename} 전송 완료 (바뀐 부분 {received} 바이트만 전송, {saved} 바이트 절약)\n")
+                            self.chat_transcript_area.yview("end")
+                        elif decoded_msg.startswith("DELTA_FAILED:"): # 변경분으로 만든 내용이 맞지 않으면 전체를 다시 제안
+                            filename = decoded_msg[13:]
+                            if filename in self.pending_uploads:
+                                filepath, digest = self.pending_uploads[filename]
+                                self.offer_file(filename, filepath, digest, delta=False)
+                        elif decoded_msg.startswith("FILE_EXISTS:"): # 서버에 이미 같은 내용이 있음
+                            filename = decoded_msg[12:]
+                            self.pending_uploads.pop(filename, None)
+                            self.chat_transcript_area.insert('end', f"파일 {filename} 전송 완료 (서버에 이미 있어 생략)\n")
+                            self.chat_transcript_area.yview("end")
+                        elif decoded_msg.startswith("NEW_FILE:"):
+                            filename = decoded_msg.split(":")[1] # NEW_FILE: 파일명
+                            self.chat_transcript_area.insert('end', f"새 파일 수신: {filename} (클릭하여 다운로드)\n")
+                            self.chat_transcript_area.tag_add(filename, "end-2l", "end-1l")
+                            self.chat_transcript_area.tag_bind(
+                                filename, "<Button-1>", lambda e, fname=filename: self.download_file(fname)
+                            )
+                        elif decoded_msg.startswith("JOINED:"): # 방을 옮겼음
+                            self.room = decoded_msg[7:]
+                            self.root.title(f"Chat Client - {self.room}")
+                            self.typing_statuses.clear() # 이전 방의 입력 중 표시는 더 이상 의미 없음
+                            self.update_typing_status()
+                            self.chat_transcript_area.insert('end', f"[{self.room}] 방에 입장했습니다.\n")
+                            self.chat_transcript_area.yview("end")
+                        elif decoded_msg.startswith("HISTORY:"): # 뒤이어 오는 메시지들은 입장 전에 오간 대화
+                            self.chat_transcript_area.insert('end', f"--- 이전 대화 {decoded_msg[8:]}개 ---\n")
+                            self.chat_transcript_area.yview("end")
+                        elif decoded_msg.startswith("JOIN_FAILED:"):
+                            self.chat_transcript_area.insert('end', f"'{decoded_msg[12:]}' 방에 입장할 수 없습니다. (공백과 ':' 없이 64자 이하)\n")
+                            self.chat_transcript_area.yview("end")
+                        elif decoded_msg.startswith("USERS:"): # 이름을 등록하면 한 번 받는 접속자 전체 목록
+                            self.online_users = set(decoded_msg[6:].split("\t")) if decoded_msg[6:] else set()
+                            self.update_users()
+                        elif decoded_msg.startswith("ONLINE:"):
+                            self.online_users.add(decoded_msg[7:])
+                            self.update_users()
+                        elif decoded_msg.startswith("OFFLINE:"):
+                            self.online_users.discard(decoded_msg[8:])
+                            self.update_users()
+                        elif decoded_msg.startswith("NAME_OK:"):
+                            pass
+                        elif decoded_msg.startswith("NAME_REJECTED:"):
+                            self.chat_transcript_area.insert('end', f"'{decoded_msg[14:]}' 이름을 쓸 수 없습니다. (이미 접속 중이거나 공백과 ':' 포함)\n")
+                            self.chat_transcript_area.yview("end")
+                        elif decoded_msg.startswith("DM_FROM:"): # "DM_FROM:보낸 사람:내용"
+                            sender, text = decoded_msg[8:].split(":", 1)
+                            self.chat_transcript_area.insert('end', f"[DM] {sender}: {text}\n")
+                            self.chat_transcript_area.yview("end")
+                        elif decoded_msg.startswith("DM_FAILED:"):
+                            self.chat_transcript_area.insert('end', f"{decoded_msg[10:]}님에게 보내지 못했습니다. (접속 중이 아니거나 내 이름이 등록되지 않음)\n")
+                            self.chat_transcript_area.yview("end")
+                        elif decoded_msg.startswith("TYPING_STATE:"): # 방에서 지금 입력 중인 사람 전체 (바뀔 때만 옴)
+                            names = decoded_msg[13:].split("\t") if decoded_msg[13:] else []
+                            self.typing_statuses = set(names) - {self.name_widget.get().strip()} # 나 자신은 제외
+                            self.update_typing_status() # UI 상태 업데이트
+                        else: # 일반적인 채팅 메시지는 그대로 채팅창에 출력
+                            self.chat_transcript_area.insert('end', decoded_msg + '\n')
+                            self.chat_transcript_area.yview("end")
+                    except UnicodeDecodeError:
+                        pass
+            except (ConnectionError, OSError) as e: # 연결이 끊기면 다시 접속해 끊긴 전송을 이어감
+                print(f"receive_message 연결 끊김: {e}")
+                so = self.reconnect()
+            except Exception as e:
+                print(f"receive_message 오류: {e}")
+                break
+
+
+    def receive_body(self, so, buf):
+        """본문이 뒤따르는 메시지(이미지, 미리보기, 원본 이미지, 파일, 블록 서명)면 본문을 so에서 받아 처리하고 True를 돌려줍니다."""
+        # 이미지 수신 시작 신호 확인
+        if buf.startswith(b"IMAGE_START:"):
+            header, filename = buf.decode('utf-8').split(":")
+            image_data = self.receive_image_data(so)
+            if image_data:
+                self.show_image(f"{filename} 이미지 수신:", io.BytesIO(image_data))
+
+        # 서버가 만든 미리보기 ("IMAGE_THUMB:해시:파일명")
+        elif buf.startswith(b"IMAGE_THUMB:"):
+            header, digest, filename = buf.decode('utf-8').split(":", 2)
+            thumbnail = self.receive_image_data(so)
+            self.show_image(f"{filename} 이미지 수신 (클릭하면 원본 보기):", io.BytesIO(thumbnail),
+                            resize=False, digest=digest)
+
+        # 클릭해서 요청한 원본 이미지 ("IMAGE_FULL:해시")
+        elif buf.startswith(b"IMAGE_FULL:"):
+            self.show_full_image(self.receive_image_data(so))
+
+        # 변경분 업로드의 기준이 될 이전 내용의 블록 서명 ("DELTA_BASE:이전해시:블록크기:파일명")
+        elif buf.startswith(b"DELTA_BASE:"):
+            header, base, block_size, filename = buf.decode('utf-8').split(":", 3)
+            signatures = b"".join(iter_body(so))
+            # 본문을 보내는 동안 CREDIT을 받아야 하므로 수신 스레드가 아닌 곳에서 보냄
+            Thread(target=self.upload_delta, args=(filename, base, int(block_size), signatures), daemon=True).start()
+
+        # 파일 수신 시작 신호 확인
+        elif buf.startswith(b"FILE_START:"): # "FILE_START:해시:크기:위치:파일명"
+            header, digest, size, offset, filename = buf.decode('utf-8').split(":", 4)
+            offset = int(offset)
+            message = f"{filename} 다운로드 중..." if offset == 0 else f"{filename} {offset} 바이트부터 이어받는 중..."
+            self.chat_transcript_area.insert('end', message + "\n") # 채팅창에 알림
+            self.chat_transcript_area.yview("end") # 스크롤 아래로 이동
+            self.receive_file(so, filename, digest, int(size), offset) # 파일 다운로드 메서드 호출
+        else:
+            return False
+        return True
+
+    def receive_stream(self, sid, stream, header):
+        """스트림 하나로 온 본문을 받습니다. 수신 스레드는 그동안 채팅과 다른 스트림의 조각을 계속 받습니다."""
+        try:
+            self.receive_body(stream, header)
+        except (ConnectionError, OSError) as e: # 연결이 끊기면 수신 스레드가 다시 접속해 이어받음
+            print(f"{sid}번 스트림 수신 중단: {e}")
+        except Exception as e:
+            print(f"{sid}번 스트림 수신 오류: {e}")
+        finally:
+            self.streams.finish(sid, stream)
+
+    def receive_image_data(self, so):
+        """IMAGE_START 수신 이후 END 프레임까지 이미지를 수신"""
+        return b"".join(iter_body(so)) # 조각들을 모아 한 번에 합침 (반복적인 += 복사 방지)
+    
+if __name__ == "__main__":
+    ip = '127.0.0.1'
+    port = 2500
+    ChatClient(ip, port)
+    mainloop()
@@ -0,0 +1,444 @@
+"""채팅 서버 부하 측정 도구. Tk 없이 ChatClient 여러 개를 흉내 냅니다.
+
+클라이언트 수백~수만 개를 루프백으로 붙입니다. 채팅, 타이핑, 파일 업로드(FILE:), 다운로드(DOWNLOAD:),
+이미지(IMAGE:) 트래픽을 정한 비율대로 보냅니다. 측정하는 값은 처리량, 채팅 전달 지연 시간(p50/p99),
+서버와 측정 도구의 CPU 사용량, 메모리(RSS)입니다. 실행할 때마다 결과 JSON 한 줄을 --output 파일 끝에
+추가하므로 버전별(v3~v6) 결과를 나란히 비교할 수 있습니다.
+
+    python chat_bench.py --clients 1000 --duration 30 --mix chat=80,typing=15,file=3,download=1,image=1
+    python chat_bench.py --server "GUI_ChatServer_Multi_v6.py --engine asyncio" --clients 10000 --rooms 100 --processes 4
+    python chat_bench.py --server GUI_ChatServer_Multi_v5.py --protocol raw --clients 100
+
+--protocol은 둘 중 하나입니다.
+- framed: v6의 프레임 프로토콜.
+- raw: v3~v5처럼 문자열을 그대로 주고받는 방식. 채팅과 타이핑만 보낼 수 있습니다. 파일 본문의 경계를
+  구분할 수 없기 때문입니다.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import resource
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+from multiprocessing import get_context
+from chat_protocol import (FRAME_TEXT, FRAME_END, text_frame, read_frame, read_frame_async,
+                           iter_bytes_frames)
+
+ACTIONS = ('chat', 'typing', 'file', 'download', 'image')
+RAW_ACTIONS = ('chat', 'typing')  # raw 프로토콜(v3~v5)로 보낼 수 있는 트래픽
+DEFAULT_MIX = 'chat=85,typing=15'
+MAX_SAMPLES = 200000  # 프로세스마다 보관하는 지연 시간 표본 수 (넘으면 무작위로 교체)
+CONNECT_CONCURRENCY = 200  # 동시에 진행하는 접속 수 (서버의 listen 대기열이 넘치지 않게)
+CONNECT_ATTEMPTS = 10  # 서버가 접속을 거절(THROTTLED)하면 알려 준 시간만큼 기다렸다가 다시 시도하는 횟수
+SERVER_STARTUP_TIMEOUT = 15.0  # --server로 띄운 서버가 접속을 받기 시작하기를 기다리는 시간(초)
+DRAIN_TIME = 2.0  # 보내기를 멈춘 뒤 남은 메시지가 도착하기를 기다리는 시간(초)
+BENCH_FILE = 'bench.bin'  # 다운로드 트래픽에 쓰는 파일 (측정 전에 한 번 올려 둠)
+
+
+def parse_mix(text, protocol):
+    """"chat=80,typing=20" 형식의 비율을 {동작: 가중치}로 바꿉니다."""
+    mix = {}
+    for part in text.split(','):
+        action, _, weight = part.partition('=')
+        action = action.strip()
+        if action not in ACTIONS:
+            raise SystemExit(f"알 수 없는 트래픽 종류: {action} (가능: {', '.join(ACTIONS)})")
+        if protocol == 'raw' and action not in RAW_ACTIONS:
+            raise SystemExit(f"raw 프로토콜에서는 {action} 트래픽을 보낼 수 없습니다.")
+        mix[action] = float(weight or 1)
+    return mix
+
+
+def make_image():
+    """이미지 트래픽에 쓸 PNG. Pillow가 없으면 임의의 바이트 (서버는 미리보기 대신 NEW_FILE로 알림)."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return os.urandom(64 * 1024)
+    buf = io.BytesIO()
+    Image.radial_gradient('L').resize((640, 480)).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def body_frames(header, payload):
+    """"FILE:이름" 같은 명령 뒤에 본문 DATA 프레임들과 END 프레임을 붙인 바이트열."""
+    return text_frame(header) + b"".join(iter_bytes_frames(payload))
+
+
+class Samples:
+    """지연 시간 표본. 개수가 limit을 넘으면 저수지 표집(reservoir sampling)으로 고르게 남깁니다."""
+
+    def __init__(self, limit=MAX_SAMPLES):
+        self.values = []
+        self.seen = 0
+        self.limit = limit
+
+    def add(self, value):
+        self.seen += 1
+        if len(self.values) < self.limit:
+            self.values.append(value)
+        else:
+            index = random.randrange(self.seen)
+            if index < self.limit:
+                self.values[index] = value
+
+
+def percentiles(values):
+    """밀리초 단위 표본에서 p50/p90/p99/최댓값을 구합니다."""
+    if not values:
+        return None
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+    return {'p50': pick(0.50), 'p90': pick(0.90), 'p99': pick(0.99), 'max': round(values[-1], 3),
+            'samples': len(values)}
+
+
+def process_tree_usage(pid):
+    """pid와 그 자식 프로세스들의 CPU 시간(초), 현재 RSS, 최대 RSS(바이트)를 /proc에서 읽어 합칩니다. (리눅스 전용)"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+            children.setdefault(int(fields[1]), []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, ()))
+    cpu = rss = peak = 0
+    ticks = os.sysconf('SC_CLK_TCK')
+    for current in tree:
+        try:
+            with open(f'/proc/{current}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / ticks  # utime, stime
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        rss += int(line.split()[1]) * 1024
+                    elif line.startswith('VmHWM:'):
+                        peak += int(line.split()[1]) * 1024
+        except OSError:  # 측정 도중 끝난 프로세스
+            continue
+    return cpu, rss, peak
+
+
+class BenchClient:
+    """ChatClient 하나를 흉내 내는 연결. 보내기는 run, 받기는 read_loop가 맡습니다."""
+
+    def __init__(self, index, config, counters):
+        self.name = f"bench{index}"
+        self.config = config
+        self.counters = counters
+        rooms = max(1, config.rooms)
+        self.room = f"bench-{index % rooms}"
+        # 같은 방의 클라이언트 수 (채팅 하나가 몇 명에게 전달되어야 하는지)
+        self.room_size = config.clients // rooms + (1 if index % rooms < config.clients % rooms else 0)
+        self.framed = config.protocol == 'framed'
+        self.downloads = deque()  # 응답을 기다리는 다운로드 요청 시각
+        self.in_download = False
+        self.resumed = asyncio.Event()  # 서버 재시작 중(RELOAD_OK를 보낸 뒤 RELOADED까지)에는 보내지 않음
+        self.resumed.set()
+        self.reader = self.writer = None
+
+    async def connect(self):
+        for attempt in range(CONNECT_ATTEMPTS):
+            self.reader, self.writer = await asyncio.open_connection(self.config.host, self.config.port)
+            if not self.framed:
+                return
+            # 측정용 방에 들어가고 JOINED를 받을 때까지 기다림 (그 전 기록은 버림)
+            self.writer.write(text_frame(f"JOIN:{self.room}"))
+            while True:
+                frame = await read_frame_async(self.reader)
+                if frame is None:
+                    raise ConnectionError("JOINED를 받기 전에 연결이 끊어졌습니다.")
+                if frame[0] != FRAME_TEXT:
+                    continue
+                if frame[1] == f"JOINED:{self.room}".encode('utf-8'):
+                    return
+                if frame[1].startswith(b"THROTTLED:"): # 접속 제한에 걸림: 알려 준 시간의 2^attempt배를 기다렸다가 다시 접속
+                    self.counters['throttled'] += 1
+                    self.writer.close()
+                    await asyncio.sleep(int(frame[1].split(b":")[2]) / 1000 * 2 ** attempt * random.uniform(1, 2))
+                    break
+        raise ConnectionError("서버가 접속을 계속 거절했습니다.")
+
+    def on_text(self, payload):
+        if b" BENCH " in payload:
+            _, run, sent_at = payload.rsplit(b" ", 2)
+            if run.decode() == self.config.run_id: # 이전 실행의 기록(HISTORY)은 세지 않음
+                self.counters['delivered'] += 1
+                self.counters['latency'].add((time.monotonic_ns() - int(sent_at)) / 1e6)
+        elif payload.startswith(b"FILE_START:"):
+            self.in_download = True
+        elif payload.startswith(b"PING:"): # 오래 걸리는 측정에서 조용한 클라이언트가 정리되지 않도록
+            self.writer.write(text_frame("PONG:" + payload[5:].decode()))
+        elif payload.startswith(b"THROTTLED:"): # 서버의 메시지/업로드 속도 제한에 걸림
+            self.counters['throttled'] += 1
+            _, _, delay, *command = payload.decode().split(":", 3)
+            if command: # 처리되지 않은 명령(다운로드 요청 등)은 알려 준 시간 뒤에 다시 보냄
+                asyncio.get_running_loop().call_later(int(delay) / 1000, self.writer.write, text_frame(command[0]))
+        elif payload == b"RELOAD": # 무중단 재시작: 멈춘 시간도 전달 지연 시간에 그대로 드러남
+            self.resumed.clear()
+            self.writer.write(text_frame("RELOAD_OK"))
+        elif payload == b"RELOADED":
+            self.resumed.set()
+        elif payload == b"FILE_NOT_FOUND" and self.downloads:
+            self.downloads.popleft()
+            self.counters['errors'] += 1
+
+    async def read_loop(self):
+        try:
+            if not self.framed:
+                buffer = b""
+                while True:
+                    data = await self.reader.read(65536)
+                    if not data:
+                        break
+                    buffer += data
+                    *lines, buffer = buffer.split(b"\n")
+                    for line in lines:
+                        self.on_text(line)
+                return
+            while True:
+                frame = await read_frame_async(self.reader)
+                if frame is None:
+                    break
+                ftype, payload = frame
+                if ftype == FRAME_TEXT:
+                    self.on_text(payload)
+                elif ftype == FRAME_END and self.in_download: # 다운로드 한 건이 끝남
+                    self.in_download = False
+                    if self.downloads:
+                        self.counters['download'].add((time.monotonic() - self.downloads.popleft()) * 1000)
+        except (ConnectionError, OSError, asyncio.IncompleteReadError):
+            pass
+
+    def encode(self, message):
+        return text_frame(message) if self.framed else (message + "\n").encode('utf-8')
+
+    async def perform(self, action):
+        counters = self.counters
+        await self.resumed.wait()
+        if action == 'chat':
+            self.writer.write(self.encode(f"{self.name}: BENCH {self.config.run_id} {time.monotonic_ns()}"))
+            counters['expected'] += self.room_size - 1
+        elif action == 'typing':
+            self.writer.write(self.encode(f"TYPING:{self.name}"))
+        elif action == 'file':
+            self.writer.write(body_frames(f"FILE:{self.name}.bin", self.config.file_payload))
+        elif action == 'download':
+            self.downloads.append(time.monotonic())
+            self.writer.write(text_frame(f"DOWNLOAD:{BENCH_FILE}"))
+        elif action == 'image':
+            self.writer.write(body_frames(f"IMAGE:{self.name}.png", self.config.image_payload))
+        counters['sent'][action] += 1
+        await self.writer.drain() # 서버가 못 받으면 여기서 기다림 (보내는 속도가 저절로 줄어듦)
+
+    async def run(self, deadline):
+        """메시지를 클라이언트당 초당 rate개씩 보냅니다. 시작 시점은 클라이언트마다 흩어 놓습니다."""
+        actions, weights = zip(*self.config.mix.items())
+        interval = 1.0 / self.config.rate
+        next_at = time.monotonic() + random.random() * interval
+        try:
+            while next_at < deadline:
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self.perform(random.choices(actions, weights)[0])
+                next_at += interval
+        except (ConnectionError, OSError):
+            self.counters['errors'] += 1
+
+
+async def bench_worker(config, first, count, barrier):
+    """클라이언트 first..first+count-1을 접속시키고, 모든 프로세스가 준비되면 duration초 동안 보냅니다."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard)) # 연결 수만큼 파일 디스크립터가 필요
+    counters = {'sent': dict.fromkeys(ACTIONS, 0), 'expected': 0, 'delivered': 0, 'errors': 0,
+                'connect_failures': 0, 'throttled': 0, 'latency': Samples(), 'download': Samples()}
+    clients = [BenchClient(index, config, counters) for index in range(first, first + count)]
+    limit = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def connect(client):
+        async with limit:
+            try:
+                await client.connect()
+                return client
+            except (ConnectionError, OSError):
+                counters['connect_failures'] += 1
+    clients = [client for client in await asyncio.gather(*map(connect, clients)) if client is not None]
+    readers = [asyncio.create_task(client.read_loop()) for client in clients]
+    await asyncio.to_thread(barrier.wait) # 다른 측정 프로세스들도 접속을 마칠 때까지
+    cpu_started = time.process_time()
+    deadline = time.monotonic() + config.duration
+    await asyncio.gather(*(client.run(deadline) for client in clients))
+    await asyncio.sleep(DRAIN_TIME)
+    for client in clients:
+        client.writer.close()
+    for task in readers:
+        task.cancel()
+    await asyncio.gather(*readers, return_exceptions=True)
+    counters['connected'] = len(clients)
+    counters['latency'] = counters['latency'].values
+    counters['download'] = counters['download'].values
+    counters['cpu_seconds'] = time.process_time() - cpu_started
+    counters['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # 리눅스는 KB 단위
+    return counters
+
+
+def run_worker(config, first, count, barrier, results):
+    results.put(asyncio.run(bench_worker(config, first, count, barrier)))
+
+
+def wait_for_server(host, port, timeout=SERVER_STARTUP_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise SystemExit(f"{host}:{port} 서버에 접속할 수 없습니다.")
+            time.sleep(0.2)
+
+
+def upload_bench_file(config):
+    """다운로드 트래픽에 쓸 파일을 한 번 올려 둡니다. JOINED 응답으로 서버가 다 받았는지 확인합니다."""
+    with socket.create_connection((config.host, config.port)) as so:
+        so.sendall(body_frames(f"FILE:{BENCH_FILE}", config.file_payload) + text_frame("JOIN:bench-setup"))
+        while True:
+            frame = read_frame(so)
+            if frame is None or frame[1] == b"JOINED:bench-setup":
+                break
+
+
+def summarize(config, parts, server_usage):
+    """프로세스별 결과를 합쳐 JSON으로 남길 결과를 만듭니다."""
+    sent = dict.fromkeys(ACTIONS, 0)
+    for part in parts:
+        for action, count in part['sent'].items():
+            sent[action] += count
+    delivered = sum(part['delivered'] for part in parts)
+    expected = sum(part['expected'] for part in parts)
+    result = {
+        'label': config.label,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'server': config.server,
+        'protocol': config.protocol,
+        'clients': config.clients,
+        'connected': sum(part['connected'] for part in parts),
+        'connect_failures': sum(part['connect_failures'] for part in parts),
+        'rooms': config.rooms,
+        'processes': config.processes,
+        'duration': config.duration,
+        'rate_per_client': config.rate,
+        'mix': config.mix,
+        'sent': sent,
+        'sent_per_sec': round(sum(sent.values()) / config.duration, 1),
+        'delivered': delivered,
+        'expected': expected,
+        'delivery_ratio': round(delivered / expected, 4) if expected else None,
+        'delivered_per_sec': round(delivered / config.duration, 1),
+        'latency_ms': percentiles([value for part in parts for value in part['latency']]),
+        'download_ms': percentiles([value for part in parts for value in part['download']]),
+        'errors': sum(part['errors'] for part in parts),
+        'throttled': sum(part['throttled'] for part in parts),
+        'bench_cpu_seconds': round(sum(part['cpu_seconds'] for part in parts), 2),
+        'bench_max_rss_mb': round(sum(part['max_rss'] for part in parts) / 2**20, 1),
+        'python': sys.version.split()[0],
+    }
+    if server_usage is not None:
+        cpu, rss, peak = server_usage
+        result.update(server_cpu_seconds=round(cpu, 2), server_cpu_percent=round(100 * cpu / config.duration, 1),
+                      server_rss_mb=round(rss / 2**20, 1), server_peak_rss_mb=round(peak / 2**20, 1))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="채팅 서버 부하 측정 도구")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2500, help="서버 포트 (v3~v5는 2500 고정)")
+    parser.add_argument('--protocol', choices=('framed', 'raw'), default='framed',
+                        help="framed: v6 프레임 프로토콜, raw: v3~v5 문자열 프로토콜")
+    parser.add_argument('--clients', type=int, default=100, help="동시에 접속하는 클라이언트 수")
+    parser.add_argument('--rooms', type=int, default=1, help="클라이언트를 나누어 넣을 방 수 (framed만)")
+    parser.add_argument('--duration', type=float, default=10.0, help="측정 시간(초)")
+    parser.add_argument('--rate', type=float, default=1.0, help="클라이언트 하나가 초당 보내는 메시지 수")
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help="트래픽 비율, 예: chat=80,typing=15,file=3,download=1,image=1")
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help="file/download 트래픽의 파일 크기(바이트)")
+    parser.add_argument('--processes', type=int, default=1, help="클라이언트를 나누어 맡을 측정 프로세스 수")
+    parser.add_argument('--server', help="측정할 서버 스크립트와 인자 (임시 디렉터리에서 실행하고 CPU/RSS도 잼)")
+    parser.add_argument('--server-pid', type=int, help="이미 떠 있는 서버의 PID (CPU/RSS 측정용)")
+    parser.add_argument('--label', default='', help="결과에 남길 이름 (예: v6-asyncio)")
+    parser.add_argument('--output', default='bench_results.jsonl', help="결과를 한 줄씩 추가할 JSON Lines 파일")
+    config = parser.parse_args()
+    if config.protocol == 'raw':
+        config.rooms = 1 # v3~v5에는 방이 없음
+    config.mix = parse_mix(config.mix, config.protocol)
+    config.run_id = os.urandom(4).hex()
+    config.file_payload = os.urandom(config.file_size)
+    config.image_payload = make_image() if 'image' in config.mix else b""
+
+    server = None
+    server_pid = config.server_pid
+    if config.server:
+        command = shlex.split(config.server)
+        command[0] = os.path.abspath(command[0])
+        # 업로드 파일과 기록이 작업 디렉터리를 어지럽히지 않도록 임시 디렉터리에서 실행
+        # 미리보기 프로세스 풀이나 워커까지 한 번에 끝낼 수 있도록 새 프로세스 그룹으로 실행
+        server = subprocess.Popen([sys.executable] + command, cwd=tempfile.mkdtemp(prefix='chatbench.'),
+                                  stdout=subprocess.DEVNULL, start_new_session=True)
+        server_pid = server.pid
+    try:
+        wait_for_server(config.host, config.port)
+        if 'download' in config.mix:
+            upload_bench_file(config)
+        ctx = get_context('spawn')
+        barrier = ctx.Barrier(config.processes + 1)
+        results = ctx.Queue()
+        share, extra = divmod(config.clients, config.processes)
+        workers, first = [], 0
+        for index in range(config.processes):
+            count = share + (1 if index < extra else 0)
+            workers.append(ctx.Process(target=run_worker, args=(config, first, count, barrier, results)))
+            first += count
+        for worker in workers:
+            worker.start()
+        barrier.wait() # 모든 클라이언트가 접속한 뒤부터 측정
+        print(f"클라이언트 {config.clients}개 접속 완료, {config.duration}초 동안 측정합니다.")
+        started = process_tree_usage(server_pid) if server_pid else None
+        time.sleep(config.duration)
+        finished = process_tree_usage(server_pid) if server_pid else None
+        parts = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+    finally:
+        if server is not None:
+            os.killpg(server.pid, signal.SIGTERM)
+            server.wait()
+    usage = (finished[0] - started[0], finished[1], finished[2]) if started else None
+    result = summarize(config, parts, usage)
+    with open(config.output, 'a') as f:
+        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,440 @@
+"""업로드 파일을 내용(SHA-256) 기준으로 저장하는 저장소.
+
+같은 내용의 파일은 몇 번을 올려도 한 번만 저장되고, 파일명은 이름 -> 해시 색인으로 관리하므로
+클라이언트가 보낸 이름끼리 충돌해도 기존 파일이 덮어써지지 않습니다.
+
+    <root>/blobs/ab/cd/abcd1234...   내용 파일 (해시 앞 2글자, 다음 2글자로 디렉터리 분산)
+    <root>/blobs/ab/cd/abcd1234....crc  조각(TRANSFER_CHUNK_SIZE)별 CRC32 목록 (이어받기 다운로드용)
+    <root>/blobs/ab/cd/abcd1234....sig  블록(DELTA_BLOCK_SIZE)별 서명 목록 (변경분 업로드용)
+    <root>/tmp/                       수신 중인 임시 파일
+    <root>/staging/<전송 id>.part     이어받기 업로드가 끝날 때까지 모아 두는 파일 (+ .json 정보)
+    <root>/index.json                 파일명 -> 해시 색인 (마지막으로 합친 때까지)
+    <root>/index.journal              그 뒤의 색인 변경 기록 (한 줄에 [파일명, 해시] JSON 하나)
+
+업로드가 끝날 때마다 색인 전체를 다시 쓰지 않고 journal에 한 줄만 덧붙이며, 기록이 색인 항목 수만큼
+쌓이면 index.json으로 합치고 journal을 비웁니다. 읽을 때는 index.json 위에 journal을 차례대로 적용합니다.
+
+멀티 프로세스 모드에서는 여러 워커가 같은 저장소를 함께 쓰므로, 색인은 파일 잠금(index.lock) 아래에서
+다른 워커가 덧붙인 기록을 먼저 읽은 뒤 갱신합니다. 다른 워커가 덧붙인 기록은 읽은 위치 뒤만 이어 읽고,
+합쳐서 index.json이나 journal이 새 파일로 바뀌었으면 처음부터 다시 읽습니다.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+import zlib
+from array import array
+from contextlib import contextmanager
+from threading import Lock
+from chat_protocol import TRANSFER_CHUNK_SIZE
+from chat_delta import DELTA_BLOCK_SIZE, file_signatures
+
+try:
+    import fcntl  # 프로세스 사이의 색인 잠금 (POSIX)
+except ImportError:
+    fcntl = None
+
+HASH_NAME = 'sha256'
+JOURNAL_COMPACT_MIN = 1000  # journal 기록이 이 수와 색인 항목 수 중 큰 쪽만큼 쌓이면 index.json으로 합침
+DIGEST_PATTERN = re.compile(r'[0-9a-f]{64}')  # SHA-256 16진 문자열 (hexdigest와 같은 소문자 64글자)
+
+
+def valid_digest(digest):
+    """클라이언트가 보낸 해시가 내용 경로를 만들어도 되는 형식인지 확인합니다. (저장소 밖을 가리키지 않도록)"""
+    return DIGEST_PATTERN.fullmatch(digest) is not None
+
+
+class BlobStore:
+    def __init__(self, root='uploads'):
+        self.root = root
+        self.blob_dir = os.path.join(root, 'blobs')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        self.staging_dir = os.path.join(root, 'staging')
+        self.index_path = os.path.join(root, 'index.json')
+        self.journal_path = os.path.join(root, 'index.journal')
+        self.lock_path = os.path.join(root, 'index.lock')
+        self.lock = Lock()  # 색인 읽기/쓰기 보호
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.index_mtime = None  # 마지막으로 읽은 index.json의 수정 시각
+        self.journal_id = None  # 마지막으로 읽은 journal 파일 (장치, inode). 합치면 새 파일로 바뀜
+        self.journal_offset = 0  # journal에서 읽은(적용한) 끝 위치
+        self.journal_entries = 0  # journal에 쌓인 기록 수
+        self.index = {}  # 파일명 -> 해시
+        self._load_index()
+        self.staging = StagingArea(self.staging_dir)  # 끝나지 않은 이어받기 업로드
+
+    def _load_index(self):
+        """index.json을 읽고 journal의 기록을 처음부터 적용합니다.
+
+        journal을 먼저 열어 두므로 그 사이 다른 워커가 합쳐도, 새 index.json 위에 이미 합쳐진 옛 기록을
+        다시 적용하게 될 뿐 결과는 같습니다.
+        """
+        try:
+            journal = open(self.journal_path, 'rb')
+        except FileNotFoundError:
+            journal = None
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                self.index_mtime = os.fstat(f.fileno()).st_mtime_ns
+                self.index = json.load(f)
+        except FileNotFoundError:
+            self.index_mtime = None
+            self.index = {}
+        self.journal_id, self.journal_offset, self.journal_entries = None, 0, 0
+        if journal is not None:
+            with journal:
+                self._read_journal(journal)
+
+    def _read_journal(self, f):
+        """journal에서 아직 읽지 않은 줄들을 색인에 적용합니다. 다른 파일로 바뀌었으면 False.
+
+        쓰는 중이거나 쓰다 죽어 줄바꿈으로 끝나지 않은 마지막 줄은 적용하지 않습니다.
+        """
+        st = os.fstat(f.fileno())
+        journal_id = (st.st_dev, st.st_ino)
+        if self.journal_id not in (None, journal_id):
+            return False
+        self.journal_id = journal_id
+        f.seek(self.journal_offset)
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            name, digest = json.loads(line)
+            self.index[name] = digest
+            self.journal_entries += 1
+        self.journal_offset += end
+        return True
+
+    def _refresh_index(self):
+        """다른 프로세스가 색인을 바꿨으면 반영합니다. (self.lock을 잡은 상태에서 호출)
+
+        덧붙인 기록만 있으면 그 부분만 읽고, 합쳐서 index.json이나 journal이 바뀌었으면 처음부터 다시 읽습니다.
+        """
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self.index_mtime:
+            self._load_index()
+            return
+        try:
+            journal = open(self.journal_path, 'rb')
+        except FileNotFoundError:
+            if self.journal_id is not None: # 합친 뒤 새 journal로 바꾸기 전
+                self._load_index()
+            return
+        with journal:
+            if self._read_journal(journal):
+                return
+        self._load_index()
+
+    @contextmanager
+    def _process_lock(self):
+        """같은 저장소를 쓰는 다른 프로세스와 색인 갱신이 겹치지 않게 합니다."""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _append_journal(self, name, digest):
+        """journal에 기록 한 줄을 덧붙이고 디스크에 기록(fsync)합니다. (두 잠금을 잡은 상태에서 호출)
+
+        전에 쓰다 죽어 남은 마지막 줄 조각이 있으면 새 기록이 거기 붙어 깨지지 않도록 먼저 잘라 냅니다.
+        """
+        line = json.dumps([name, digest], ensure_ascii=False).encode('utf-8') + b'\n'
+        with open(self.journal_path, 'ab') as f:
+            st = os.fstat(f.fileno())
+            created = (st.st_dev, st.st_ino) != self.journal_id
+            if created: # journal이 없어서 방금 만듦
+                self.journal_id, self.journal_offset = (st.st_dev, st.st_ino), 0
+            if st.st_size > self.journal_offset:
+                f.truncate(self.journal_offset)
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        if created:
+            sync_directory(self.root)
+        self.journal_offset += len(line)
+        self.journal_entries += 1
+
+    def _save_index(self):
+        """색인 전체를 index.json에 쓰고 journal을 빈 새 파일로 바꿉니다. (journal 합치기)
+
+        임시 파일에 쓴 뒤 이름을 바꾸므로 도중에 죽어도 색인이 깨지지 않고, 두 이름 바꾸기 사이에 죽어
+        옛 journal이 남아도 이미 합쳐진 기록을 다시 적용할 뿐입니다.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='index.', suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.index_path)
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='index.', suffix='.tmp')
+        os.close(fd)
+        os.replace(tmp, self.journal_path)
+        sync_directory(self.root)
+        self.index_mtime = os.stat(self.index_path).st_mtime_ns
+        st = os.stat(self.journal_path)
+        self.journal_id, self.journal_offset, self.journal_entries = (st.st_dev, st.st_ino), 0, 0
+
+    def path_for(self, digest):
+        if not valid_digest(digest):
+            raise ValueError(f"잘못된 해시입니다: {digest!r}")
+        return os.path.join(self.blob_dir, digest[:2], digest[2:4], digest)
+
+    def has(self, digest):
+        return valid_digest(digest) and os.path.exists(self.path_for(digest))
+
+    def lookup(self, name):
+        """파일명에 연결된 해시를 돌려줍니다. 없으면 None."""
+        with self.lock:
+            self._refresh_index()
+            return self.index.get(name)
+
+    def resolve(self, name):
+        """파일명으로 실제 내용 파일의 경로를 찾습니다. 없으면 None."""
+        digest = self.lookup(name)
+        if digest and self.has(digest):
+            return self.path_for(digest)
+        return None
+
+    def link(self, name, digest):
+        """파일명이 해당 내용을 가리키도록 색인을 갱신합니다. journal에 한 줄 덧붙이고, 많이 쌓였으면 합칩니다."""
+        with self.lock, self._process_lock():
+            self._refresh_index() # 다른 워커가 방금 덧붙인 기록 뒤에 이어 씀
+            self.index[name] = digest
+            self._append_journal(name, digest)
+            if self.journal_entries >= max(JOURNAL_COMPACT_MIN, len(self.index)):
+                self._save_index()
+
+    def open_writer(self):
+        return BlobWriter(self)
+
+    def adopt(self, path, digest):
+        """이미 해시를 확인한 파일을 디스크에 기록(fsync)한 뒤 내용 경로로 옮깁니다. (같은 내용이 있으면 버림)
+
+        이름 바꾸기는 원자적이므로 내용 경로에는 다 쓴 파일만 나타나고, 다운로드가 쓰다 만 파일을 읽는 일이 없습니다.
+        """
+        target = self.path_for(digest)
+        if os.path.exists(target):
+            os.remove(path)
+        else:
+            sync_file(path)
+            directory = os.path.dirname(target)
+            os.makedirs(directory, exist_ok=True)
+            os.replace(path, target)
+            sync_directory(directory) # 이름 바꾸기도 디스크에 남도록
+
+    def checksums(self, digest):
+        """내용 파일의 조각별 CRC32 목록을 돌려줍니다.
+
+        처음 요청될 때 한 번 계산해 옆에 .crc 파일로 저장하므로, 이후 다운로드는 파일을 읽지 않고
+        sendfile로 본문을 보내면서도 조각마다 체크섬을 붙일 수 있습니다.
+        """
+        crc_path = self.path_for(digest) + '.crc'
+        sums = array('I')
+        try:
+            with open(crc_path, 'rb') as f:
+                sums.frombytes(f.read())
+            return sums
+        except FileNotFoundError:
+            pass
+        with open(self.path_for(digest), 'rb') as f:
+            while chunk := f.read(TRANSFER_CHUNK_SIZE):
+                sums.append(zlib.crc32(chunk))
+        tmp = crc_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(sums.tobytes())
+        os.replace(tmp, crc_path)
+        return sums
+
+    def signatures(self, digest):
+        """내용 파일의 블록 서명 파일(.sig) 경로를 돌려줍니다. checksums처럼 처음 요청될 때 한 번 계산해 둡니다."""
+        sig_path = self.path_for(digest) + '.sig'
+        if os.path.exists(sig_path):
+            return sig_path
+        with open(self.path_for(digest), 'rb') as f:
+            signatures = file_signatures(f, DELTA_BLOCK_SIZE)
+        tmp = sig_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(signatures)
+        os.replace(tmp, sig_path)
+        return sig_path
+
+
+class BlobWriter:
+    """수신 중인 파일을 임시 파일에 쓰면서 해시를 계산하고, 끝나면 내용 경로로 옮깁니다.
+
+    서버는 write와 commit을 I/O 스레드(chat_diskio.DiskChannel)에서 호출합니다.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.hash = hashlib.new(HASH_NAME)
+        self.size = 0
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.tmp_dir, suffix='.part')
+        self.file = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        self.file.write(data)
+        self.hash.update(data)
+        self.size += len(data)
+
+    def commit(self, expected=None):
+        """쓰기를 마치고 해시를 돌려줍니다. expected와 다르면 버리고 ValueError를 발생시킵니다."""
+        self.file.close()
+        digest = self.hash.hexdigest()
+        if expected and expected != digest:
+            os.remove(self.tmp_path)
+            raise ValueError(f"해시가 일치하지 않습니다: {digest} (예상 {expected})")
+        self.store.adopt(self.tmp_path, digest)  # 같은 내용이 이미 있으면 새로 받은 것은 버림
+        return digest
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class StagedUpload:
+    """이어받기 업로드 한 건. 받은 바이트는 staging 디렉터리의 .part 파일에 차례대로 쌓입니다."""
+
+    def __init__(self, staging, transfer_id, digest, size, name):
+        self.transfer_id = transfer_id
+        self.digest = digest
+        self.size = size
+        self.name = name
+        self.path = os.path.join(staging.root, transfer_id + '.part')
+        self.meta_path = os.path.join(staging.root, transfer_id + '.json')
+        self.busy = False  # 어떤 연결이 지금 이 업로드의 본문을 받고 있는지 (StagingArea.claim)
+
+    @property
+    def offset(self):
+        """지금까지 받은 바이트 수 (다음에 받을 위치)."""
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    @property
+    def complete(self):
+        return self.offset >= self.size
+
+
+class StagingArea:
+    """끝나지 않은 업로드를 모아 두는 곳. 서버가 다시 시작되어도 .json 정보로 이어받을 수 있습니다."""
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = Lock()
+        os.makedirs(root, exist_ok=True)
+        self.uploads = {}  # 전송 id -> StagedUpload
+        for entry in os.scandir(root):
+            if entry.name.endswith('.json'):
+                with open(entry.path, encoding='utf-8') as f:
+                    meta = json.load(f)
+                self.uploads[meta['id']] = StagedUpload(self, meta['id'], meta['digest'], meta['size'], meta['name'])
+
+    def begin(self, digest, size, name):
+        """같은 내용을 받다가 끊긴 업로드가 있으면 그것을, 없으면 새 업로드를 돌려줍니다."""
+        with self.lock:
+            for upload in self.uploads.values():
+                if upload.digest == digest and upload.size == size:
+                    upload.name = name
+                    return upload
+            upload = StagedUpload(self, uuid.uuid4().hex, digest, size, name)
+            with open(upload.meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'id': upload.transfer_id, 'digest': digest, 'size': size, 'name': name,
+                           'created': time.time()}, f, ensure_ascii=False)
+            open(upload.path, 'ab').close()
+            self.uploads[upload.transfer_id] = upload
+            return upload
+
+    def get(self, transfer_id):
+        """전송 id로 업로드를 찾습니다. 다른 워커 프로세스가 시작한 업로드면 .json 정보에서 읽어 옵니다."""
+        with self.lock:
+            upload = self.uploads.get(transfer_id)
+            if upload is not None and not os.path.exists(upload.meta_path): # 다른 워커가 이미 끝냄
+                del self.uploads[transfer_id]
+                return None
+            if upload is None and transfer_id.isalnum():
+                try:
+                    with open(os.path.join(self.root, transfer_id + '.json'), encoding='utf-8') as f:
+                        meta = json.load(f)
+                except FileNotFoundError:
+                    return None
+                upload = StagedUpload(self, meta['id'], meta['digest'], meta['size'], meta['name'])
+                self.uploads[transfer_id] = upload
+            return upload
+
+    def claim(self, upload):
+        """본문을 받기 시작할 때 호출합니다. 다른 연결이 이미 받고 있으면 False."""
+        with self.lock:
+            if upload.busy:
+                return False
+            upload.busy = True
+            return True
+
+    def release(self, upload):
+        with self.lock:
+            upload.busy = False
+
+    def discard(self, upload):
+        with self.lock:
+            self.uploads.pop(upload.transfer_id, None)
+        for path in (upload.path, upload.meta_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def finish(self, upload, store):
+        """모두 받은 업로드의 해시를 확인하고 저장소로 옮깁니다. 해시가 다르면 버리고 ValueError."""
+        digest = file_digest(upload.path)
+        if digest != upload.digest:
+            self.discard(upload)
+            raise ValueError(f"해시가 일치하지 않습니다: {digest} (예상 {upload.digest})")
+        store.adopt(upload.path, digest)
+        self.discard(upload)
+        return digest
+
+
+def sync_file(path):
+    """파일 내용을 디스크에 기록합니다."""
+    fd = os.open(path, os.O_RDWR)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def sync_directory(path):
+    """디렉터리 항목(새 이름)을 디스크에 기록합니다. 디렉터리를 열 수 없는 운영체제(Windows)에서는 생략합니다."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """파일의 SHA-256 해시(16진 문자열)를 계산합니다. 클라이언트가 업로드 전에 사용합니다."""
+    h = hashlib.new(HASH_NAME)
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
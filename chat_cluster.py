@@ -0,0 +1,183 @@
+"""여러 서버 프로세스(워커)가 같은 포트를 나누어 받는 멀티 프로세스 모드.
+
+각 워커는 SO_REUSEPORT로 같은 포트에 바인딩하므로 커널이 새 연결을 워커들에게 고르게 나누어 줍니다.
+워커마다 인터프리터(GIL)가 따로 있어 브로드캐스트 처리량이 코어 수만큼 늘어납니다.
+한 워커의 클라이언트가 보낸 채팅/타이핑/NEW_FILE 알림은 부모 프로세스의 로컬 버스(유닉스 도메인 소켓)를
+거쳐 다른 워커들에게 전달되므로, 클라이언트는 어느 워커에 붙어 있든 하나의 채팅방을 봅니다.
+
+원본 중계 방식의 이미지는 본문을 버스로 보내지 않습니다. 보낸 워커가 중계하면서 저장소(워커들이 함께 쓰는
+storage 디렉터리)에 쓴 뒤 "해시:헤더 메시지"만 BUS_BLOB으로 알리면, 다른 워커들이 그 파일을 sendfile로 보냅니다.
+
+DM은 받는 사람이 접속한 워커만 전달하도록 방 이름 자리에 받는 사람 이름을 넣어 BUS_DIRECT로 보내고,
+접속/퇴장("ONLINE:이름"/"OFFLINE:이름")은 BUS_PRESENCE로 알려 워커마다 다른 워커의 접속자도 알고 있게 합니다.
+
+버스 메시지: [플래그 1바이트][방 이름 길이 2바이트][데이터 길이 4바이트][방 이름][이미 인코딩된 프레임들]
+"""
+import os
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import time
+from multiprocessing import get_context
+from threading import Lock, Thread
+from chat_protocol import recv_exact
+
+BUS_HEADER = struct.Struct('!BHI')  # 플래그, 방 이름 길이, 데이터 길이
+BUS_DROPPABLE = 0x01  # 타이핑 이벤트처럼 송신 큐가 가득 차면 버려도 되는 메시지
+BUS_RECORD = 0x02  # 방 기록(링 버퍼)에 남길 메시지. 로그 파일에는 보낸 워커가 이미 썼음
+BUS_TYPING = 0x04  # 클라이언트에게 보내지 않고 타이핑 상태에만 반영할 TYPING:/TYPING_STOP: 이벤트
+BUS_BLOB = 0x08  # 데이터가 "해시:헤더 메시지"인 저장소 파일 참조. 받은 워커가 헤더 뒤에 파일 본문을 보냄
+BUS_DIRECT = 0x10  # 방 이름 자리의 사용자에게만 보낼 프레임 (DM)
+BUS_PRESENCE = 0x20  # 데이터가 "ONLINE:이름" 또는 "OFFLINE:이름"인 접속자 변경. 받은 워커가 모든 클라이언트에게 알림
+BUS_CONNECT_TIMEOUT = 10.0  # 워커가 버스에 접속을 기다리는 최대 시간(초)
+
+
+def read_bus_message(sock):
+    """버스 메시지 하나를 읽어 (데이터, droppable, 방 이름, record, typing, blob, direct, presence)를 돌려줍니다.
+    연결이 끊기면 None."""
+    try:
+        header = recv_exact(sock, BUS_HEADER.size)
+        if header is None:
+            return None
+        flags, room_length, length = BUS_HEADER.unpack(header)
+        body = recv_exact(sock, room_length + length) if room_length + length else b''
+    except ConnectionError:
+        return None
+    return (body[room_length:], bool(flags & BUS_DROPPABLE), body[:room_length].decode('utf-8'),
+            bool(flags & BUS_RECORD), bool(flags & BUS_TYPING), bool(flags & BUS_BLOB),
+            bool(flags & BUS_DIRECT), bool(flags & BUS_PRESENCE))
+
+
+def encode_bus_message(data, droppable=False, room='', record=False, typing=False, blob=False, direct=False,
+                       presence=False):
+    flags = ((BUS_DROPPABLE if droppable else 0) | (BUS_RECORD if record else 0) | (BUS_TYPING if typing else 0)
+             | (BUS_BLOB if blob else 0) | (BUS_DIRECT if direct else 0) | (BUS_PRESENCE if presence else 0))
+    room = room.encode('utf-8')
+    return BUS_HEADER.pack(flags, len(room), len(data)) + room + data
+
+
+class BroadcastBus:
+    """부모 프로세스에서 실행되는 버스 허브. 한 워커가 보낸 메시지를 나머지 워커 모두에게 전달합니다."""
+
+    def __init__(self, path):
+        self.path = path
+        self.peers = {}  # 워커 소켓 -> 쓰기 잠금
+        self.lock = Lock()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen()
+        Thread(target=self.accept_loop, daemon=True).start()
+
+    def accept_loop(self):
+        while True:
+            peer, _ = self.sock.accept()
+            with self.lock:
+                self.peers[peer] = Lock()
+            Thread(target=self.forward_loop, args=(peer,), daemon=True).start()
+
+    def forward_loop(self, peer):
+        """워커 하나가 보낸 메시지를 다른 워커들에게 그대로 전달합니다 (다시 인코딩하지 않음)."""
+        try:
+            while True:
+                message = read_bus_message(peer)
+                if message is None:
+                    break
+                raw = encode_bus_message(*message)
+                with self.lock:
+                    targets = [(other, lock) for other, lock in self.peers.items() if other is not peer]
+                for other, lock in targets:
+                    try:
+                        with lock:
+                            other.sendall(raw)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                self.peers.pop(peer, None)
+            peer.close()
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class BusClient:
+    """워커 쪽 버스 연결. publish로 보낸 메시지는 다른 워커들의
+    on_message(데이터, droppable, 방, record, typing, blob, direct, presence)로 전달됩니다.
+
+    on_message는 버스 수신 스레드에서 호출됩니다.
+    """
+
+    def __init__(self, path, on_message):
+        self.on_message = on_message
+        self.lock = Lock()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        deadline = time.monotonic() + BUS_CONNECT_TIMEOUT
+        while True:
+            try:
+                self.sock.connect(path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+        Thread(target=self.receive_loop, daemon=True).start()
+
+    def publish(self, data, droppable=False, room='', record=False, typing=False, blob=False, direct=False,
+                presence=False):
+        """이미 인코딩된 프레임들을 다른 워커들의 room 참여자에게 보냅니다."""
+        with self.lock:
+            self.sock.sendall(encode_bus_message(data, droppable, room, record, typing, blob, direct, presence))
+
+    def receive_loop(self):
+        while True:
+            message = read_bus_message(self.sock)
+            if message is None:
+                # 부모 프로세스가 끝났음. 다른 워커와 떨어진 채로 클라이언트를 받지 않도록 워커도 종료
+                print("버스 연결이 끊어져 워커를 종료합니다.")
+                os._exit(1)
+            try:
+                self.on_message(*message)
+            except Exception as e:
+                print(f"버스 메시지 처리 중 오류 발생: {e}")
+
+
+def _run_worker(engine, port, options):
+    engine(port, **options)
+
+
+def run_cluster(engine, workers, port, **options):
+    """버스를 연 뒤 engine 서버 workers개를 각각의 프로세스에서 같은 포트로 실행합니다."""
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise SystemExit("이 운영체제는 SO_REUSEPORT를 지원하지 않아 멀티 프로세스 모드를 사용할 수 없습니다.")
+    bus_dir = tempfile.mkdtemp(prefix='chatbus.')
+    bus = BroadcastBus(os.path.join(bus_dir, 'bus.sock'))
+    options = dict(options, reuse_port=True, bus_path=bus.path)
+    metrics_port = options.get('metrics_port')
+    ctx = get_context('spawn')  # 버스 스레드가 떠 있는 부모 프로세스를 fork하지 않음
+    # 워커는 미리보기 프로세스 풀을 만들어야 하므로 daemon 프로세스로 만들 수 없음
+    # 계측 포트는 워커마다 따로 (metrics_port, metrics_port+1, ...)
+    processes = [ctx.Process(target=_run_worker, args=(engine, port, dict(options, metrics_port=metrics_port + i)
+                                                       if metrics_port else options))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    print(f"워커 {workers}개가 포트 {port}를 함께 사용합니다.")
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) # kill로 종료해도 워커를 정리
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        bus.close()
+        os.rmdir(bus_dir)
@@ -0,0 +1,240 @@
+"""연결을 시작할 때 협상하는 압축 (zlib/deflate).
+
+클라이언트가 접속 직후 "COMPRESS:deflate,files"로 제안하면 서버는 쓸 수 있는 것만 골라
+"COMPRESS_OK:deflate[,files]"로 답합니다. 그 뒤로 양쪽은 프레임 여러 개를 압축해 DEFLATE 프레임 하나에 담아
+보낼 수 있고, 받는 쪽은 풀어서 안에 든 프레임들을 원래 프레임처럼 읽습니다. (압축하지 않은 프레임과 섞여도 됨)
+
+  - FRAME_DEFLATE: 채팅/명령 프레임용 스트림. 연결마다 방향별로 하나씩 유지하고 PRESET_DICTIONARY로 시작하므로
+    짧은 채팅 한 줄도 앞서 오간 메시지와 자주 쓰는 명령어를 참조해 줄어듭니다.
+  - FRAME_DEFLATE_BODY: 파일 본문(CHUNK/DATA 프레임)용 스트림. "files"를 협상했을 때만 쓰고, 빠른 압축 수준을
+    씁니다. PNG/JPEG/ZIP처럼 이미 압축된 형식은 앞부분의 시그니처로 알아보고 압축하지 않습니다.
+
+스트림은 보내는 순서대로 이어지므로 압축기에 넣은 데이터는 반드시 그 순서대로 보내야 합니다.
+업로드 크레딧은 압축을 푼 프레임 기준으로 셉니다.
+"""
+import time
+import zlib
+from chat_protocol import (HEADER, FRAME_DATA, FRAME_CHUNK, FRAME_DEFLATE, FRAME_DEFLATE_BODY, CHUNK_HEADER,
+                           ProtocolError, encode_frame, parse_header, recv_exact)
+
+COMPRESSION_OFFER = "deflate,files"  # 클라이언트가 제안하는 방식
+# 서버 설정: 압축 안 함 / 채팅 프레임만 / 파일 본문까지
+COMPRESSION_OFF = 'off'
+COMPRESSION_TEXT = 'text'
+COMPRESSION_FILES = 'files'
+COMPRESSION_MODES = (COMPRESSION_OFF, COMPRESSION_TEXT, COMPRESSION_FILES)
+TEXT_LEVEL = 6  # 채팅 스트림 압축 수준
+BODY_LEVEL = 1  # 파일 본문 압축 수준 (CPU를 덜 쓰는 쪽)
+MIN_COMPRESS_SIZE = 64  # 이보다 작은 묶음은 압축해도 헤더와 동기화 표시 때문에 오히려 커짐
+MAX_COMPRESS_SIZE = 2 * 1024 * 1024  # DEFLATE 프레임 하나에 담는 압축 전 최대 크기 (푼 크기 제한이기도 함)
+SNIFF_SIZE = 16  # 형식을 알아보는 데 쓰는 앞부분 바이트 수
+
+# 뒤쪽에 있을수록 가까운 거리로 참조되므로 자주 쓰는 문자열을 뒤에 둠
+PRESET_DICTIONARY = (
+    "FILE_OFFER:FILE_ACCEPT:FILE_CHUNKS:FILE_STORED:FILE_EXISTS:FILE_START:DOWNLOAD_RESUME:DOWNLOAD:"
+    "IMAGE_THUMB:IMAGE_START:IMAGE_FETCH:METRICS:JOIN_FAILED:JOINED:HISTORY:CREDIT:NEW_FILE:"
+    "ㅋㅋㅋㅋ ㅎㅎ 네 감사합니다 안녕하세요 파일 이미지 TYPING_STOP:TYPING_STATE:TYPING:lobby"
+).encode('utf-8')
+
+# 이미 압축된 형식의 시그니처 (파일 맨 앞)
+COMPRESSED_SIGNATURES = (
+    b'\x89PNG\r\n\x1a\n',  # PNG
+    b'\xff\xd8\xff',  # JPEG
+    b'GIF8',  # GIF
+    b'PK\x03\x04',  # ZIP (docx/xlsx/jar/apk 포함)
+    b'\x1f\x8b',  # gzip
+    b'BZh',  # bzip2
+    b'\xfd7zXZ\x00',  # xz
+    b'7z\xbc\xaf\x27\x1c',  # 7z
+    b'Rar!\x1a\x07',  # RAR
+    b'\x28\xb5\x2f\xfd',  # zstd
+    b'OggS',  # Ogg
+    b'ID3',  # MP3
+)
+
+
+def is_compressed_format(head):
+    """파일 앞부분을 보고 이미 압축된 형식인지 판단합니다."""
+    head = bytes(head[:SNIFF_SIZE])
+    if head.startswith(COMPRESSED_SIGNATURES):
+        return True
+    if head[:4] == b'RIFF' and head[8:12] in (b'WEBP', b'AVI '):
+        return True
+    return head[4:8] == b'ftyp'  # MP4/MOV/HEIC
+
+
+def is_compressed_file(path):
+    with open(path, "rb") as f:
+        return is_compressed_format(f.read(SNIFF_SIZE))
+
+
+def compressible(data):
+    """인코딩된 프레임 묶음을 압축할 만한지 봅니다.
+
+    너무 작거나 크면, 또는 이미 압축된 형식의 본문(미리보기 이미지 등)이 들어 있으면 False입니다.
+    """
+    if not MIN_COMPRESS_SIZE <= len(data) <= MAX_COMPRESS_SIZE:
+        return False
+    view = memoryview(data)
+    pos = 0
+    while pos + HEADER.size <= len(view):
+        _, ftype, length = HEADER.unpack_from(view, pos)
+        body = pos + HEADER.size
+        if ftype == FRAME_CHUNK:
+            body += CHUNK_HEADER.size
+        if ftype in (FRAME_DATA, FRAME_CHUNK) and is_compressed_format(view[body:body + SNIFF_SIZE]):
+            return False
+        pos = pos + HEADER.size + length
+    return True
+
+
+def accept_offer(mode, offer):
+    """클라이언트가 제안한 "deflate,files" 같은 목록에서 서버 설정(mode)으로 허용할 것만 골라 돌려줍니다."""
+    offered = set(offer.split(","))
+    if mode == COMPRESSION_OFF or "deflate" not in offered:
+        return []
+    if mode == COMPRESSION_FILES and "files" in offered:
+        return ["deflate", "files"]
+    return ["deflate"]
+
+
+class CompressionStats:
+    """연결 하나의 압축 통계. 보내는 쪽은 송신 스레드, 받는 쪽은 수신 스레드만 늘립니다."""
+
+    def __init__(self):
+        self.raw_out = 0  # 압축 전 보낸 바이트 수
+        self.packed_out = 0  # 압축해서 실제로 보낸 바이트 수 (DEFLATE 프레임 헤더 포함)
+        self.raw_in = 0  # 풀어서 얻은 바이트 수
+        self.packed_in = 0  # 받은 DEFLATE 프레임 바이트 수
+        self.cpu_out = 0.0  # 압축에 쓴 CPU 시간(초)
+        self.cpu_in = 0.0  # 압축 해제에 쓴 CPU 시간(초)
+
+    @property
+    def cpu(self):
+        return self.cpu_out + self.cpu_in
+
+    @staticmethod
+    def ratio(raw, packed):
+        return packed / raw if raw else 1.0
+
+    def summary(self):
+        return (f"보냄 {self.raw_out}->{self.packed_out} 바이트 ({self.ratio(self.raw_out, self.packed_out):.2f}), "
+                f"받음 {self.packed_in}->{self.raw_in} 바이트 ({self.ratio(self.raw_in, self.packed_in):.2f}), "
+                f"CPU {self.cpu * 1000:.1f}ms")
+
+
+class Deflater:
+    """보내는 방향의 압축 상태. files가 False면 파일 본문 스트림은 없습니다."""
+
+    def __init__(self, stats, files=False):
+        self.stats = stats
+        self.text = zlib.compressobj(TEXT_LEVEL, zdict=PRESET_DICTIONARY)
+        self.body = zlib.compressobj(BODY_LEVEL) if files else None
+
+    def pack(self, data, body=False):
+        """인코딩된 프레임들을 압축해 DEFLATE 프레임 하나로 만듭니다."""
+        started = time.thread_time()
+        stream = self.body if body else self.text
+        payload = stream.compress(data) + stream.flush(zlib.Z_SYNC_FLUSH)  # 받는 쪽이 바로 풀 수 있게 경계를 맞춤
+        frame = encode_frame(FRAME_DEFLATE_BODY if body else FRAME_DEFLATE, payload)
+        self.stats.cpu_out += time.thread_time() - started
+        self.stats.raw_out += len(data)
+        self.stats.packed_out += len(frame)
+        return frame
+
+
+class Inflater:
+    """받는 방향의 압축 해제 상태."""
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.text = zlib.decompressobj(zdict=PRESET_DICTIONARY)
+        self.body = zlib.decompressobj()
+
+    def unpack(self, ftype, payload):
+        started = time.thread_time()
+        stream = self.body if ftype == FRAME_DEFLATE_BODY else self.text
+        try:
+            data = stream.decompress(payload, MAX_COMPRESS_SIZE)
+        except zlib.error as e:
+            raise ProtocolError(f"압축을 풀 수 없습니다: {e}")
+        if stream.unconsumed_tail:
+            raise ProtocolError("압축을 푼 크기가 너무 큽니다.")
+        self.stats.cpu_in += time.thread_time() - started
+        self.stats.raw_in += len(data)
+        self.stats.packed_in += HEADER.size + len(payload)
+        return data
+
+
+class InflatingSocket:
+    """블로킹 소켓을 감싸 DEFLATE 프레임은 풀어서 안의 프레임들을, 다른 프레임은 그대로 돌려주는 읽기 전용 객체.
+
+    recv_into만 제공하므로 read_frame, iter_body 같은 함수에 소켓 대신 넘기면 압축 여부를 모른 채 동작합니다.
+    압축하지 않은 프레임의 본문은 복사하지 않고 소켓에서 바로 읽습니다.
+    """
+
+    def __init__(self, sock, inflater):
+        self.sock = sock
+        self.inflater = inflater
+        self.buffer = bytearray()  # 풀어 둔 프레임(또는 그대로 넘길 프레임 헤더)
+        self.passthrough = 0  # 소켓에서 그대로 읽어 넘길 남은 본문 바이트 수
+
+    def recv_into(self, view):
+        while not self.buffer:
+            if self.passthrough:
+                count = self.sock.recv_into(view[:self.passthrough])
+                self.passthrough -= count
+                return count
+            header = recv_exact(self.sock, HEADER.size)
+            if header is None:
+                return 0
+            ftype, length = parse_header(header)
+            if ftype in (FRAME_DEFLATE, FRAME_DEFLATE_BODY):
+                payload = recv_exact(self.sock, length) if length else b''
+                if payload is None:
+                    raise ConnectionError("프레임 수신 도중 연결이 끊어졌습니다.")
+                self.buffer += self.inflater.unpack(ftype, payload)
+            else:
+                self.buffer += header
+                self.passthrough = length
+        count = min(len(view), len(self.buffer))
+        view[:count] = self.buffer[:count]
+        del self.buffer[:count]
+        return count
+
+
+class AsyncInflatingReader:
+    """InflatingSocket의 asyncio 버전. read_frame_async가 쓰는 readexactly만 제공합니다."""
+
+    def __init__(self, reader, inflater):
+        self.reader = reader
+        self.inflater = inflater
+        self.buffer = bytearray()
+        self.passthrough = 0
+
+    async def readexactly(self, n):
+        out = bytearray()
+        try:
+            while len(out) < n:
+                if self.buffer:
+                    count = min(n - len(out), len(self.buffer))
+                    out += self.buffer[:count]
+                    del self.buffer[:count]
+                elif self.passthrough:
+                    count = min(n - len(out), self.passthrough)
+                    out += await self.reader.readexactly(count)
+                    self.passthrough -= count
+                else:
+                    header = await self.reader.readexactly(HEADER.size)
+                    ftype, length = parse_header(header)
+                    if ftype in (FRAME_DEFLATE, FRAME_DEFLATE_BODY):
+                        payload = await self.reader.readexactly(length) if length else b''
+                        self.buffer += self.inflater.unpack(ftype, payload)
+                    else:
+                        self.buffer += header
+                        self.passthrough = length
+        except EOFError as e:  # asyncio.IncompleteReadError: 지금까지 읽은 것까지 포함해 다시 알림
+            e.partial = bytes(out) + e.partial
+            e.expected = n
+            raise
+        return bytes(out)
@@ -0,0 +1,518 @@
+"""서버 쪽 클라이언트 연결 객체.
+
+연결마다 크기가 제한된 송신 큐와 전용 송신자(스레드 또는 코루틴)를 두어,
+느린 클라이언트 하나가 브로드캐스트 전체나 메시지를 보낸 클라이언트의 수신을 막지 않게 합니다.
+큐에는 이미 인코딩된 바이트열을 넣으므로 같은 메시지를 여러 수신자가 그대로 공유합니다.
+
+송신자는 큐에서 꺼낸 작은 프레임들을 바로 쓰지 않고 flush_interval 동안(또는 flush_bytes가 찰 때까지)
+모았다가 한 번에 씁니다. 채팅 한 줄마다 시스템 호출과 TCP 세그먼트가 하나씩 생기지 않도록 하는 것으로,
+Nagle 알고리즘에 맡기지 않고 TCP_NODELAY를 켠 채 언제 보낼지는 서버가 직접 정합니다.
+압축을 협상한 연결이면 묶은 프레임들을 연결의 압축 스트림으로 압축해 DEFLATE 프레임 하나로 씁니다.
+
+다중화를 협상한 연결의 다운로드는 송신 작업 대신 OutboundStream으로 큐에 들어옵니다. 송신자는 큐가 빌 때마다
+보내는 중인 스트림들을 돌아가며 조각 하나씩 보내므로(chat_streams 참고) 전송 중에도 채팅이 밀리지 않습니다.
+"""
+import asyncio
+import itertools
+import os
+import queue
+import time
+from collections import deque
+from socket import SHUT_RDWR, IPPROTO_TCP, TCP_NODELAY, socket
+from threading import Lock, Thread
+from chat_compression import CompressionStats, compressible
+from chat_heartbeat import Liveness
+from chat_streams import StreamTable, AsyncStreamReader, OutboundStream
+
+# 송신 큐가 가득 찼을 때의 처리 방식. 브로드캐스트하는 쪽은 어느 방식이든 기다리지 않음
+OVERFLOW_DROP_TYPING = 'drop_typing'  # 타이핑 이벤트는 버리고, 나머지는 즉시 연결 종료
+OVERFLOW_DISCONNECT = 'disconnect'    # 즉시 연결 종료
+OVERFLOW_BLOCK = 'block'              # 타이핑 이벤트는 버리고, 나머지는 spill에 쌓아 두고 자리가 나기를 기다려 줌
+                                      # (block_timeout 넘게 밀려 있거나 BLOCK_SPILL_SIZE를 넘으면 연결 종료)
+OVERFLOW_POLICIES = (OVERFLOW_DROP_TYPING, OVERFLOW_DISCONNECT, OVERFLOW_BLOCK)
+
+DEFAULT_QUEUE_SIZE = 256  # 연결당 송신 큐에 쌓을 수 있는 메시지 수
+DEFAULT_BLOCK_TIMEOUT = 5.0  # block 방식에서 메시지가 송신 큐 밖(spill)에 밀려 있어도 연결을 유지하는 최대 시간(초)
+BLOCK_SPILL_SIZE = 4096  # block 방식에서 송신 큐 밖에 더 쌓아 둘 수 있는 메시지 수
+DEFAULT_FLUSH_INTERVAL = 0.002  # 첫 프레임을 꺼낸 뒤 다른 프레임을 더 모으는 시간(초). 0이면 이미 쌓인 것만 묶음
+DEFAULT_FLUSH_BYTES = 64 * 1024  # 모은 크기가 이만큼 되면 시간과 상관없이 바로 씀. 0 이하면 묶지 않고 하나씩 씀
+DETACH = object()  # 송신 큐에 넣으면 앞의 것을 모두 보낸 뒤 소켓을 닫지 않고 송신자를 멈춤 (다른 프로세스로 넘길 때)
+
+
+class WriteStats:
+    """서버 전체의 송신 통계. 보낸 메시지(송신 큐 항목) 수와 소켓 쓰기 호출 수를 비교해 묶어 보내기 효과를 봅니다.
+
+    파일 전송 같은 송신 작업은 TransferStats에서 따로 셉니다.
+    """
+
+    def __init__(self):
+        self.messages = 0  # 소켓에 쓴 프레임(큐 항목) 수
+        self.writes = 0  # sendall / StreamWriter.write 호출 수
+        self.bytes = 0
+        self.lock = Lock()
+
+    def add(self, messages, nbytes):
+        with self.lock:
+            self.messages += messages
+            self.writes += 1
+            self.bytes += nbytes
+
+    def summary(self):
+        per_message = self.writes / self.messages if self.messages else 0.0
+        return (f"메시지 {self.messages}개, 소켓 쓰기 {self.writes}회 "
+                f"(메시지당 {per_message:.2f}회), {self.bytes} 바이트")
+
+
+def join_frames(frames):
+    return frames[0] if len(frames) == 1 else b"".join(frames)
+
+
+def pack_frames(pending, deflater):
+    """모아 둔 프레임들을 한 번에 쓸 바이트열로 만듭니다. 압축할 만하면 DEFLATE 프레임 하나로 압축합니다."""
+    data = join_frames(pending)
+    if deflater is not None and compressible(data):
+        return deflater.pack(data)
+    return data
+
+
+class ClientConnection:
+    """스레드 방식 서버의 클라이언트 연결. 소켓 쓰기는 전용 송신 스레드만 합니다."""
+
+    def __init__(self, sock, addr, queue_size=DEFAULT_QUEUE_SIZE,
+                 overflow_policy=OVERFLOW_DROP_TYPING, block_timeout=DEFAULT_BLOCK_TIMEOUT,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, flush_bytes=DEFAULT_FLUSH_BYTES, stats=None):
+        self.sock = sock
+        self.inbound = sock  # 프레임을 읽는 쪽 (압축을 협상하면 InflatingSocket으로 바뀜)
+        self.addr = addr
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.stats = stats if stats is not None else WriteStats()
+        sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)  # 묶어 보내기는 송신 스레드가 하므로 커널이 더 미루지 않게 함
+        self.outbound = queue.Queue(maxsize=queue_size)  # 보낼 바이트열 또는 송신 작업
+        self.closed = False
+        self.dropped = 0  # 큐가 가득 차서 버린 메시지 수
+        self.spill = deque()  # block 방식에서 송신 큐가 가득 차 넣지 못한 메시지 (자리가 나면 송신 스레드가 옮김)
+        self.spill_lock = Lock()  # spill과 송신 큐 사이의 순서 보호
+        self.full_since = None  # spill에 처음 쌓기 시작한 시각
+        self.bytes_in = 0  # 받은 바이트 수 (수신 스레드만 늘림. 다중화된 업로드는 STREAM 프레임으로 셈)
+        self.bytes_out = 0  # 보낸 바이트 수 (송신 스레드만 늘림)
+        self.offers = {}  # FILE_OFFER로 미리 알려 온 파일명 -> 해시
+        self.credit = None  # 업로드 흐름 제어 (서버가 UploadCredit을 붙임)
+        self.message_limit = None  # 메시지 속도 제한 (서버가 RateLimit을 붙임. None이면 제한 없음)
+        self.deflater = None  # 압축을 협상했으면 보내는 방향의 압축 상태 (송신 스레드만 사용)
+        self.compression = CompressionStats()  # 압축 전후 바이트 수와 압축에 쓴 CPU 시간
+        self.liveness = Liveness()  # 마지막으로 받은 시각 등 (하트비트와 연결 정리에 사용)
+        self.room = None  # 지금 들어가 있는 방 (RoomIndex가 관리)
+        self.multiplexed = False  # 클라이언트가 다중화 스트림을 협상했으면 True ("STREAMS")
+        self.streams = StreamTable()  # 받는 중인 업로드 스트림들
+        self.stream_ids = itertools.count(2, 2)  # 서버가 여는 스트림의 id (짝수)
+        self.writer = Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def send(self, data, droppable=False, wait=False):
+        """인코딩된 프레임(또는 소켓을 인자로 받는 송신 작업)을 송신 큐에 넣습니다.
+
+        droppable은 타이핑 이벤트처럼 버려도 되는 메시지, wait는 요청한 클라이언트 자신에게
+        보내는 응답처럼 정책과 상관없이 자리가 날 때까지 기다려야 하는 경우에 사용합니다.
+        wait가 아니면 기다리지 않습니다. 브로드캐스트는 보낸 클라이언트의 수신 스레드(또는 버스 스레드)에서
+        수신자마다 부르므로, 느린 수신자 하나를 기다리면 다른 수신자와 보낸 사람까지 모두 밀립니다.
+        block 방식은 그 대신 spill에 쌓아 두므로 메시지를 잃지 않습니다. (spill_send)
+        큐에 넣지 못했으면 False를 돌려줍니다.
+        """
+        if self.closed:
+            return False
+        if wait:
+            while not self.closed:  # 송신 스레드가 끝난 뒤에 영원히 기다리지 않도록 주기적으로 확인
+                try:
+                    self.outbound.put(data, timeout=1.0)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        if self.overflow_policy == OVERFLOW_BLOCK and not droppable:
+            return self.spill_send(data)
+        try:
+            self.outbound.put_nowait(data)
+            return True
+        except queue.Full:
+            pass
+        if droppable and self.overflow_policy != OVERFLOW_DISCONNECT:
+            self.dropped += 1
+            return False
+        print(f"{self.addr} 송신 큐가 가득 차 연결을 종료합니다.")
+        self.close()
+        return False
+
+    def spill_send(self, data):
+        """block 방식: 송신 큐가 가득 찼으면(또는 이미 밀린 메시지가 있으면) spill 뒤에 쌓아 순서를 지킵니다.
+
+        spill은 송신 스레드가 큐에서 하나 꺼낼 때마다 자리가 나는 만큼 옮깁니다. 처음 쌓은 뒤 block_timeout이
+        지나도록 밀려 있거나 BLOCK_SPILL_SIZE가 차면 그 수신자는 따라오지 못하는 것으로 보고 연결을 끊습니다.
+        """
+        with self.spill_lock:
+            if not self.spill:
+                try:
+                    self.outbound.put_nowait(data)
+                    return True
+                except queue.Full:
+                    self.full_since = time.monotonic()
+            if time.monotonic() - self.full_since < self.block_timeout and len(self.spill) < BLOCK_SPILL_SIZE:
+                self.spill.append(data)
+                self.refill() # 그 사이 송신 스레드가 큐를 비웠을 수 있음
+                return True
+        print(f"{self.addr} 송신 큐가 {self.block_timeout}초 넘게 밀려 연결을 종료합니다.")
+        self.close()
+        return False
+
+    def refill(self):
+        """spill에 밀린 메시지를 송신 큐에 자리가 나는 만큼 순서대로 옮깁니다. (spill_lock을 잡고 호출)"""
+        while self.spill:
+            try:
+                self.outbound.put_nowait(self.spill[0])
+            except queue.Full:
+                return
+            self.spill.popleft()
+
+    def write_loop(self):
+        """송신 큐에서 꺼낸 데이터를 차례대로 소켓에 씁니다.
+
+        프레임은 첫 프레임부터 flush_interval이 지나거나 모은 크기가 flush_bytes를 넘을 때 한 번에 씁니다.
+        송신 작업을 꺼내면 모아 둔 프레임부터 보내므로 순서는 그대로 유지됩니다.
+        스트림(OutboundStream)은 보내는 중인 목록에 넣고, 큐가 빌 때마다 모아 둔 프레임을 쓴 뒤 조각 하나를 보냅니다.
+        """
+        pending, size, deadline = [], 0, 0
+        streams = deque()  # 보내는 중인 스트림 (맨 앞 스트림의 조각을 보내고 맨 뒤로 돌림)
+        detaching = detached = False
+        try:
+            while True:
+                if streams: # 보낼 조각이 있으면 기다리지 않고, 쌓인 메시지가 없을 때마다 조각 하나
+                    try:
+                        if detaching: # 넘기기 전에 보내던 스트림만 마저 보냄
+                            raise queue.Empty
+                        item = self.outbound.get_nowait()
+                    except queue.Empty:
+                        if pending:
+                            self.flush(pending, size)
+                            pending, size = [], 0
+                        self.send_segment(streams)
+                        if detaching and not streams:
+                            detached = True
+                            break
+                        continue
+                elif pending:
+                    try:
+                        timeout = deadline - time.monotonic()
+                        item = self.outbound.get(timeout=timeout) if timeout > 0 else self.outbound.get_nowait()
+                    except queue.Empty: # 시간이 됐고 더 쌓인 것도 없음
+                        self.flush(pending, size)
+                        pending, size = [], 0
+                        continue
+                else:
+                    item = self.outbound.get()
+                if self.spill: # 하나 꺼내 자리가 났으므로 block 방식에서 밀려 있던 메시지를 옮김
+                    with self.spill_lock:
+                        if item is DETACH and self.spill: # 밀린 메시지까지 보낸 뒤에 멈춤
+                            self.spill.append(DETACH)
+                            item = None
+                        self.refill()
+                    if item is None and not self.closed:
+                        continue
+                if item is None or self.closed:
+                    break
+                if item is DETACH:
+                    if pending:
+                        self.flush(pending, size)
+                        pending, size = [], 0
+                    if not streams:
+                        detached = True
+                        break
+                    detaching = True
+                    continue
+                if isinstance(item, OutboundStream):
+                    streams.append(item)
+                    continue
+                if callable(item):
+                    if pending:
+                        self.flush(pending, size)
+                        pending, size = [], 0
+                    self.liveness.sending = True
+                    try:
+                        item(self.sock)  # 파일 다운로드처럼 소켓을 직접 다루는 작업
+                    finally:
+                        self.liveness.sending = False
+                    continue
+                if not pending:
+                    deadline = time.monotonic() + self.flush_interval
+                pending.append(item)
+                size += len(item)
+                if size >= self.flush_bytes: # flush_bytes가 0 이하면 항상 바로 씀
+                    self.flush(pending, size)
+                    pending, size = [], 0
+        except OSError:
+            pass
+        finally:
+            if not detached:
+                self.close()
+                self.sock.close()
+
+    def flush(self, pending, size):
+        """모아 둔 프레임들을 sendall 한 번으로 보냅니다."""
+        self.sock.sendall(pack_frames(pending, self.deflater))
+        self.bytes_out += size
+        self.stats.add(len(pending), size)
+
+    def send_segment(self, streams):
+        """맨 앞 스트림의 조각 하나를 보내고 그 스트림을 맨 뒤로 돌립니다. 다 보낸 스트림은 목록에서 뺍니다."""
+        stream = streams.popleft()
+        try:
+            if not stream.send(self.sock, self.deflater):
+                return
+        except OSError:
+            raise # 소켓 오류는 연결을 닫음
+        except Exception as e:
+            print(f"파일 전송 중 오류 발생: {e}")
+            return
+        streams.append(stream)
+
+    def detach(self):
+        """송신 큐에 남은 것을 모두 보낸 뒤 송신 스레드를 멈추고 소켓을 닫지 않은 채 돌려줍니다.
+
+        수신 스레드는 이미 멈춘 상태여야 합니다. 그 사이 연결이 끊겼으면 None.
+        """
+        if not self.send(DETACH, wait=True):
+            return None
+        self.writer.join()
+        if self.closed:
+            return None
+        self.closed = True # 이후의 send는 큐에 넣지 않음
+        return self.sock
+
+    def close(self):
+        """연결을 닫습니다. 수신 스레드는 recv 실패로, 송신 스레드는 종료 신호로 빠져나옵니다."""
+        if self.closed:
+            return
+        self.closed = True
+        self.streams.close() # 업로드 스트림을 읽던 스레드도 연결 끊김을 봄
+        try:
+            self.sock.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.outbound.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+class AsyncClientConnection:
+    """asyncio 서버의 클라이언트 연결. StreamWriter 쓰기는 전용 송신 태스크만 합니다."""
+
+    def __init__(self, writer, queue_size=DEFAULT_QUEUE_SIZE,
+                 overflow_policy=OVERFLOW_DROP_TYPING, block_timeout=DEFAULT_BLOCK_TIMEOUT,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, flush_bytes=DEFAULT_FLUSH_BYTES, stats=None):
+        self.writer = writer
+        self.addr = writer.get_extra_info('peername')
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.stats = stats if stats is not None else WriteStats()
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        self.outbound = asyncio.Queue(maxsize=queue_size)
+        self.closed = False
+        self.dropped = 0
+        self.spill = deque()
+        self.full_since = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.offers = {}
+        self.credit = None
+        self.message_limit = None
+        self.deflater = None
+        self.compression = CompressionStats()
+        self.liveness = Liveness()
+        self.room = None
+        self.multiplexed = False
+        self.streams = StreamTable(AsyncStreamReader)
+        self.stream_ids = itertools.count(2, 2)
+        self.writer_task = asyncio.create_task(self.write_loop())
+
+    async def send(self, data, droppable=False, wait=False):
+        """ClientConnection.send와 같은 규칙으로 송신 큐에 넣습니다. 송신 작업은 코루틴 함수입니다."""
+        if self.closed:
+            return False
+        if wait:
+            while not self.closed:
+                try:
+                    await asyncio.wait_for(self.outbound.put(data), 1.0)
+                    return True
+                except asyncio.TimeoutError:
+                    continue
+            return False
+        if self.overflow_policy == OVERFLOW_BLOCK and not droppable:
+            return self.spill_send(data)
+        try:
+            self.outbound.put_nowait(data)
+            return True
+        except asyncio.QueueFull:
+            pass
+        if droppable and self.overflow_policy != OVERFLOW_DISCONNECT:
+            self.dropped += 1
+            return False
+        print(f"{self.addr} 송신 큐가 가득 차 연결을 종료합니다.")
+        self.close()
+        return False
+
+    def spill_send(self, data):
+        """ClientConnection.spill_send와 같음. (이벤트 루프 하나에서만 부르므로 잠금이 필요 없음)"""
+        if not self.spill:
+            try:
+                self.outbound.put_nowait(data)
+                return True
+            except asyncio.QueueFull:
+                self.full_since = time.monotonic()
+        if time.monotonic() - self.full_since < self.block_timeout and len(self.spill) < BLOCK_SPILL_SIZE:
+            self.spill.append(data)
+            return True
+        print(f"{self.addr} 송신 큐가 {self.block_timeout}초 넘게 밀려 연결을 종료합니다.")
+        self.close()
+        return False
+
+    def refill(self):
+        while self.spill:
+            try:
+                self.outbound.put_nowait(self.spill[0])
+            except asyncio.QueueFull:
+                return
+            self.spill.popleft()
+
+    async def write_loop(self):
+        """ClientConnection.write_loop와 같은 방식으로 프레임을 모아서 씁니다."""
+        pending, size, deadline = [], 0, 0
+        streams = deque()
+        detaching = detached = False
+        try:
+            while True:
+                if streams:
+                    try:
+                        if detaching:
+                            raise asyncio.QueueEmpty
+                        item = self.outbound.get_nowait()
+                    except asyncio.QueueEmpty:
+                        if pending:
+                            await self.flush(pending, size)
+                            pending, size = [], 0
+                        await self.send_segment(streams)
+                        if detaching and not streams:
+                            detached = True
+                            break
+                        continue
+                elif pending:
+                    try:
+                        timeout = deadline - time.monotonic()
+                        if timeout > 0:
+                            item = await asyncio.wait_for(self.outbound.get(), timeout)
+                        else:
+                            item = self.outbound.get_nowait()
+                    except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                        await self.flush(pending, size)
+                        pending, size = [], 0
+                        continue
+                else:
+                    item = await self.outbound.get()
+                if self.spill:
+                    if item is DETACH:
+                        self.spill.append(DETACH)
+                        item = None
+                    self.refill()
+                    if item is None and not self.closed:
+                        continue
+                if item is None or self.closed:
+                    break
+                if item is DETACH:
+                    if pending:
+                        await self.flush(pending, size)
+                        pending, size = [], 0
+                    if not streams:
+                        detached = True
+                        break
+                    detaching = True
+                    continue
+                if isinstance(item, OutboundStream):
+                    streams.append(item)
+                    continue
+                if callable(item):
+                    if pending:
+                        await self.flush(pending, size)
+                        pending, size = [], 0
+                    self.liveness.sending = True
+                    try:
+                        await item(self.writer)
+                    finally:
+                        self.liveness.sending = False
+                    continue
+                if not pending:
+                    deadline = time.monotonic() + self.flush_interval
+                pending.append(item)
+                size += len(item)
+                if size >= self.flush_bytes:
+                    await self.flush(pending, size)
+                    pending, size = [], 0
+        except (OSError, asyncio.CancelledError):
+            pass
+        finally:
+            if not detached:
+                self.close()
+
+    async def flush(self, pending, size):
+        self.writer.write(pack_frames(pending, self.deflater))
+        self.bytes_out += size
+        self.stats.add(len(pending), size)
+        await self.writer.drain()
+
+    async def send_segment(self, streams):
+        stream = streams.popleft()
+        try:
+            if not await stream.send_async(self.writer, self.deflater):
+                return
+        except OSError:
+            raise
+        except Exception as e:
+            print(f"파일 전송 중 오류 발생: {e}")
+            return
+        streams.append(stream)
+
+    async def detach(self):
+        """ClientConnection.detach의 asyncio 버전. 트랜스포트의 버퍼까지 비운 뒤 소켓을 복제해 돌려주고
+        트랜스포트는 닫습니다. (복제한 소켓이 남아 있으므로 연결은 끊기지 않음)"""
+        if not await self.send(DETACH, wait=True):
+            return None
+        await self.writer_task
+        if self.closed:
+            return None
+        self.closed = True
+        try:
+            self.writer.transport.set_write_buffer_limits(0) # drain이 버퍼가 빌 때까지 기다리도록
+            await self.writer.drain()
+        except OSError:
+            return None
+        sock = socket(fileno=os.dup(self.writer.get_extra_info('socket').fileno()))
+        self.writer.transport.abort()
+        return sock
+
+    def close(self, abort=False):
+        """abort면 아직 보내지 못한 데이터를 기다리지 않고 바로 끊습니다. (응답 없는 연결 정리)"""
+        if abort:
+            self.writer.transport.abort()
+        if self.closed:
+            return
+        self.closed = True
+        self.streams.close()
+        self.writer.close()
+        try:
+            self.outbound.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
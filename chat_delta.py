@@ -0,0 +1,149 @@
+"""rsync 방식의 변경분 업로드: 조금 고친 큰 파일을 같은 이름으로 다시 올릴 때 바뀐 블록만 보냅니다.
+
+  1. 클라이언트는 DELTA_MIN_SIZE 이상인 파일에 FILE_OFFER 대신 "DELTA_OFFER:해시:크기:파일명"을 보냅니다.
+  2. 서버는 같은 이름의 이전 내용이 있고 그것도 DELTA_MIN_SIZE 이상이면 "DELTA_BASE:이전해시:블록크기:파일명" 뒤에
+     이전 내용의 블록 서명(블록마다 롤링 체크섬 4바이트 + 강한 해시 16바이트)을 본문으로 보냅니다.
+     그렇지 않으면 FILE_OFFER와 똑같이 FILE_EXISTS나 FILE_ACCEPT로 답합니다.
+  3. 클라이언트는 새 파일 위에서 창을 한 바이트씩 굴리며 롤링 체크섬과 강한 해시가 모두 맞는 곳을 이전 블록으로
+     바꾸고, "FILE_DELTA:이전해시:해시:크기:파일명" 뒤에 명령들을 DATA 프레임 하나에 하나씩 보냅니다.
+       b'C' + [블록 번호 4바이트][블록 수 4바이트]   이전 내용의 연속된 블록들을 그대로 복사
+       b'L' + 바이트열                               새 내용
+  4. 서버는 이전 내용과 받은 바이트로 새 파일을 다시 만들어 전체 해시가 맞으면 저장하고
+     "DELTA_STORED:받은바이트:절약한바이트:파일명"으로 알립니다. 맞지 않으면 "DELTA_FAILED:파일명"을 보내고,
+     클라이언트는 FILE_OFFER로 처음부터 다시 올립니다.
+
+롤링 체크섬은 Adler-32라서 서버는 zlib.adler32로 한 번에 계산하고, 클라이언트는 한 바이트 굴릴 때마다 산술 몇 번으로
+갱신합니다. 굴리는 일은 바뀐 부분 근처에서만 일어나지만 파이썬으로 하므로 느리고, 굴린 양이 DELTA_SCAN_LIMIT을
+넘으면(많이 바뀐 파일) 변경분을 포기하고 보통 업로드로 보냅니다.
+서명은 BlobStore가 내용 파일 옆에 .sig로 한 번 계산해 둡니다.
+"""
+import hashlib
+import mmap
+import struct
+import zlib
+from chat_protocol import FRAME_DATA, CHUNK_SIZE, ProtocolError, encode_frame, end_frame
+
+DELTA_BLOCK_SIZE = 16 * 1024  # 서명을 만드는 블록 크기
+DELTA_MIN_SIZE = 1024 * 1024  # 이보다 작은 파일은 통째로 올림
+DELTA_SCAN_LIMIT = 4 * 1024 * 1024  # 클라이언트가 한 바이트씩 굴려 볼 최대 바이트 수
+SIGNATURE = struct.Struct('!I16s')  # 블록 하나의 서명: Adler-32, BLAKE2b 16바이트
+COPY = struct.Struct('!II')  # 복사 명령: 블록 번호, 블록 수
+OP_COPY = b'C'
+OP_LITERAL = b'L'
+ADLER_MOD = 65521
+COPY_READ_SIZE = 1024 * 1024  # 서버가 이전 내용을 복사할 때 한 번에 읽는 크기
+
+
+def strong_hash(block):
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+
+def file_signatures(f, block_size=DELTA_BLOCK_SIZE):
+    """열린 파일의 블록 서명들을 이어 붙인 바이트열. (마지막 블록은 짧을 수 있음)"""
+    signatures = bytearray()
+    while block := f.read(block_size):
+        signatures += SIGNATURE.pack(zlib.adler32(block), strong_hash(block))
+    return bytes(signatures)
+
+
+def compute_delta(f, signatures, block_size=DELTA_BLOCK_SIZE, scan_limit=DELTA_SCAN_LIMIT):
+    """새 파일 f를 이전 내용의 서명과 맞춰 명령 목록을 만듭니다.
+
+    명령은 (OP_COPY, 블록 번호, 블록 수) 또는 (OP_LITERAL, 시작, 끝)이고, 새 내용은 f의 위치로만 가리킵니다.
+    굴린 바이트가 scan_limit을 넘으면 None을 돌려줍니다.
+    """
+    table = {}  # Adler-32 -> {강한 해시: 블록 번호}
+    for index, (weak, strong) in enumerate(SIGNATURE.iter_unpack(signatures)):
+        table.setdefault(weak, {}).setdefault(strong, index)
+    ops = []
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        size = len(data)
+        literal = 0  # 아직 명령으로 만들지 않은 새 내용의 시작
+        position = 0  # 지금 보고 있는 창의 시작
+        scanned = 0
+        weak = None
+        while position + block_size <= size:
+            if weak is None: # 블록을 맞춘 직후나 처음: 창 전체로 계산
+                weak = zlib.adler32(data[position:position + block_size])
+                a, b = weak & 0xffff, weak >> 16
+            candidates = table.get(weak)
+            if candidates is not None:
+                index = candidates.get(strong_hash(data[position:position + block_size]))
+                if index is not None:
+                    if literal < position:
+                        ops.append((OP_LITERAL, literal, position))
+                    if ops and ops[-1][0] == OP_COPY and ops[-1][1] + ops[-1][2] == index: # 이어지는 블록은 합침
+                        ops[-1] = (OP_COPY, ops[-1][1], ops[-1][2] + 1)
+                    else:
+                        ops.append((OP_COPY, index, 1))
+                    position += block_size
+                    literal = position
+                    weak = None
+                    continue
+            if position + block_size == size:
+                break
+            scanned += 1
+            if scanned > scan_limit:
+                return None
+            old, new = data[position], data[position + block_size]
+            a = (a - old + new) % ADLER_MOD
+            b = (b - block_size * old + a - 1) % ADLER_MOD
+            weak = b << 16 | a
+            position += 1
+        if literal < size:
+            ops.append((OP_LITERAL, literal, size))
+    return ops
+
+
+def iter_delta_frames(f, ops):
+    """명령들을 DATA 프레임들로 만들고 마지막에 END 프레임을 돌려줍니다. 새 내용은 f에서 CHUNK_SIZE씩 읽습니다."""
+    for op, start, end in ops:
+        if op == OP_COPY:
+            yield encode_frame(FRAME_DATA, OP_COPY + COPY.pack(start, end))
+            continue
+        f.seek(start)
+        while start < end:
+            data = f.read(min(CHUNK_SIZE, end - start))
+            if not data:
+                raise EOFError("전송 도중 파일이 줄어들었습니다.")
+            yield encode_frame(FRAME_DATA, OP_LITERAL + data)
+            start += len(data)
+    yield end_frame()
+
+
+class DeltaPatcher:
+    """받은 명령으로 이전 내용과 새 바이트를 이어 붙여 writer(BlobWriter)에 씁니다.
+
+    check는 수신 쪽에서 명령마다 부르고, apply는 I/O 스레드(DiskChannel)에서 넣은 순서대로 실행됩니다.
+    """
+
+    def __init__(self, base, base_size, writer, block_size=DELTA_BLOCK_SIZE):
+        self.base = base  # 이전 내용 파일 (바이너리 읽기)
+        self.blocks = -(-base_size // block_size)
+        self.writer = writer
+        self.block_size = block_size
+        self.copied = 0  # 이전 내용에서 복사한 바이트 수
+
+    def check(self, payload):
+        """명령 하나의 형식과 범위를 확인합니다. 잘못되면 ProtocolError."""
+        op = payload[:1]
+        if op == OP_LITERAL:
+            return
+        if op == OP_COPY and len(payload) == 1 + COPY.size:
+            index, count = COPY.unpack_from(payload, 1)
+            if count and index + count <= self.blocks:
+                return
+        raise ProtocolError("잘못된 변경분 명령입니다.")
+
+    def apply(self, payload):
+        if payload[:1] == OP_LITERAL:
+            self.writer.write(payload[1:])
+            return
+        index, count = COPY.unpack_from(payload, 1)
+        offset = index * self.block_size
+        remaining = count * self.block_size # 마지막 블록은 짧을 수 있으므로 파일 끝에서 멈춤
+        self.base.seek(offset)
+        while remaining > 0 and (data := self.base.read(min(COPY_READ_SIZE, remaining))):
+            self.writer.write(data)
+            self.copied += len(data)
+            remaining -= len(data)
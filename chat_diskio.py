@@ -0,0 +1,131 @@
+"""업로드 본문을 디스크에 쓰는 전용 I/O 스레드 풀.
+
+수신 스레드(또는 이벤트 루프)가 파일에 직접 쓰면 디스크가 느릴 때 소켓 읽기도 함께 멈춥니다.
+업로드 한 건마다 DiskChannel을 하나 열고, 받은 조각은 쓰기 작업으로 큐에 넣기만 합니다.
+  - 한 채널의 작업은 항상 같은 I/O 스레드가 넣은 순서대로 실행하므로 파일 내용과 해시 순서가 유지됩니다.
+  - 채널마다 아직 쓰지 않은 양이 IO_WINDOW를 넘으면 수신 쪽이 기다립니다. 그동안 본문을 읽지 않으므로
+    업로더의 크레딧도 늘지 않아, 큐가 차지하는 메모리는 (진행 중인 업로드 수 x IO_WINDOW)를 넘지 않습니다.
+  - 작업 하나가 실패하면 그 채널의 이후 작업은 실행하지 않고, 수신 쪽의 다음 write/drain/call에서 예외가 납니다.
+  - 마무리(임시 파일 fsync -> 내용 경로로 이름 바꾸기 -> 디렉터리 fsync)도 call로 I/O 스레드에서 실행하므로,
+    call이 돌아온 뒤에 알리는 NEW_FILE은 디스크에 온전히 기록된 파일만 가리킵니다.
+"""
+import asyncio
+import itertools
+from collections import deque
+from concurrent.futures import Future, wait
+from queue import SimpleQueue
+from threading import Thread
+
+IO_WORKERS = 2  # 디스크 쓰기를 맡는 스레드 수
+IO_WINDOW = 4 * 1024 * 1024  # 업로드 한 건이 쓰기를 기다리게 할 수 있는 최대 양(바이트)
+
+
+class DiskPool:
+    """I/O 스레드들. 스레드 방식과 asyncio 방식 서버가 함께 사용합니다."""
+
+    def __init__(self, workers=IO_WORKERS, window=IO_WINDOW):
+        self.window = window
+        self.queues = [SimpleQueue() for _ in range(workers)]  # 스레드마다 작업 큐 하나
+        self.next_queue = itertools.count()
+        for jobs in self.queues:
+            Thread(target=self.run, args=(jobs,), daemon=True).start()
+
+    def run(self, jobs):
+        while True:
+            future, fn, args = jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def channel(self):
+        """업로드 한 건의 쓰기 통로를 엽니다. (I/O 스레드에 돌아가며 배정)"""
+        return DiskChannel(self.queues[next(self.next_queue) % len(self.queues)], self.window)
+
+
+class DiskChannel:
+    """업로드 한 건의 쓰기 통로. 수신 쪽 스레드(코루틴) 하나만 사용합니다."""
+
+    def __init__(self, jobs, window):
+        self.jobs = jobs
+        self.window = window
+        self.pending = deque()  # 끝나지 않았을 수 있는 (Future, 바이트 수), 넣은 순서대로
+        self.pending_bytes = 0
+        self.failed = None  # 처음 실패한 작업의 예외 (I/O 스레드가 기록)
+
+    def submit(self, fn, *args, size=0):
+        future = Future()
+        self.jobs.put((future, self.run, (fn, args)))
+        self.pending.append((future, size))
+        self.pending_bytes += size
+        return future
+
+    def run(self, fn, args):
+        """I/O 스레드에서 실행됩니다. 앞의 작업이 실패했으면 실행하지 않습니다."""
+        if self.failed is not None:
+            raise self.failed
+        try:
+            return fn(*args)
+        except BaseException as e:
+            self.failed = e
+            raise
+
+    def check(self):
+        if self.failed is not None:
+            raise self.failed
+
+    def oldest(self):
+        """앞에서부터 끝난 작업을 치우고, 남은 것 중 가장 오래된 작업을 돌려줍니다. 없으면 None."""
+        while self.pending and self.pending[0][0].done():
+            _, size = self.pending.popleft()
+            self.pending_bytes -= size
+        return self.pending[0][0] if self.pending else None
+
+    def write(self, fn, data):
+        """fn(data)를 큐에 넣습니다. 밀린 양이 창을 넘으면 줄어들 때까지 기다립니다."""
+        self.check()
+        self.submit(fn, data, size=len(data))
+        while (future := self.oldest()) is not None and self.pending_bytes > self.window:
+            wait((future,))
+
+    def wait(self):
+        """넣은 작업이 모두 끝날 때까지 기다립니다. 실패는 발생시키지 않습니다. (파일을 닫거나 버리기 전에)"""
+        if self.pending: # 같은 스레드가 순서대로 실행하므로 마지막 작업이 끝나면 모두 끝남
+            wait((self.pending[-1][0],))
+        self.pending.clear()
+        self.pending_bytes = 0
+
+    def drain(self):
+        """넣은 작업이 모두 끝날 때까지 기다리고, 실패한 작업이 있었으면 그 예외를 발생시킵니다."""
+        self.wait()
+        self.check()
+
+    def call(self, fn, *args):
+        """앞서 넣은 작업들 뒤에 fn(*args)를 I/O 스레드에서 실행하고 결과를 돌려줍니다."""
+        future = self.submit(fn, *args)
+        self.drain()
+        return future.result()
+
+    # asyncio 방식 서버용: 기다리는 동안 이벤트 루프는 다른 연결을 처리함
+    async def write_async(self, fn, data):
+        self.check()
+        self.submit(fn, data, size=len(data))
+        while (future := self.oldest()) is not None and self.pending_bytes > self.window:
+            await asyncio.wait((asyncio.wrap_future(future),))
+
+    async def wait_async(self):
+        if self.pending: # 태스크가 취소되어도 작업은 취소하지 않음 (asyncio.wait)
+            await asyncio.wait((asyncio.wrap_future(self.pending[-1][0]),))
+        self.pending.clear()
+        self.pending_bytes = 0
+
+    async def drain_async(self):
+        await self.wait_async()
+        self.check()
+
+    async def call_async(self, fn, *args):
+        future = self.submit(fn, *args)
+        await self.drain_async()
+        return future.result()
@@ -0,0 +1,90 @@
+"""하트비트와 응답 없는 연결 정리.
+
+서버는 HEARTBEAT_INTERVAL마다 연결들을 둘러보고, 그동안 아무것도 받지 못한 연결에 "PING:번호"를 보냅니다.
+클라이언트는 같은 번호로 "PONG:번호"를 돌려줍니다. (PONG이 아니어도 받은 프레임이면 살아 있다는 표시)
+HEARTBEAT_TIMEOUT 동안 아무것도 받지 못한 연결(상대가 사라진 반쯤 열린 연결, 멈춘 클라이언트)과
+idle_timeout 동안 하트비트 말고는 보낸 것이 없는 연결은 닫고 목록에서 지웁니다.
+
+파일 전송처럼 한쪽이 오래 바쁜 동안에는 PONG이 늦을 수 있으므로 살아 있는 것으로 봅니다.
+그동안 상대가 사라지면 커널이 알아채도록 TCP keepalive와 TCP_USER_TIMEOUT을 함께 설정합니다.
+"""
+import socket
+import time
+
+HEARTBEAT_INTERVAL = 15.0  # 조용한 연결에 PING을 보내는 간격이자 점검 간격(초). 0이면 하트비트와 정리를 하지 않음
+HEARTBEAT_TIMEOUT = 45.0  # 이 시간 동안 아무것도 받지 못하면 연결을 닫음(초)
+IDLE_TIMEOUT = 0  # 하트비트 말고 보낸 것이 없는 연결을 닫는 시간(초). 0이면 닫지 않음
+KEEPALIVE_COUNT = 3  # 응답 없는 keepalive 탐색을 몇 번까지 보낼지
+
+REAP_TIMEOUT = 'timeout'  # 응답 없음
+REAP_IDLE = 'idle'  # 오래 아무것도 하지 않음
+REAP_REASONS = (REAP_TIMEOUT, REAP_IDLE)
+
+
+def set_keepalive(sock, timeout=HEARTBEAT_TIMEOUT):
+    """TCP keepalive를 켜고 timeout 안에 끊긴 상대를 알아채도록 조정합니다.
+
+    보낸 데이터가 timeout 동안 확인되지 않아도 연결을 끊습니다. (TCP_USER_TIMEOUT)
+    세부 옵션이 없는 운영체제에서는 keepalive를 켜기만 합니다.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    idle = max(1, int(timeout / 3))
+    for option, value in (('TCP_KEEPIDLE', idle), ('TCP_KEEPINTVL', max(1, idle // KEEPALIVE_COUNT)),
+                          ('TCP_KEEPCNT', KEEPALIVE_COUNT), ('TCP_USER_TIMEOUT', int(timeout * 1000))):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+def is_heartbeat(message):
+    return message.startswith(("PING:", "PONG:"))
+
+
+class Liveness:
+    """연결 하나의 생존 상태. 수신 쪽과 송신 쪽이 표시하고 정리 스레드(태스크)가 읽습니다."""
+
+    def __init__(self):
+        now = time.monotonic()
+        self.seen = now  # 마지막으로 무엇이든 받은 시각
+        self.active = now  # 마지막으로 하트비트가 아닌 메시지를 받은 시각
+        self.handling = False  # 수신 쪽이 명령을 처리하는 중 (업로드 본문 수신 등)
+        self.sending = False  # 송신 쪽이 파일 전송 같은 작업을 하는 중
+        self.pings = 0  # 보낸 PING 수 (PING 번호로 씀)
+
+    def received(self, message):
+        """명령 하나를 받았을 때 수신 쪽이 부릅니다. 다음 명령을 기다리기 전에 handling을 False로 돌려놓습니다."""
+        now = time.monotonic()
+        self.seen = now
+        self.handling = True
+        if not is_heartbeat(message):
+            self.active = now
+
+    def streamed(self):
+        """다중화된 본문 조각(STREAM 프레임)을 받았을 때 수신 쪽이 부릅니다. 명령이 아니므로 handling은 그대로 둡니다."""
+        self.seen = self.active = time.monotonic()
+
+
+class Reaper:
+    """연결들의 Liveness를 보고 PING을 보낼지, 닫을지 정합니다. 스레드 방식과 asyncio 방식 서버가 함께 사용합니다."""
+
+    def __init__(self, interval=HEARTBEAT_INTERVAL, timeout=HEARTBEAT_TIMEOUT, idle_timeout=IDLE_TIMEOUT):
+        self.interval = interval
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    def check(self, liveness, now):
+        """닫아야 하면 그 이유(REAP_TIMEOUT, REAP_IDLE), PING을 보내야 하면 "PING:번호", 아니면 None."""
+        if liveness.handling or liveness.sending: # 전송 중에는 PONG이 늦으므로 살아 있는 것으로 봄
+            liveness.seen = liveness.active = now
+            return None
+        if now - liveness.seen >= self.timeout:
+            return REAP_TIMEOUT
+        if self.idle_timeout > 0 and now - liveness.active >= self.idle_timeout:
+            return REAP_IDLE
+        if now - liveness.seen >= self.interval:
+            liveness.pings += 1
+            return f"PING:{liveness.pings}"
+        return None
@@ -0,0 +1,118 @@
+"""방별 대화 기록: 최근 메시지 링 버퍼와 추가 전용(append-only) 세그먼트 로그.
+
+기록은 이미 인코딩된 TEXT 프레임을 그대로 저장합니다. 프레임 헤더에 길이가 들어 있으므로 로그 파일은
+프레임을 이어 붙인 것일 뿐이고, 새로 들어온 클라이언트에게는 링 버퍼의 프레임들을 합쳐 한 번에 보내면 됩니다.
+
+    <root>/<방 이름(퍼센트 인코딩)>/00000001.log, 00000002.log, ...
+
+세그먼트가 segment_size를 넘으면 다음 번호의 파일로 넘어가고, max_segments개보다 오래된 세그먼트는 지웁니다.
+서버가 다시 시작되면 마지막 세그먼트들을 mmap으로 읽어 링 버퍼를 복원합니다.
+"""
+import mmap
+import os
+from collections import OrderedDict, deque
+from threading import Lock
+from urllib.parse import quote
+from chat_protocol import HEADER
+
+HISTORY_SIZE = 100  # 방마다 메모리에 보관하고 입장할 때 다시 보내 주는 최근 메시지 수
+SEGMENT_SIZE = 8 * 1024 * 1024  # 로그 세그먼트 파일 하나의 최대 크기
+MAX_SEGMENTS = 16  # 방마다 디스크에 남겨 두는 세그먼트 수
+MAX_OPEN_LOGS = 128  # 동시에 열어 두는 세그먼트 파일 수 (최근에 쓴 방 순)
+
+
+def iter_log_frames(buf):
+    """세그먼트 내용(bytes 또는 mmap)에서 완전한 프레임들을 차례대로 돌려줍니다. 잘린 마지막 프레임은 무시합니다."""
+    offset, size = 0, len(buf)
+    while offset + HEADER.size <= size:
+        _, _, length = HEADER.unpack_from(buf, offset)
+        end = offset + HEADER.size + length
+        if end > size:
+            break
+        yield buf[offset:end]
+        offset = end
+
+
+class MessageHistory:
+    def __init__(self, root, size=HISTORY_SIZE, segment_size=SEGMENT_SIZE, max_segments=MAX_SEGMENTS):
+        self.root = root
+        self.size = size
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.rings = {}  # 방 이름 -> 최근 프레임 deque
+        self.logs = OrderedDict()  # 방 이름 -> (세그먼트 번호, 파일 디스크립터)
+        self.lock = Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _room_dir(self, room):
+        return os.path.join(self.root, quote(room, safe=''))
+
+    def _segments(self, room):
+        """방의 세그먼트 번호들을 오름차순으로 돌려줍니다."""
+        try:
+            names = os.listdir(self._room_dir(room))
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-4]) for name in names if name.endswith('.log'))
+
+    def _segment_path(self, room, seq):
+        return os.path.join(self._room_dir(room), f"{seq:08d}.log")
+
+    def _ring(self, room):
+        """방의 링 버퍼. 처음 쓰일 때 디스크의 마지막 세그먼트들에서 최근 size개를 읽어 옵니다."""
+        ring = self.rings.get(room)
+        if ring is not None:
+            return ring
+        frames = []
+        for seq in reversed(self._segments(room)):
+            with open(self._segment_path(room, seq), 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    frames[:0] = list(iter_log_frames(buf))[-self.size:]
+            if len(frames) >= self.size:
+                break
+        ring = self.rings[room] = deque(frames[-self.size:], maxlen=self.size)
+        return ring
+
+    def _log_fd(self, room, length):
+        """기록할 세그먼트 파일을 엽니다. 가득 찼으면 다음 세그먼트로 넘어가고 오래된 것을 지웁니다."""
+        entry = self.logs.get(room)
+        if entry is None:
+            segments = self._segments(room)
+            seq = segments[-1] if segments else 1
+            os.makedirs(self._room_dir(room), exist_ok=True)
+            fd = os.open(self._segment_path(room, seq), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            entry = (seq, fd)
+        seq, fd = entry
+        if os.fstat(fd).st_size + length > self.segment_size:
+            os.close(fd)
+            seq += 1
+            fd = os.open(self._segment_path(room, seq), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            for old in self._segments(room)[:-self.max_segments]:
+                try:
+                    os.remove(self._segment_path(room, old))
+                except FileNotFoundError:
+                    pass
+        self.logs[room] = (seq, fd)
+        self.logs.move_to_end(room)
+        while len(self.logs) > MAX_OPEN_LOGS:
+            _, (_, old_fd) = self.logs.popitem(last=False)
+            os.close(old_fd)
+        return fd
+
+    def record(self, room, frame, persist=True):
+        """인코딩된 프레임 하나를 방 기록에 추가합니다.
+
+        persist가 False면 메모리에만 넣습니다. (멀티 프로세스 모드에서 다른 워커가 이미 로그에 쓴 메시지)
+        """
+        with self.lock:
+            self._ring(room).append(frame)
+            if persist:
+                os.write(self._log_fd(room, len(frame)), frame) # O_APPEND 한 번의 쓰기라 다른 워커와 섞이지 않음
+
+    def replay(self, room):
+        """방의 최근 메시지들을 (개수, 한 번에 보낼 바이트열)로 돌려줍니다."""
+        with self.lock:
+            ring = self._ring(room)
+            return len(ring), b"".join(ring)
@@ -0,0 +1,202 @@
+"""서버 계측: 명령별 메시지 수, 연결별 송수신 바이트와 송신 큐 길이, 연결별 압축 전후 바이트와 압축 CPU 시간,
+진행 중인 전송 수, 응답이 없거나 오래 쉬어서 정리한 연결 수, 속도/접속 제한에 걸린 횟수,
+변경분 업로드로 받은/절약한 바이트, 지연 시간 히스토그램.
+
+값은 Prometheus 텍스트 형식으로 읽습니다.
+  - --metrics-port로 연 로컬 HTTP 포트 (127.0.0.1에서만 받음): curl http://127.0.0.1:포트/metrics
+  - 같은 컴퓨터(루프백)에서 접속한 클라이언트의 "METRICS" 명령: "METRICS:" 뒤에 같은 텍스트로 응답
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from chat_heartbeat import REAP_REASONS
+from chat_ratelimit import THROTTLE_KINDS
+
+# 히스토그램 구간 상한(초)
+BROADCAST_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)  # 브로드캐스트 팬아웃
+TRANSFER_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)  # 파일 업로드/다운로드 한 건
+
+# 명령별 메시지 수를 셀 때 쓰는 이름. 여기에 없는 텍스트는 일반 채팅(CHAT)으로 셈
+COMMANDS = ("IMAGE", "IMAGE_FETCH", "FILE_OFFER", "FILE_RESUME", "FILE_CHUNKS", "FILE", "DOWNLOAD",
+            "DOWNLOAD_RESUME", "TYPING", "TYPING_STOP", "JOIN", "LEAVE", "METRICS", "COMPRESS", "PONG", "NAME", "USERS", "DM",
+            "RELOAD_OK", "STREAMS", "STREAM", "DOWNLOAD_INFO", "DOWNLOAD_RANGE", "RANGES", "DELTA_OFFER", "FILE_DELTA")
+
+
+def command_name(message):
+    """텍스트 메시지의 명령 이름. ("FILE_OFFER:..." -> "FILE_OFFER", "홍길동: 안녕" -> "CHAT")"""
+    name = message.split(":", 1)[0]
+    return name if name in COMMANDS else "CHAT"
+
+
+def label_value(value):
+    """Prometheus 레이블 값으로 쓸 수 있게 \\, ", 줄바꿈을 이스케이프합니다. (방 이름은 클라이언트가 정함)"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def is_local_address(addr):
+    """루프백 주소에서 온 연결인지 확인합니다. (관리 명령은 같은 컴퓨터에서만 허용)"""
+    host = addr[0] if addr else ''
+    return host == '::1' or host.startswith('127.') or host.startswith('::ffff:127.')
+
+
+class Histogram:
+    """누적 구간(le) 방식의 지연 시간 히스토그램."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 마지막 칸은 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self, name, labels=''):
+        lines = []
+        with self.lock:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+            suffix = f'{{{labels}}}' if labels else ''
+            lines.append(f'{name}_sum{suffix} {self.sum:.6f}')
+            lines.append(f'{name}_count{suffix} {self.count}')
+        return lines
+
+
+class ServerMetrics:
+    """서버 하나(워커 하나)의 계측 값. 스레드 방식과 asyncio 방식 서버가 함께 사용합니다."""
+
+    def __init__(self):
+        self.commands = {}  # 명령 이름 -> 받은 메시지 수
+        self.active_transfers = {'upload': 0, 'download': 0}
+        self.reaped = dict.fromkeys(REAP_REASONS, 0)  # 정리한 이유 -> 연결 수
+        self.throttled = dict.fromkeys(THROTTLE_KINDS, 0)  # 제한 종류 -> 거절한 연결 수 또는 제한에 걸리기 시작한 횟수
+        self.delta = {'uploads': 0, 'received': 0, 'saved': 0}  # 변경분 업로드 수, 받은 바이트, 보내지 않아도 된 바이트
+        self.broadcast_latency = Histogram(BROADCAST_BUCKETS)
+        self.transfer_latency = {'upload': Histogram(TRANSFER_BUCKETS), 'download': Histogram(TRANSFER_BUCKETS)}
+        self.started = time.time()
+        self.lock = Lock()
+
+    def count_command(self, message):
+        name = command_name(message)
+        with self.lock:
+            self.commands[name] = self.commands.get(name, 0) + 1
+
+    def count_reaped(self, reason):
+        with self.lock:
+            self.reaped[reason] += 1
+
+    def count_throttled(self, kind):
+        with self.lock:
+            self.throttled[kind] += 1
+
+    def count_delta(self, received, saved):
+        with self.lock:
+            self.delta['uploads'] += 1
+            self.delta['received'] += received
+            self.delta['saved'] += saved
+
+    @contextmanager
+    def transfer(self, kind):
+        """with 블록 동안 진행 중인 전송으로 세고, 끝나면 걸린 시간을 히스토그램에 기록합니다."""
+        with self.lock:
+            self.active_transfers[kind] += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.transfer_latency[kind].observe(time.perf_counter() - started)
+            with self.lock:
+                self.active_transfers[kind] -= 1
+
+    def render(self, connections, write_stats):
+        """Prometheus 텍스트 형식으로 만듭니다. connections는 지금 접속된 연결 목록입니다."""
+        lines = [
+            '# TYPE chat_uptime_seconds gauge',
+            f'chat_uptime_seconds {time.time() - self.started:.1f}',
+            '# TYPE chat_connections gauge',
+            f'chat_connections {len(connections)}',
+            '# TYPE chat_messages_total counter',
+        ]
+        with self.lock:
+            commands = sorted(self.commands.items())
+            active = sorted(self.active_transfers.items())
+            reaped = sorted(self.reaped.items())
+            throttled = sorted(self.throttled.items())
+            delta = dict(self.delta)
+        lines += [f'chat_messages_total{{command="{name}"}} {count}' for name, count in commands]
+        lines.append('# TYPE chat_active_transfers gauge')
+        lines += [f'chat_active_transfers{{direction="{kind}"}} {count}' for kind, count in active]
+        lines.append('# TYPE chat_reaped_connections_total counter')
+        lines += [f'chat_reaped_connections_total{{reason="{reason}"}} {count}' for reason, count in reaped]
+        lines.append('# TYPE chat_throttled_total counter')
+        lines += [f'chat_throttled_total{{limit="{kind}"}} {count}' for kind, count in throttled]
+        lines += [
+            '# TYPE chat_delta_uploads_total counter',
+            f'chat_delta_uploads_total {delta["uploads"]}',
+            '# TYPE chat_delta_bytes_total counter',
+            f'chat_delta_bytes_total{{kind="received"}} {delta["received"]}',
+            f'chat_delta_bytes_total{{kind="saved"}} {delta["saved"]}',
+        ]
+        lines += [
+            '# TYPE chat_outbound_frames_total counter',
+            f'chat_outbound_frames_total {write_stats.messages}',
+            '# TYPE chat_outbound_writes_total counter',
+            f'chat_outbound_writes_total {write_stats.writes}',
+        ]
+        lines.append('# TYPE chat_broadcast_seconds histogram')
+        lines += self.broadcast_latency.render('chat_broadcast_seconds')
+        lines.append('# TYPE chat_transfer_seconds histogram')
+        for kind, histogram in sorted(self.transfer_latency.items()):
+            lines += histogram.render('chat_transfer_seconds', f'direction="{kind}"')
+        # 연결별 값 (큐 길이는 느린 클라이언트를 찾는 데 씀)
+        rows = [(f'peer="{label_value(f"{conn.addr[0]}:{conn.addr[1]}")}",room="{label_value(conn.room)}"',
+                 (conn.bytes_in, conn.bytes_out, conn.outbound.qsize() + len(conn.spill), conn.dropped,
+                  conn.compression.raw_out, conn.compression.packed_out,
+                  conn.compression.packed_in, conn.compression.raw_in,
+                  f'{conn.compression.cpu:.6f}')) for conn in connections]
+        lines += ['# TYPE chat_outbound_queue_depth_max gauge',
+                  f'chat_outbound_queue_depth_max {max((values[2] for _, values in rows), default=0)}']
+        for index, (name, kind) in enumerate((('chat_connection_received_bytes_total', 'counter'),
+                                              ('chat_connection_sent_bytes_total', 'counter'),
+                                              ('chat_connection_queue_depth', 'gauge'),
+                                              ('chat_connection_dropped_total', 'counter'),
+                                              # 압축: 압축 전/후 보낸 바이트, 받은 압축 바이트/푼 바이트, CPU 시간
+                                              ('chat_connection_uncompressed_sent_bytes_total', 'counter'),
+                                              ('chat_connection_compressed_sent_bytes_total', 'counter'),
+                                              ('chat_connection_compressed_received_bytes_total', 'counter'),
+                                              ('chat_connection_decompressed_received_bytes_total', 'counter'),
+                                              ('chat_connection_compression_cpu_seconds_total', 'counter'))):
+            lines.append(f'# TYPE {name} {kind}')
+            lines += [f'{name}{{{labels}}} {values[index]}' for labels, values in rows]
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(port, render):
+    """127.0.0.1:port에서 render()의 결과를 돌려주는 HTTP 서버를 백그라운드 스레드로 띄웁니다."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # 수집기가 주기적으로 읽을 때마다 로그를 찍지 않음
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    httpd.daemon_threads = True
+    Thread(target=httpd.serve_forever, daemon=True).start()
+    print(f"계측 값: http://127.0.0.1:{port}/metrics")
+    return httpd
@@ -0,0 +1,88 @@
+"""접속자 목록(사용자 이름 -> 연결)과 이름으로 보내는 개인 메시지(DM).
+
+클라이언트는 "NAME:이름"으로 자기 이름을 알리고, 서버는 이름 -> 연결 색인을 유지합니다.
+  - DM: "DM:받는 사람:내용"은 색인에서 받는 사람의 연결 하나를 찾아 "DM_FROM:보낸 사람:내용"으로 그 연결에만
+    보냅니다. 방 참여자를 훑지 않으므로 비용은 접속자 수와 상관없고, 다른 클라이언트에게는 가지 않습니다.
+  - 접속자 목록: 이름을 등록하면(또는 "USERS"로 요청하면) 지금 접속자 전체를 "USERS:이름<TAB>이름..."
+    메시지 하나로 받고, 그 뒤로는 "ONLINE:이름"/"OFFLINE:이름" 변경분만 받습니다.
+
+멀티 프로세스 모드에서는 다른 워커에 접속한 이름을 REMOTE로 기록해 두고, 그 이름으로 가는 DM은 버스로 넘깁니다.
+"""
+from threading import Lock
+
+MAX_USER_NAME = 32  # 이름의 최대 길이
+USERS_SEPARATOR = "\t"  # USERS 메시지의 이름 구분자
+REMOTE = 'remote'  # 다른 워커에 접속한 이름 (연결 대신 기록)
+
+
+def valid_user_name(name):
+    """이름으로 쓸 수 있는지 확인합니다. (명령 구분자 ':'와 공백 문자는 허용하지 않음)"""
+    return 0 < len(name) <= MAX_USER_NAME and ':' not in name and not any(c.isspace() for c in name)
+
+
+def users_message(names):
+    """접속자 이름 목록을 "USERS:..." 메시지로 만듭니다."""
+    return "USERS:" + USERS_SEPARATOR.join(names)
+
+
+class PresenceDirectory:
+    """이름 -> 연결 색인. 스레드 방식과 asyncio 방식 서버가 함께 사용합니다."""
+
+    def __init__(self):
+        self.users = {}  # 이름 -> 연결 (다른 워커의 이름이면 REMOTE)
+        self.names = {}  # 연결 -> 이름
+        self.snapshot = None  # 정렬된 이름 튜플 (접속자가 바뀌기 전까지 재사용)
+        self.lock = Lock()
+
+    def register(self, conn, name):
+        """conn의 이름을 name으로 정하고 (성공 여부, 이전 이름)을 돌려줍니다. 다른 연결이 쓰는 이름이면 실패."""
+        with self.lock:
+            owner = self.users.get(name)
+            if owner is not None and owner is not conn:
+                return False, None
+            previous = self.names.get(conn)
+            if previous is not None:
+                del self.users[previous]
+            self.users[name] = conn
+            self.names[conn] = name
+            self.snapshot = None
+            return True, previous
+
+    def unregister(self, conn):
+        """연결이 쓰던 이름을 지우고 돌려줍니다. 이름이 없었으면 None."""
+        with self.lock:
+            name = self.names.pop(conn, None)
+            if name is not None:
+                del self.users[name]
+                self.snapshot = None
+            return name
+
+    def add_remote(self, name):
+        with self.lock:
+            self.users.setdefault(name, REMOTE)
+            self.snapshot = None
+
+    def remove_remote(self, name):
+        with self.lock:
+            if self.users.get(name) is REMOTE:
+                del self.users[name]
+                self.snapshot = None
+
+    def lookup(self, name):
+        """이름의 연결(다른 워커면 REMOTE)을 돌려줍니다. 접속 중이 아니면 None."""
+        return self.users.get(name)
+
+    def name_of(self, conn):
+        return self.names.get(conn)
+
+    def connections(self):
+        """이 워커에서 이름을 등록한 연결들 (접속자 변경을 알릴 대상)."""
+        with self.lock:
+            return tuple(self.names)
+
+    def online(self):
+        """접속 중인 이름들을 정렬된 튜플로 돌려줍니다."""
+        with self.lock:
+            if self.snapshot is None:
+                self.snapshot = tuple(sorted(self.users))
+            return self.snapshot
@@ -0,0 +1,265 @@
+"""채팅 서버(MultiChatServer)와 클라이언트(ChatClient)가 함께 사용하는 프레임 프로토콜.
+
+모든 메시지는 [버전 1바이트][타입 1바이트][길이 4바이트][페이로드] 형태의 프레임으로 전송됩니다.
+수신 측은 헤더의 길이만큼 정확히 읽기 때문에 END_OF_FILE 같은 종료 문자열을 찾을 필요가 없고,
+파일 데이터 안에 어떤 바이트가 있더라도 제어 메시지와 섞이지 않습니다.
+
+파일/이미지 본문은 FRAME_DATA 프레임 여러 개로 나누어 보내고 FRAME_END 프레임으로 끝을 알립니다.
+이어받기가 가능한 파일 전송은 DATA 대신 FRAME_CHUNK 프레임을 사용합니다. CHUNK 프레임의 페이로드 앞에는
+[파일 안의 위치 8바이트][CRC32 4바이트]가 붙어 있어, 조각마다 무결성을 확인하고 끊긴 위치부터 다시 받을 수 있습니다.
+
+업로드 본문은 서버가 허락한 만큼만 보냅니다(크레딧 방식 흐름 제어). 연결이 열린 뒤 보낸 본문 프레임(DATA/CHUNK)
+페이로드의 누적 바이트 수가 처음에는 INITIAL_CREDIT, 그 뒤로는 서버가 마지막으로 보낸 "CREDIT:n"의 n에 이르면
+업로더는 다음 CREDIT이 올 때까지 기다립니다. 상한에 닿기 전까지는 프레임 하나를 통째로 보낼 수 있으므로
+상한을 넘는 양은 프레임 하나를 넘지 않습니다.
+
+"STREAMS"로 다중화를 협상한 연결에서는 본문 프레임들을 STREAM 프레임에 나누어 담아 채팅과 번갈아 보냅니다.
+(chat_streams 참고)
+"""
+import struct
+import zlib
+
+PROTOCOL_VERSION = 1  # 헤더 형식이 바뀌면 올립니다.
+
+HEADER = struct.Struct('!BBI')  # 버전, 프레임 타입, 페이로드 길이
+MAX_FRAME_SIZE = 16 * 1024 * 1024  # 한 프레임 페이로드의 최대 크기
+CHUNK_SIZE = 64 * 1024  # 파일 본문을 나누어 보낼 때 한 DATA 프레임의 크기
+TRANSFER_CHUNK_SIZE = 1024 * 1024  # 이어받기 전송에서 CHUNK 프레임 하나에 담는 크기 (체크섬 단위)
+CHUNK_HEADER = struct.Struct('!QI')  # CHUNK 프레임 페이로드 앞부분: 파일 안의 위치, CRC32
+INITIAL_CREDIT = 256 * 1024  # 연결마다 첫 CREDIT을 받기 전에 보낼 수 있는 본문 바이트 수
+STREAM_ID = struct.Struct('!I')  # STREAM 프레임 페이로드 앞부분: 스트림 id
+STREAM_SEGMENT = 256 * 1024  # STREAM 프레임 하나에 담는 최대 크기 (채팅이 전송 뒤에서 기다리는 최대 양)
+
+FRAME_TEXT = 1  # UTF-8 문자열 (채팅, "FILE:이름" 같은 명령)
+FRAME_DATA = 2  # 파일/이미지 본문 조각
+FRAME_END = 3   # 파일/이미지 본문의 끝
+FRAME_CHUNK = 4  # 위치와 체크섬이 붙은 파일 조각 (이어받기 전송)
+FRAME_DEFLATE = 5  # 압축한 채팅/명령 프레임들 (연결 시작 때 압축을 협상한 경우, chat_compression 참고)
+FRAME_DEFLATE_BODY = 6  # 압축한 파일 본문 프레임들
+FRAME_STREAM = 7  # 다중화된 스트림의 조각 ([스트림 id 4바이트][그 스트림의 본문 프레임들을 이어 붙인 바이트열의 일부])
+
+
+class ProtocolError(Exception):
+    """상대방이 규약에 맞지 않는 프레임을 보냈을 때 발생합니다."""
+
+
+class ChecksumError(ProtocolError):
+    """CHUNK 프레임의 CRC32가 맞지 않을 때 발생합니다. offset부터 다시 받으면 됩니다."""
+
+    def __init__(self, offset):
+        super().__init__(f"{offset} 위치의 조각 체크섬이 맞지 않습니다.")
+        self.offset = offset
+
+
+def encode_frame(ftype, payload=b''):
+    """프레임 타입과 페이로드로 전송할 바이트열을 만듭니다."""
+    return HEADER.pack(PROTOCOL_VERSION, ftype, len(payload)) + payload
+
+
+def text_frame(message):
+    """문자열 메시지를 TEXT 프레임으로 인코딩합니다."""
+    return encode_frame(FRAME_TEXT, message.encode('utf-8'))
+
+
+def end_frame():
+    return encode_frame(FRAME_END)
+
+
+def stream_frame(sid, data):
+    """스트림 sid의 조각을 STREAM 프레임으로 인코딩합니다."""
+    return encode_frame(FRAME_STREAM, STREAM_ID.pack(sid) + data)
+
+
+def chunk_frame(offset, data):
+    """파일 조각을 위치와 CRC32가 붙은 CHUNK 프레임으로 인코딩합니다."""
+    return encode_frame(FRAME_CHUNK, CHUNK_HEADER.pack(offset, zlib.crc32(data)) + data)
+
+
+def parse_chunk(payload):
+    """CHUNK 프레임 페이로드를 검증하고 (위치, 데이터)를 돌려줍니다."""
+    if len(payload) < CHUNK_HEADER.size:
+        raise ProtocolError("CHUNK 프레임에 위치와 체크섬이 없습니다.")
+    offset, crc = CHUNK_HEADER.unpack_from(payload)
+    data = payload[CHUNK_HEADER.size:]
+    if zlib.crc32(data) != crc:
+        raise ChecksumError(offset)
+    return offset, data
+
+
+def parse_header(header):
+    """헤더 6바이트를 해석해 (타입, 길이)를 돌려줍니다."""
+    version, ftype, length = HEADER.unpack(header)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"지원하지 않는 프로토콜 버전: {version}")
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"프레임이 너무 큽니다: {length} 바이트")
+    return ftype, length
+
+
+def recv_exact(sock, n):
+    """소켓에서 정확히 n 바이트를 읽습니다. 처음부터 연결이 끊겨 있으면 None을 돌려줍니다."""
+    buf = bytearray(n)
+    view = memoryview(buf)
+    received = 0
+    while received < n:
+        count = sock.recv_into(view[received:])
+        if not count:
+            if received == 0:
+                return None
+            raise ConnectionError("프레임 수신 도중 연결이 끊어졌습니다.")
+        received += count
+    return bytes(buf)
+
+
+def read_frame(sock):
+    """블로킹 소켓에서 프레임 하나를 읽어 (타입, 페이로드)를 돌려줍니다. 연결이 끊기면 None."""
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    ftype, length = parse_header(header)
+    payload = recv_exact(sock, length) if length else b''
+    if payload is None:
+        raise ConnectionError("프레임 수신 도중 연결이 끊어졌습니다.")
+    return ftype, payload
+
+
+async def read_frame_async(reader):
+    """asyncio StreamReader에서 프레임 하나를 읽습니다. 연결이 끊기면 None."""
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except EOFError as e:  # asyncio.IncompleteReadError
+        if not e.partial:
+            return None
+        raise ConnectionError("프레임 수신 도중 연결이 끊어졌습니다.")
+    ftype, length = parse_header(header)
+    payload = await reader.readexactly(length) if length else b''
+    return ftype, payload
+
+
+def iter_body(sock, credit=None):
+    """DATA 프레임의 페이로드를 END 프레임이 올 때까지 하나씩 돌려줍니다.
+
+    credit(서버의 UploadCredit)이 주어지면 프레임을 읽을 때마다 받은 양을 알려 업로더에게 크레딧을 돌려줍니다.
+    """
+    while True:
+        frame = read_frame(sock)
+        if frame is None:
+            raise ConnectionError("파일 수신 도중 연결이 끊어졌습니다.")
+        ftype, payload = frame
+        if ftype == FRAME_END:
+            return
+        if ftype != FRAME_DATA:
+            raise ProtocolError(f"파일 본문 중에 예상하지 못한 프레임: {ftype}")
+        if credit is not None:
+            credit.consume(len(payload))
+        yield payload
+
+
+async def iter_body_async(reader, credit=None):
+    """iter_body의 asyncio 버전. credit은 AsyncUploadCredit입니다."""
+    while True:
+        frame = await read_frame_async(reader)
+        if frame is None:
+            raise ConnectionError("파일 수신 도중 연결이 끊어졌습니다.")
+        ftype, payload = frame
+        if ftype == FRAME_END:
+            return
+        if ftype != FRAME_DATA:
+            raise ProtocolError(f"파일 본문 중에 예상하지 못한 프레임: {ftype}")
+        if credit is not None:
+            await credit.consume(len(payload))
+        yield payload
+
+
+def iter_chunks(sock, credit=None):
+    """CHUNK 프레임을 END 프레임이 올 때까지 검증하며 (위치, 데이터)로 돌려줍니다.
+
+    체크섬이 틀린 조각도 받은 것이므로 검증하기 전에 크레딧을 돌려줍니다.
+    """
+    while True:
+        frame = read_frame(sock)
+        if frame is None:
+            raise ConnectionError("파일 수신 도중 연결이 끊어졌습니다.")
+        ftype, payload = frame
+        if ftype == FRAME_END:
+            return
+        if ftype != FRAME_CHUNK:
+            raise ProtocolError(f"파일 본문 중에 예상하지 못한 프레임: {ftype}")
+        if credit is not None:
+            credit.consume(len(payload))
+        yield parse_chunk(payload)
+
+
+async def iter_chunks_async(reader, credit=None):
+    """iter_chunks의 asyncio 버전."""
+    while True:
+        frame = await read_frame_async(reader)
+        if frame is None:
+            raise ConnectionError("파일 수신 도중 연결이 끊어졌습니다.")
+        ftype, payload = frame
+        if ftype == FRAME_END:
+            return
+        if ftype != FRAME_CHUNK:
+            raise ProtocolError(f"파일 본문 중에 예상하지 못한 프레임: {ftype}")
+        if credit is not None:
+            await credit.consume(len(payload))
+        yield parse_chunk(payload)
+
+
+def skip_body(sock, credit=None):
+    """본문(DATA/CHUNK 프레임들)을 END 프레임까지 읽고 버립니다. 버린 본문도 크레딧은 돌려줍니다."""
+    while True:
+        frame = read_frame(sock)
+        if frame is None:
+            raise ConnectionError("파일 수신 도중 연결이 끊어졌습니다.")
+        if frame[0] == FRAME_END:
+            return
+        if credit is not None and frame[0] in (FRAME_DATA, FRAME_CHUNK):
+            credit.consume(len(frame[1]))
+
+
+async def skip_body_async(reader, credit=None):
+    while True:
+        frame = await read_frame_async(reader)
+        if frame is None:
+            raise ConnectionError("파일 수신 도중 연결이 끊어졌습니다.")
+        if frame[0] == FRAME_END:
+            return
+        if credit is not None and frame[0] in (FRAME_DATA, FRAME_CHUNK):
+            await credit.consume(len(frame[1]))
+
+
+def iter_file_chunks(f, offset=0, chunk_size=TRANSFER_CHUNK_SIZE):
+    """열린 파일을 offset부터 CHUNK 프레임들로 나눈 뒤 마지막에 END 프레임을 돌려줍니다."""
+    f.seek(offset)
+    while chunk := f.read(chunk_size):
+        yield chunk_frame(offset, chunk)
+        offset += len(chunk)
+    yield end_frame()
+
+
+def iter_file_frames(f, chunk_size=CHUNK_SIZE):
+    """열린 파일을 DATA 프레임들로 나눈 뒤 마지막에 END 프레임을 돌려줍니다."""
+    while chunk := f.read(chunk_size):
+        yield encode_frame(FRAME_DATA, chunk)
+    yield end_frame()
+
+
+def body_credit(frame):
+    """업로더가 프레임 하나를 보낼 때 쓰는 크레딧 (본문 프레임의 페이로드 길이, END 프레임은 0)."""
+    return len(frame) - HEADER.size
+
+
+def iter_stream_frames(sid, frame, segment=STREAM_SEGMENT):
+    """인코딩된 프레임 하나를 스트림 sid의 STREAM 프레임들로 나눕니다. (segment 바이트씩)"""
+    view = memoryview(frame)
+    for start in range(0, len(view), segment):
+        yield stream_frame(sid, bytes(view[start:start + segment]))
+
+
+def iter_bytes_frames(data, chunk_size=CHUNK_SIZE):
+    """메모리에 있는 바이트열을 DATA 프레임들과 END 프레임으로 나눕니다."""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield encode_frame(FRAME_DATA, bytes(view[start:start + chunk_size]))
+    yield end_frame()
@@ -0,0 +1,191 @@
+"""큰 파일을 보조 연결 여러 개로 나누어 받는 병렬 다운로드.
+
+채팅 연결 하나로 받으면 큰 파일도 TCP 흐름 하나의 속도를 넘지 못합니다. 클라이언트는
+  1. "DOWNLOAD_INFO:파일명"으로 내용 해시와 크기("FILE_INFO:해시:크기:파일명")를 먼저 받고,
+  2. 크기가 PARALLEL_MIN_SIZE 이상이면 같은 서버에 보조 연결을 RANGE_CONNECTIONS개 열어 "RANGES"를 보낸 뒤
+     (서버는 이 연결을 방에서 빼서 채팅을 보내지 않음)
+  3. 파일을 RANGE_SIZE 구간으로 나누어 연결마다 "DOWNLOAD_RANGE:해시:위치:길이"로 하나씩 요청합니다.
+서버는 구간마다 "RANGE_START:해시:위치:길이" 뒤에 그 구간의 CHUNK 프레임들과 END 프레임을 sendfile로 보냅니다.
+받은 조각은 크기를 미리 잡아 둔 .part 파일의 제 위치에 pwrite로 바로 쓰므로 구간들이 어떤 순서로 와도 되고,
+먼저 끝난 연결이 남은 구간을 가져가므로 느린 연결이 있어도 나머지가 기다리지 않습니다.
+구간은 파일명이 아니라 내용 해시로 요청하므로 그 사이 같은 이름으로 다른 내용이 올라와도 모든 구간이 같은 내용에서 옵니다.
+
+보조 연결이 끊기면 받지 못한 나머지를 대기열에 돌려놓고 다시 접속하며, 체크섬이 틀린 조각은 그 위치부터 다시 요청합니다.
+같은 구간의 체크섬이 RANGE_RETRIES번을 넘게 틀리면 다운로드를 그만둡니다.
+"""
+import os
+import socket
+import time
+from collections import deque
+from threading import Event, Lock, Thread
+from chat_protocol import (FRAME_TEXT, TRANSFER_CHUNK_SIZE, ChecksumError, ProtocolError, read_frame, text_frame,
+                           iter_chunks, skip_body)
+from chat_heartbeat import set_keepalive
+
+RANGE_CONNECTIONS = 4  # 병렬 다운로드에 여는 보조 연결 수
+RANGE_SIZE = 16 * TRANSFER_CHUNK_SIZE  # 보조 연결이 한 번에 요청하는 구간 크기 (체크섬 조각 경계에 맞춤)
+PARALLEL_MIN_SIZE = 32 * 1024 * 1024  # 이보다 작은 파일은 채팅 연결 하나로 받음
+RANGE_RETRIES = 3  # 보조 연결 하나가 연달아 실패해도 다시 접속해 보는 횟수
+RANGE_RETRY_INTERVAL = 1  # 보조 연결이 끊겼을 때 다시 접속하기 전에 기다리는 시간(초)
+
+_write_lock = Lock()  # pwrite가 없는 운영체제에서 위치 옮기기와 쓰기를 묶음
+
+
+def split_ranges(size, range_size=RANGE_SIZE):
+    """size 바이트 파일을 (위치, 길이) 구간들로 나눕니다."""
+    return [(offset, min(range_size, size - offset)) for offset in range(0, size, range_size)]
+
+
+def preallocate(fd, size):
+    """파일 크기를 미리 잡아 둡니다. 가능하면 디스크 공간도 할당해 쓰는 도중 공간이 모자라거나 조각나지 않게 합니다."""
+    os.ftruncate(fd, size)
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError: # 지원하지 않는 파일 시스템은 크기만 잡아 둠
+            pass
+
+
+def write_at(fd, data, offset):
+    """파일 위치를 옮기지 않고 offset에 data를 씁니다. 여러 스레드가 같은 파일의 다른 구간에 동시에 씁니다."""
+    view = memoryview(data)
+    while view:
+        if hasattr(os, 'pwrite'):
+            written = os.pwrite(fd, view, offset)
+        else:
+            with _write_lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+
+class ParallelDownload:
+    """내용 해시가 digest인 size 바이트 파일을 address의 서버에서 보조 연결 connections개로 나누어 받아 path에 씁니다."""
+
+    def __init__(self, address, digest, size, path, connections=RANGE_CONNECTIONS, range_size=RANGE_SIZE):
+        self.address = address
+        self.digest = digest
+        self.size = size
+        self.path = path
+        self.connections = max(1, connections)
+        self.pending = deque(split_ranges(size, range_size))  # 아직 받지 않은 구간 (위치, 길이)
+        self.lock = Lock()  # pending, received, corrupted 보호
+        self.received = 0  # 검증해서 파일에 쓴 바이트 수
+        self.corrupted = {}  # 구간 끝 -> 체크섬이 틀려 다시 요청한 횟수
+        self.error = None  # 마지막으로 다운로드를 방해한 오류
+        self.stopped = Event()  # 서버에 내용이 없으므로 모든 연결이 그만둠
+        self.elapsed = 0.0
+
+    def run(self):
+        """모든 구간을 받을 때까지 기다립니다. 다 받았으면 True, 그만두었으면 False (이유는 error)."""
+        started = time.monotonic()
+        with open(self.path, "wb") as f:
+            preallocate(f.fileno(), self.size)
+            workers = [Thread(target=self.worker, args=(f.fileno(),), daemon=True)
+                       for _ in range(min(self.connections, len(self.pending)))]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        self.elapsed = time.monotonic() - started
+        return self.received == self.size and not self.stopped.is_set()
+
+    def summary(self):
+        rate = self.received / self.elapsed / 1e6 if self.elapsed > 0 else 0.0
+        return f"{self.received} 바이트, {self.elapsed:.3f}초, {rate:.1f} MB/s, 연결 {self.connections}개"
+
+    def connect(self):
+        sock = socket.create_connection(self.address)
+        set_keepalive(sock)
+        sock.sendall(text_frame("RANGES")) # 채팅을 받지 않는 구간 다운로드 전용 연결
+        return sock
+
+    def worker(self, fd):
+        """보조 연결 하나: 대기열이 빌 때까지 구간을 하나씩 가져와 받습니다."""
+        sock = None
+        failures = 0
+        try:
+            while not self.stopped.is_set():
+                with self.lock:
+                    if not self.pending:
+                        return
+                    offset, length = self.pending.popleft()
+                try:
+                    if sock is None:
+                        sock = self.connect()
+                    self.fetch(sock, fd, offset, offset + length)
+                    failures = 0
+                except FileNotFoundError as e:
+                    self.error = e
+                    self.stopped.set()
+                except (ConnectionError, OSError, ProtocolError) as e:
+                    self.error = e
+                    if sock is not None:
+                        sock.close()
+                        sock = None
+                    failures += 1
+                    if failures > RANGE_RETRIES: # 남은 구간은 다른 연결이 가져감
+                        return
+                    time.sleep(RANGE_RETRY_INTERVAL)
+        finally:
+            if sock is not None:
+                sock.close()
+
+    def fetch(self, sock, fd, offset, end):
+        """구간 [offset, end)를 요청해 받은 조각을 제 위치에 씁니다. 실패하면 받지 못한 나머지를 대기열에 돌려놓습니다."""
+        position = offset
+        try:
+            sock.sendall(text_frame(f"DOWNLOAD_RANGE:{self.digest}:{offset}:{end - offset}"))
+            self.wait_start(sock, offset, end)
+            try:
+                for chunk_offset, data in iter_chunks(sock): # END 프레임이 올 때까지 검증하며 수신
+                    if chunk_offset != position:
+                        raise ProtocolError(f"구간 {offset}의 {position} 위치 대신 {chunk_offset} 위치가 왔습니다.")
+                    write_at(fd, data, chunk_offset)
+                    position += len(data)
+                    with self.lock:
+                        self.received += len(data)
+            except ChecksumError as e: # 연결은 그대로 쓰고 손상된 조각부터 다시 요청
+                position = e.offset
+                skip_body(sock)
+                with self.lock:
+                    self.pending.appendleft((position, end - position))
+                    self.corrupted[end] = retries = self.corrupted.get(end, 0) + 1
+                if retries > RANGE_RETRIES: # 서버에 있는 내용 자체가 손상되었으면 계속 받아도 같음
+                    self.error = e
+                    self.stopped.set()
+                return
+        except BaseException:
+            with self.lock:
+                self.pending.appendleft((position, end - position))
+            raise
+        if position != end:
+            with self.lock:
+                self.pending.appendleft((position, end - position))
+            raise ProtocolError(f"구간 {offset}을 {position} 위치까지만 받았습니다.")
+
+    def wait_start(self, sock, offset, end):
+        """"RANGE_START"가 올 때까지 읽습니다. 그 사이에 온 PING에는 답하고 방 기록 같은 다른 메시지는 버립니다."""
+        while True:
+            frame = read_frame(sock)
+            if frame is None:
+                raise ConnectionError("보조 연결이 끊어졌습니다.")
+            ftype, payload = frame
+            if ftype != FRAME_TEXT:
+                raise ProtocolError(f"구간 시작 전에 예상하지 못한 프레임: {ftype}")
+            message = payload.decode('utf-8')
+            if message.startswith("RANGE_START:"):
+                if message != f"RANGE_START:{self.digest}:{offset}:{end - offset}":
+                    raise ProtocolError(f"요청하지 않은 구간: {message}")
+                return
+            elif message.startswith("RANGE_NOT_FOUND:"):
+                raise FileNotFoundError("서버에 파일 내용이 없습니다.")
+            elif message.startswith("PING:"):
+                sock.sendall(text_frame("PONG:" + message[5:]))
+            elif message.startswith("THROTTLED:"):
+                kind, delay, *command = message[10:].split(":", 2)
+                if not command: # 서버가 접속 수 제한으로 거절함
+                    raise ConnectionError(f"서버가 보조 연결을 거절했습니다. ({message})")
+                time.sleep(int(delay) / 1000) # 메시지 속도 제한: 처리되지 않은 요청을 다시 보냄
+                sock.sendall(text_frame(command[0]))
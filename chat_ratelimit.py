@@ -0,0 +1,141 @@
+"""접속 제한(admission control)과 연결별 토큰 버킷 속도 제한.
+
+서버 전체:
+  - 동시 접속 수가 max_connections에 이르면 새 연결은 받자마자 "THROTTLED:connections:밀리초"를 보내고 닫습니다.
+  - 초당 accept_rate개보다 빨리 들어오는 연결도 같은 방식으로 "THROTTLED:accepts:밀리초"로 거절합니다.
+    (연결이 몰려도 수락하는 쪽이 방 입장과 기록 전송에 묶여 기존 클라이언트가 밀리지 않도록)
+연결마다:
+  - 명령/채팅 메시지는 초당 message_rate개(최대 message_burst개까지 몰아서)만 처리합니다. 넘은 채팅은 처리하지
+    않고 버리며, 제한에 걸리기 시작할 때 한 번 "THROTTLED:messages:밀리초"로 알립니다.
+    답을 기다리는 명령(REPLY_COMMANDS)은 버리면 클라이언트가 답을 영영 기다리므로 처리하지 않는 대신
+    "THROTTLED:messages:밀리초:명령"으로 답하고, 클라이언트는 그만큼 기다렸다가 같은 명령을 다시 보냅니다.
+    본문이 뒤따르는 업로드 명령(BODY_COMMANDS)은 버리면 본문 프레임의 경계를 잃으므로 버리지 않고 그만큼 늦게 처리합니다.
+    (다중화된 업로드는 그 스트림을 받는 쪽만 기다리고, 연결의 수신 루프는 다른 스트림의 조각을 계속 넘김)
+  - 업로드 본문은 초당 upload_rate 바이트를 넘으면 그만큼 늦게 읽습니다. 읽은 만큼 주는 크레딧도 늦게 늘어나므로
+    업로더가 저절로 천천히 보내고, 제한에 걸리기 시작할 때 "THROTTLED:upload:밀리초"로 알립니다.
+
+밀리초는 다시 시도하거나 다시 빨라질 때까지 기다리면 되는 시간입니다. 확인은 모두 시각 한 번 읽기와 산술
+몇 번뿐이라 메시지 수와 상관없이 일정합니다. 속도를 0으로 주면 그 제한은 쓰지 않습니다.
+"""
+import math
+import time
+from threading import Lock
+from chat_protocol import text_frame
+
+MAX_CONNECTIONS = 10000  # 동시에 받을 최대 연결 수
+ACCEPT_RATE = 1000.0  # 초당 받을 새 연결 수 (1초 분량까지는 몰려도 받음)
+MESSAGE_RATE = 50.0  # 연결마다 초당 처리할 메시지 수
+MESSAGE_BURST = 100  # 연결마다 몰아서 처리할 수 있는 메시지 수
+UPLOAD_RATE = 0  # 연결마다 초당 읽을 업로드 본문 바이트 수 (0이면 제한 없음. 1초 분량까지는 몰아서 받음)
+FULL_RETRY = 1.0  # 접속 수가 가득 찼을 때 다시 접속해 보라고 알리는 시간(초)
+
+THROTTLE_CONNECTIONS = 'connections'
+THROTTLE_ACCEPTS = 'accepts'
+THROTTLE_MESSAGES = 'messages'
+THROTTLE_UPLOAD = 'upload'
+THROTTLE_KINDS = (THROTTLE_CONNECTIONS, THROTTLE_ACCEPTS, THROTTLE_MESSAGES, THROTTLE_UPLOAD)
+UNTHROTTLED_COMMANDS = ("PONG:", "RELOAD_OK")  # 서버가 요청한 응답은 세지 않음
+BODY_COMMANDS = ("IMAGE:", "FILE:", "FILE_CHUNKS:", "FILE_DELTA:", "STREAM:")  # 본문이 뒤따르므로 버리지 않고 늦게 처리
+REPLY_COMMANDS = ("IMAGE_FETCH:", "FILE_OFFER:", "DELTA_OFFER:", "FILE_RESUME:", "DOWNLOAD:", "DOWNLOAD_RESUME:",
+                  "DOWNLOAD_INFO:", "DOWNLOAD_RANGE:", "RANGES", "JOIN:", "LEAVE", "NAME:", "USERS", "METRICS",
+                  "COMPRESS:", "STREAMS")  # 답을 기다리므로 버리지 않고 다시 보내라고 답함
+
+
+def throttled_message(kind, delay, command=None):
+    """"THROTTLED:종류:밀리초" 프레임. 처리하지 않은 명령이 있으면 뒤에 ":명령"을 붙입니다."""
+    suffix = f":{command}" if command is not None else ""
+    return text_frame(f"THROTTLED:{kind}:{math.ceil(delay * 1000)}{suffix}")
+
+
+class TokenBucket:
+    """초당 rate개씩 채워지고 burst개까지 모이는 토큰 버킷. 한 스레드(코루틴)만 사용합니다."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def take(self, amount=1):
+        """토큰이 amount개 있으면 꺼내고 0을, 모자라면 꺼내지 않고 모일 때까지의 시간(초)을 돌려줍니다."""
+        self.refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0
+        return (amount - self.tokens) / self.rate
+
+    def charge(self, amount):
+        """모자라도 amount개를 꺼내고(빚), 잔고가 다시 0이 될 때까지의 시간(초)을 돌려줍니다."""
+        self.refill()
+        self.tokens -= amount
+        return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+class RateLimit:
+    """연결 하나의 제한 하나. 제한에 걸리기 시작할 때만 알릴 THROTTLED 프레임을 만들어 줍니다."""
+
+    def __init__(self, kind, rate, burst, observer=None):
+        self.kind = kind
+        self.bucket = TokenBucket(rate, burst)
+        self.observer = observer  # 제한에 걸리기 시작할 때마다 종류를 넘겨 부름 (계측)
+        self.limited = False
+
+    def check(self, delay):
+        """(기다릴 시간, 보낼 THROTTLED 프레임 또는 None)"""
+        notice = None
+        if delay > 0 and not self.limited:
+            notice = throttled_message(self.kind, delay)
+            if self.observer is not None:
+                self.observer(self.kind)
+        self.limited = delay > 0
+        return delay, notice
+
+    def take(self, amount=1):
+        return self.check(self.bucket.take(amount))
+
+    def charge(self, amount):
+        return self.check(self.bucket.charge(amount))
+
+
+class AdmissionControl:
+    """서버 하나(워커 하나)의 접속 제한과 연결별 제한 설정. 스레드 방식과 asyncio 방식 서버가 함께 사용합니다."""
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, accept_rate=ACCEPT_RATE, message_rate=MESSAGE_RATE,
+                 message_burst=MESSAGE_BURST, upload_rate=UPLOAD_RATE, observer=None):
+        self.max_connections = max_connections
+        self.accepts = TokenBucket(accept_rate, accept_rate) if accept_rate > 0 else None
+        self.message_rate = message_rate
+        self.message_burst = message_burst
+        self.upload_rate = upload_rate
+        self.observer = observer
+        self.lock = Lock()  # 수락 스레드가 여럿일 수 있음 (리스닝 소켓마다)
+
+    def admit(self, active):
+        """지금 연결이 active개일 때 새 연결을 받아도 되면 None, 아니면 보낼 THROTTLED 프레임을 돌려줍니다."""
+        with self.lock:
+            if 0 < self.max_connections <= active:
+                kind, delay = THROTTLE_CONNECTIONS, FULL_RETRY
+            elif self.accepts is not None and (delay := self.accepts.take()) > 0:
+                kind = THROTTLE_ACCEPTS
+            else:
+                return None
+        if self.observer is not None:
+            self.observer(kind)
+        return throttled_message(kind, delay)
+
+    def message_limit(self):
+        """새 연결의 메시지 속도 제한. 제한하지 않으면 None."""
+        if self.message_rate <= 0:
+            return None
+        return RateLimit(THROTTLE_MESSAGES, self.message_rate, max(1, self.message_burst), self.observer)
+
+    def upload_limit(self):
+        """새 연결의 업로드 속도 제한. 제한하지 않으면 None."""
+        if self.upload_rate <= 0:
+            return None
+        return RateLimit(THROTTLE_UPLOAD, self.upload_rate, self.upload_rate, self.observer)
@@ -0,0 +1,83 @@
+"""무중단 재시작: 리스닝 소켓과 접속 중인 클라이언트 소켓을 새 서버 프로세스로 넘깁니다.
+
+지금 서버를 --reload-socket 경로와 함께 실행해 두고, 새 코드를 같은 옵션에 --takeover를 붙여 실행하면
+  1. 새 프로세스가 그 경로(유닉스 도메인 소켓)로 접속해 넘겨 달라고 요청합니다.
+  2. 예전 프로세스는 새 연결을 받지 않고(커널 대기열에 남음) 모든 연결에 "RELOAD"를 보냅니다.
+     클라이언트는 올리던 파일을 마저 보낸 뒤 "RELOAD_OK"로 답하고 "RELOADED"를 받을 때까지 아무것도 보내지 않습니다.
+     예전 프로세스는 RELOAD_OK까지 읽은 연결의 수신을 멈추고(프레임 경계), 아직 답하지 않은 연결의 채팅과
+     진행 중인 다운로드는 계속 보냅니다.
+  3. 모든 연결이 멈추고 받던 업로드 스트림도 끝나면(RELOAD_TIMEOUT이 지나도록 답하지 않은 연결은 닫음)
+     송신 큐와 보내던 스트림을 비운 뒤 소켓들은 SCM_RIGHTS로, 연결마다의 상태(방, 이름, 협상한 압축과 다중화,
+     업로드 제안)는 JSON 스냅샷으로 새 프로세스에 보내고 종료합니다.
+  4. 새 프로세스는 연결마다 "RELOADED"를 보낸 뒤 이어서 처리하고, 같은 경로에서 다음 재시작 요청을 기다립니다.
+
+압축 스트림의 상태는 프로세스 사이에 옮길 수 없으므로 양쪽 모두 RELOADED 뒤로는 새 스트림으로 압축합니다.
+이어받기 업로드(staging), 저장소와 방 기록은 디스크에 있으므로 새 프로세스가 그대로 이어서 씁니다.
+"""
+import json
+import os
+import socket
+import struct
+from chat_protocol import recv_exact
+
+RELOAD_TIMEOUT = 30.0  # 클라이언트가 RELOAD_OK로 답하기를 기다리는 최대 시간(초). 답하지 않은 연결은 닫음
+RELOAD_POLL = 0.1  # 모든 연결이 멈췄는지 확인하는 간격(초)
+HANDOFF_VERSION = 1
+FDS_PER_MESSAGE = 250  # sendmsg 한 번에 넘기는 소켓 수 (리눅스 SCM_MAX_FD는 253)
+LENGTH = struct.Struct('!I')
+
+
+def listen_reload(path):
+    """재시작 요청을 받을 유닉스 도메인 소켓을 엽니다. (예전 프로세스가 쓰던 경로면 지우고 다시 만듦)"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(1)
+    return sock
+
+
+def connection_state(conn, name):
+    """넘길 연결의 상태. 압축은 협상한 결과만 남기고 스트림은 새로 시작합니다."""
+    accepted = []
+    if conn.deflater is not None:
+        accepted = ["deflate", "files"] if conn.deflater.body is not None else ["deflate"]
+    return {'addr': list(conn.addr[:2]), 'room': conn.room, 'name': name, 'compression': accepted,
+            'offers': conn.offers, 'streams': conn.multiplexed}
+
+
+def send_handoff(peer, listeners, connections):
+    """리스닝 소켓들과 (소켓, 상태) 목록을 peer로 보내고 새 프로세스가 받았다고 답할 때까지 기다립니다."""
+    snapshot = json.dumps({'version': HANDOFF_VERSION, 'listeners': len(listeners),
+                           'connections': [state for _, state in connections]}, ensure_ascii=False).encode('utf-8')
+    peer.sendall(LENGTH.pack(len(snapshot)) + snapshot)
+    fds = [sock.fileno() for sock in listeners] + [sock.fileno() for sock, _ in connections]
+    for start in range(0, len(fds), FDS_PER_MESSAGE):
+        socket.send_fds(peer, [b'F'], fds[start:start + FDS_PER_MESSAGE])
+    if peer.recv(1) != b'K':
+        raise ConnectionError("새 프로세스가 소켓을 받지 못했습니다.")
+
+
+def request_handoff(path):
+    """path에서 기다리는 서버에 재시작을 요청하고 (리스닝 소켓 목록, [(소켓, 상태), ...])를 돌려줍니다."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as peer:
+        peer.connect(path)
+        header = recv_exact(peer, LENGTH.size)
+        if header is None:
+            raise ConnectionError("실행 중인 서버가 연결을 넘기지 않았습니다.")
+        snapshot = json.loads(recv_exact(peer, LENGTH.unpack(header)[0]))
+        if snapshot['version'] != HANDOFF_VERSION:
+            raise ValueError(f"알 수 없는 스냅샷 버전: {snapshot['version']}")
+        fds = []
+        total = snapshot['listeners'] + len(snapshot['connections'])
+        while len(fds) < total:
+            data, received, _, _ = socket.recv_fds(peer, 1, FDS_PER_MESSAGE)
+            if not data:
+                raise ConnectionError("소켓을 모두 받기 전에 연결이 끊어졌습니다.")
+            fds += received
+        peer.sendall(b'K')
+    sockets = [socket.socket(fileno=fd) for fd in fds]
+    listeners = sockets[:snapshot['listeners']]
+    return listeners, list(zip(sockets[snapshot['listeners']:], snapshot['connections']))
@@ -0,0 +1,59 @@
+"""채팅방(룸)과 방별 참여자 색인.
+
+연결은 항상 방 하나에 들어가 있고(처음에는 DEFAULT_ROOM), 채팅/타이핑/NEW_FILE 같은 브로드캐스트는
+보낸 사람의 방 참여자에게만 전달됩니다. 방 -> 참여자 색인을 유지하므로 메시지 하나를 보내는 비용은
+서버 전체 접속자 수가 아니라 그 방의 인원 수에 비례합니다.
+"""
+from threading import Lock
+
+DEFAULT_ROOM = 'lobby'  # 접속하면 처음 들어가는 방
+MAX_ROOM_NAME = 64  # 방 이름의 최대 길이
+
+
+def valid_room_name(name):
+    """방 이름으로 쓸 수 있는지 확인합니다. (명령 구분자 ':'와 공백 문자는 허용하지 않음)"""
+    return 0 < len(name) <= MAX_ROOM_NAME and ':' not in name and not any(c.isspace() for c in name)
+
+
+class RoomIndex:
+    """방 이름 -> 참여 연결 색인. 스레드 방식과 asyncio 방식 서버가 함께 사용합니다."""
+
+    def __init__(self):
+        self.rooms = {}  # 방 이름 -> 참여 연결 집합
+        self.snapshots = {}  # 방 이름 -> 참여자 튜플 (브로드캐스트마다 복사하지 않도록 캐시)
+        self.lock = Lock()
+
+    def join(self, conn, room):
+        """conn을 room에 넣습니다. 다른 방에 있었다면 그 방에서는 나옵니다. 이전 방 이름을 돌려줍니다."""
+        with self.lock:
+            previous = conn.room
+            if previous is not None:
+                self._discard(conn, previous)
+            self.rooms.setdefault(room, set()).add(conn)
+            self.snapshots.pop(room, None)
+            conn.room = room
+            return previous
+
+    def leave(self, conn):
+        """conn을 지금 있는 방에서 뺍니다. (연결이 끊길 때)"""
+        with self.lock:
+            if conn.room is not None:
+                self._discard(conn, conn.room)
+                conn.room = None
+
+    def _discard(self, conn, room):
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(conn)
+            if not members: # 빈 방은 색인에서 지움
+                del self.rooms[room]
+        self.snapshots.pop(room, None)
+
+    def members(self, room):
+        """방 참여자들을 튜플로 돌려줍니다. 참여자가 바뀌기 전까지는 같은 튜플을 재사용합니다."""
+        with self.lock:
+            snapshot = self.snapshots.get(room)
+            if snapshot is None:
+                snapshot = tuple(self.rooms.get(room, ()))
+                self.snapshots[room] = snapshot
+            return snapshot
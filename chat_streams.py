@@ -0,0 +1,274 @@
+"""연결 하나에서 여러 전송과 채팅을 번갈아 보내는 다중화 스트림.
+
+본문을 그대로 보내면 받는 쪽 수신 루프가 END 프레임까지 그 전송에 묶여, 같은 연결로 오는 채팅 한 줄도
+전송이 끝날 때까지 기다립니다. 접속할 때 "STREAMS"로 협상한("STREAMS_OK") 연결에서는
+  - 본문이 뒤따르는 명령을 "STREAM:id:명령"으로 보내 스트림을 엽니다. (예: "STREAM:3:FILE_CHUNKS:전송id:0")
+  - 본문 프레임들(DATA/CHUNK/END)을 이어 붙인 바이트열을 STREAM_SEGMENT 이하로 잘라 STREAM 프레임에 담아 보냅니다.
+    다른 스트림의 조각과 채팅 프레임은 조각 사이에 끼어듭니다.
+  - 받는 쪽 수신 루프는 STREAM 프레임을 id에 맞는 StreamReader에 넣기만 하고 바로 다음 프레임을 읽습니다.
+    명령의 처리(저장, 표시)는 스트림마다 따로 스레드(코루틴)가 StreamReader를 소켓처럼 읽으며 합니다.
+스트림 id는 여는 쪽이 정합니다(클라이언트는 홀수, 서버는 짝수). 스트림은 본문의 END 프레임으로 끝나므로
+닫는 프레임은 따로 없고, 끝난 스트림으로 오는 조각은 버립니다.
+
+서버의 송신 스레드(코루틴)는 큐에 쌓인 채팅을 먼저 보내고, 보낼 것이 없을 때마다 보내는 중인 스트림들을
+돌아가며 조각 하나씩 보냅니다(라운드 로빈). 큰 전송이 여럿 진행 중이어도 채팅은 조각 하나만큼만 기다리고,
+커널 송신 버퍼에 쌓이는 양도 TCP_NOTSENT_LOWAT으로 줄여 그 뒤에서 기다리지 않게 합니다.
+압축을 협상한 연결은 STREAM 프레임 전체를 파일 본문 압축 스트림으로 압축하므로 보낸 순서대로 풀립니다.
+
+업로드 흐름 제어(CREDIT)는 그대로 연결 단위이고 스트림을 읽는 쪽이 본문 프레임을 읽을 때 셉니다.
+그래서 서버에 쌓이는 업로드 조각은 모든 스트림을 합쳐 transfer_window를 넘지 않습니다.
+"""
+import asyncio
+import os
+import socket
+from collections import deque
+from threading import Condition
+from chat_protocol import (HEADER, FRAME_STREAM, PROTOCOL_VERSION, STREAM_ID, STREAM_SEGMENT, TRANSFER_CHUNK_SIZE,
+                           ProtocolError, end_frame)
+from chat_transfer import data_header, chunk_header, _send_range, _send_range_async
+
+STREAM_BUFFER = 4 * 1024 * 1024  # 스트림 하나가 읽히기 전에 쌓아 둘 최대 바이트 수 (넘으면 수신 스레드가 기다림)
+STREAM_LOWAT = 128 * 1024  # 다중화한 연결의 커널 송신 버퍼에 쌓아 둘, 아직 보내지 않은 데이터의 상한
+
+
+def set_stream_lowat(sock, lowat=STREAM_LOWAT):
+    """아직 보내지 않은 데이터가 lowat 이하일 때만 소켓에 더 쓰도록 합니다. (지원하지 않는 운영체제에서는 그대로)
+
+    커널 버퍼에 전송 본문이 몇 MB씩 쌓여 있으면 그 뒤에 쓴 채팅은 버퍼가 빌 때까지 기다려야 합니다.
+    """
+    option = getattr(socket, 'TCP_NOTSENT_LOWAT', None)
+    if option is not None:
+        sock.setsockopt(socket.IPPROTO_TCP, option, lowat)
+
+
+def stream_header(sid, length):
+    """본문 length 바이트를 담을 STREAM 프레임의 헤더와 스트림 id 부분만 만듭니다."""
+    return HEADER.pack(PROTOCOL_VERSION, FRAME_STREAM, STREAM_ID.size + length) + STREAM_ID.pack(sid)
+
+
+class StreamReader:
+    """받는 스트림 하나의 버퍼 (스레드 방식).
+
+    recv_into만 제공하므로 read_frame, iter_body 같은 함수에 소켓 대신 넘기면 다중화 여부를 모른 채 동작합니다.
+    읽히지 않은 양이 limit을 넘으면 feed(수신 스레드)가 기다립니다.
+    """
+
+    def __init__(self, limit=STREAM_BUFFER):
+        self.limit = limit
+        self.chunks = deque()  # 받은 조각들 (memoryview)
+        self.size = 0  # chunks에 남은 바이트 수
+        self.eof = False  # 연결이 끊겼음
+        self.abandoned = False  # 읽는 쪽이 끝났으므로 더 오는 조각은 버림
+        self.cond = Condition()
+
+    def feed(self, data):
+        with self.cond:
+            while self.size >= self.limit and not (self.eof or self.abandoned):
+                self.cond.wait()
+            if self.eof or self.abandoned:
+                return
+            self.chunks.append(data)
+            self.size += len(data)
+            self.cond.notify_all()
+
+    def recv_into(self, view):
+        with self.cond:
+            while not self.chunks and not self.eof:
+                self.cond.wait()
+            if not self.chunks:
+                return 0
+            data = self.chunks[0]
+            count = min(len(view), len(data))
+            view[:count] = data[:count]
+            if count == len(data):
+                self.chunks.popleft()
+            else:
+                self.chunks[0] = data[count:]
+            self.size -= count
+            self.cond.notify_all()
+            return count
+
+    def close(self):
+        with self.cond:
+            self.eof = True
+            self.cond.notify_all()
+
+    def abandon(self):
+        with self.cond:
+            self.abandoned = True
+            self.chunks.clear()
+            self.size = 0
+            self.cond.notify_all()
+
+
+class AsyncStreamReader:
+    """StreamReader의 asyncio 버전. read_frame_async가 쓰는 readexactly만 제공합니다.
+
+    이벤트 루프 안에서만 쓰고 feed는 기다리지 않습니다. (쌓이는 양은 업로드 크레딧이 묶음)
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.eof = False
+        self.abandoned = False
+        self.ready = asyncio.Event()  # 조각이 들어오거나 연결이 끊기면 설정
+
+    def feed(self, data):
+        if not self.abandoned:
+            self.buffer += data
+            self.ready.set()
+
+    async def readexactly(self, n):
+        while len(self.buffer) < n:
+            if self.eof:
+                partial = bytes(self.buffer)
+                self.buffer.clear()
+                raise asyncio.IncompleteReadError(partial, n)
+            self.ready.clear()
+            await self.ready.wait()
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    def close(self):
+        self.eof = True
+        self.ready.set()
+
+    def abandon(self):
+        self.abandoned = True
+        self.buffer.clear()
+
+
+class StreamTable:
+    """연결 하나의 받는 스트림들 (스트림 id -> StreamReader). 수신 쪽이 STREAM 프레임을 id에 맞게 나눠 넣습니다."""
+
+    def __init__(self, reader_class=StreamReader):
+        self.reader_class = reader_class
+        self.readers = {}
+
+    def __len__(self):
+        return len(self.readers)
+
+    def open(self, sid):
+        """sid 스트림을 엽니다. 같은 id가 아직 남아 있으면(재시작한 서버가 id를 다시 씀) 새 스트림으로 바꿉니다."""
+        reader = self.reader_class()
+        self.readers[sid] = reader
+        return reader
+
+    def feed(self, payload):
+        """STREAM 프레임의 페이로드를 그 스트림에 넣습니다. 끝났거나 모르는 스트림의 조각은 버립니다."""
+        if len(payload) < STREAM_ID.size:
+            raise ProtocolError("STREAM 프레임에 스트림 id가 없습니다.")
+        sid, = STREAM_ID.unpack_from(payload)
+        reader = self.readers.get(sid)
+        if reader is not None:
+            reader.feed(memoryview(payload)[STREAM_ID.size:])
+
+    def finish(self, sid, reader):
+        """스트림을 읽는 쪽이 끝났을 때 부릅니다."""
+        reader.abandon()
+        if self.readers.get(sid) is reader:
+            self.readers.pop(sid, None)
+
+    def close(self):
+        """연결이 끊겼을 때: 모든 스트림을 읽는 쪽이 연결 끊김을 보도록 합니다."""
+        for reader in list(self.readers.values()):
+            reader.close()
+        self.readers.clear()
+
+
+def file_body_pieces(f, segment=STREAM_SEGMENT):
+    """send_file_body처럼 파일 전체를 DATA 프레임들과 END 프레임으로 보낼 조각들. DATA 프레임 하나가 조각 하나입니다.
+
+    조각은 (앞부분 바이트열, 파일, 위치, 길이)이고, 파일 구간은 송신 쪽이 sendfile로 보냅니다.
+    """
+    size = os.fstat(f.fileno()).st_size
+    offset = 0
+    while offset < size:
+        count = min(segment - HEADER.size, size - offset)
+        yield data_header(count), f, offset, count
+        offset += count
+    yield end_frame(), None, 0, 0
+
+
+def file_chunk_pieces(f, checksums, offset=0, segment=STREAM_SEGMENT):
+    """send_file_chunks와 같은 CHUNK 프레임들과 END 프레임의 조각들. CHUNK 프레임 하나를 여러 조각에 나누어 담습니다."""
+    size = os.fstat(f.fileno()).st_size
+    while offset < size:
+        count = min(TRANSFER_CHUNK_SIZE, size - offset)
+        head = chunk_header(offset, count, checksums[offset // TRANSFER_CHUNK_SIZE])
+        start, end = offset, offset + count
+        while start < end:
+            length = min(segment - len(head), end - start)
+            yield head, f, start, length
+            head = b''
+            start += length
+        offset = end
+    yield end_frame(), None, 0, 0
+
+
+def read_range(f, offset, count):
+    f.seek(offset)
+    data = f.read(count)
+    if len(data) != count:
+        raise EOFError("전송 도중 파일이 줄어들었습니다.")
+    return data
+
+
+class OutboundStream:
+    """송신 스레드(코루틴)가 채팅, 다른 스트림과 번갈아 보낼 스트림 하나. 송신 큐에 넣으면 보내는 중인 목록에 들어갑니다.
+
+    pieces는 조각 (앞부분 바이트열, 파일, 위치, 길이)들의 이터레이터이고 조각 하나가 STREAM 프레임 하나가 됩니다.
+    compress면 조각을 읽어 연결의 파일 본문 압축 스트림으로 압축하고, 아니면 파일 구간을 sendfile로 보냅니다.
+    """
+
+    def __init__(self, pieces, stats, compress=False):
+        self.sid = None  # 서버가 스트림을 열 때 정함
+        self.pieces = pieces
+        self.stats = stats
+        self.compress = compress
+        if compress:
+            stats.method = 'deflate'
+
+    def send(self, sock, deflater):
+        """조각 하나를 블로킹 소켓에 보냅니다. 더 보낼 조각이 없으면 False."""
+        piece = next(self.pieces, None)
+        if piece is None:
+            return False
+        head, f, offset, count = piece
+        frame = stream_header(self.sid, len(head) + count) + head
+        if self.compress:
+            if count:
+                frame += read_range(f, offset, count)
+                self.stats.bytes_sent += count
+            sock.sendall(deflater.pack(frame, body=True))
+            self.stats.syscalls += 1
+        else:
+            sock.sendall(frame)
+            self.stats.syscalls += 1
+            if count:
+                _send_range(sock, f, offset, count, self.stats)
+        return True
+
+    async def send_async(self, writer, deflater):
+        """send의 asyncio 버전. 읽기와 압축은 이벤트 루프를 막지 않도록 스레드 풀에서 합니다."""
+        piece = next(self.pieces, None)
+        if piece is None:
+            return False
+        head, f, offset, count = piece
+        frame = stream_header(self.sid, len(head) + count) + head
+        if self.compress:
+            loop = asyncio.get_running_loop()
+            if count:
+                frame += await loop.run_in_executor(None, read_range, f, offset, count)
+                self.stats.bytes_sent += count
+            writer.write(await loop.run_in_executor(None, deflater.pack, frame, True))
+            await writer.drain()
+            self.stats.syscalls += 1
+        else:
+            writer.write(frame)
+            await writer.drain()
+            self.stats.syscalls += 1
+            if count:
+                await _send_range_async(writer, f, offset, count, self.stats)
+        return True
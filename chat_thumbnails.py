@@ -0,0 +1,96 @@
+"""서버 쪽 이미지 미리보기(썸네일) 생성과 캐시.
+
+미리보기는 서버가 이미지마다 한 번만 만들어 모든 클라이언트에게 보내고,
+원본은 클라이언트가 클릭했을 때만 따로 받아 갑니다.
+생성은 별도 프로세스 풀에서 하므로 디코딩/축소 작업이 서버의 GIL을 잡지 않습니다.
+Pillow가 설치되어 있지 않으면 THUMBNAILS_AVAILABLE이 False가 되고 서버는 원본 중계 방식으로 동작합니다.
+"""
+import io
+import os
+from collections import OrderedDict
+from threading import Lock
+
+try:
+    from PIL import Image
+    THUMBNAILS_AVAILABLE = True
+except ImportError:
+    Image = None
+    THUMBNAILS_AVAILABLE = False
+
+THUMBNAIL_SIZE = (150, 150)  # 미리보기의 최대 가로/세로 크기 (비율 유지)
+THUMBNAIL_WORKERS = 2  # 미리보기를 만드는 프로세스 수
+
+
+def make_thumbnail(path, size=THUMBNAIL_SIZE):
+    """이미지 파일을 읽어 PNG 미리보기 바이트열을 만듭니다. (프로세스 풀에서 실행)"""
+    with Image.open(path) as image:
+        image.thumbnail(size, Image.LANCZOS)
+        if image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+            image = image.convert('RGBA')
+        out = io.BytesIO()
+        image.save(out, format='PNG', optimize=True)
+    return out.getvalue()
+
+
+class ThumbnailCache:
+    """내용 해시 -> 미리보기 바이트열 캐시.
+
+    메모리에는 최근에 쓴 max_entries개만 LRU로 두고, 디스크(<root>/<해시>.png)에는
+    max_disk_entries개까지 보관합니다. 넘치면 가장 오래전에 쓴 것부터 지웁니다.
+    """
+
+    def __init__(self, root, max_entries=256, max_disk_entries=4096):
+        self.root = root
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.memory = OrderedDict()  # 해시 -> 바이트열 (뒤쪽일수록 최근에 사용)
+        self.lock = Lock()
+        os.makedirs(root, exist_ok=True)
+        # 디스크에 남아 있는 미리보기를 최근 사용 순서(수정 시각)로 불러옴
+        entries = [(entry.stat().st_mtime, entry.name[:-4]) for entry in os.scandir(root)
+                   if entry.name.endswith('.png')]
+        self.disk = OrderedDict((digest, None) for _, digest in sorted(entries))
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest + '.png')
+
+    def get(self, digest):
+        """캐시에 있으면 미리보기 바이트열을, 없으면 None을 돌려줍니다."""
+        with self.lock:
+            if digest in self.memory:
+                self.memory.move_to_end(digest)
+                return self.memory[digest]
+            if digest not in self.disk:
+                return None
+            self.disk.move_to_end(digest)
+        try:
+            with open(self._path(digest), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self._remember(digest, data)
+        return data
+
+    def put(self, digest, data):
+        """미리보기를 메모리와 디스크에 저장합니다."""
+        tmp = self._path(digest) + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self._path(digest))
+        with self.lock:
+            self.disk[digest] = None
+            self.disk.move_to_end(digest)
+            while len(self.disk) > self.max_disk_entries:
+                old, _ = self.disk.popitem(last=False)
+                try:
+                    os.remove(self._path(old))
+                except FileNotFoundError:
+                    pass
+        self._remember(digest, data)
+
+    def _remember(self, digest, data):
+        with self.lock:
+            self.memory[digest] = data
+            self.memory.move_to_end(digest)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
@@ -0,0 +1,469 @@
+"""서버에서 클라이언트로 파일 본문을 보내는 전송 경로.
+
+가능하면 커널의 제로 카피 경로(os.sendfile / loop.sendfile)로 파일 내용을 소켓에 바로 보내고,
+지원하지 않는 환경에서는 큰 버퍼로 읽어 보내는 방식으로 대체합니다.
+전송마다 TransferStats에 보낸 바이트 수, 초당 전송량, 시스템 호출 수를 기록합니다.
+
+이어받기 다운로드는 DATA 대신 CHUNK 프레임으로 보냅니다. 조각별 CRC32는 저장소가 미리 계산해 둔 값을 쓰므로
+본문은 여전히 sendfile로 보내고, 프레임 헤더와 [위치][CRC32] 12바이트만 따로 씁니다.
+병렬 다운로드(chat_ranges)의 구간 요청에도 같은 CHUNK 프레임으로 파일의 한 구간만 보냅니다.
+파일 본문 압축("files")을 협상한 연결에는 제로 카피 대신 조각을 읽어 압축한 뒤 보냅니다.
+
+업로드 쪽 흐름 제어도 여기에 있습니다. 업로더 -> 서버는 UploadCredit이 보내는 "CREDIT:n"으로,
+서버 -> 수신자는 StreamRelay의 바이트 창으로 묶여 있어서, 수신자가 느리면 중계 창이 차고, 서버가 본문을
+더 읽지 않으니 크레딧도 늘지 않아 업로더가 보내는 속도가 가장 느린 수신자에 맞춰 줄어듭니다.
+전송 한 건이 서버 메모리에 두는 양은 창 크기(transfer_window)에 프레임 하나를 더한 것을 넘지 않습니다.
+"""
+import asyncio
+import errno
+import os
+import time
+from threading import Condition
+from chat_protocol import (FRAME_DATA, FRAME_CHUNK, HEADER, CHUNK_HEADER, PROTOCOL_VERSION,
+                           TRANSFER_CHUNK_SIZE, INITIAL_CREDIT, end_frame, text_frame)
+
+SENDFILE_FRAME_SIZE = 8 * 1024 * 1024  # 제로 카피 경로에서 DATA 프레임 하나에 담는 크기
+BUFFERED_CHUNK_SIZE = 256 * 1024  # 대체 경로에서 한 번에 읽어 보내는 크기
+TRANSFER_WINDOW = 1024 * 1024  # 업로드/중계 한 건이 서버가 처리하기 전에 쌓아 둘 수 있는 최대 바이트 수
+
+# 이 오류들은 "sendfile을 쓸 수 없는 소켓/파일"이라는 뜻이므로 버퍼 방식으로 대체합니다.
+_SENDFILE_UNSUPPORTED = {errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP}
+
+
+def data_header(length):
+    """DATA 프레임의 헤더만 만듭니다. 본문은 sendfile로 따로 보냅니다."""
+    return HEADER.pack(PROTOCOL_VERSION, FRAME_DATA, length)
+
+
+def chunk_header(offset, length, crc):
+    """CHUNK 프레임의 헤더와 [위치][CRC32] 부분만 만듭니다. 본문은 sendfile로 따로 보냅니다."""
+    return HEADER.pack(PROTOCOL_VERSION, FRAME_CHUNK, CHUNK_HEADER.size + length) + CHUNK_HEADER.pack(offset, crc)
+
+
+class TransferStats:
+    """파일 전송 한 건의 통계."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.method = 'sendfile'  # 실제로 사용한 경로 ('sendfile', 'buffered', 'deflate')
+        self.bytes_sent = 0  # 보낸 파일 본문 바이트 수 (프레임 헤더 제외)
+        self.syscalls = 0  # 소켓에 대한 send/sendfile 호출 수
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def bytes_per_sec(self):
+        return self.bytes_sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        return (f"{self.bytes_sent} 바이트, {self.elapsed:.3f}초, "
+                f"{self.bytes_per_sec / (1024 * 1024):.1f} MB/s, "
+                f"시스템 호출 {self.syscalls}회 ({self.method})")
+
+
+def _send_buffered(sock, f, offset, count, stats):
+    """파일의 [offset, offset+count) 구간을 버퍼로 읽어 보냅니다."""
+    f.seek(offset)
+    while count > 0:
+        chunk = f.read(min(BUFFERED_CHUNK_SIZE, count))
+        if not chunk:
+            raise EOFError("전송 도중 파일이 줄어들었습니다.")
+        sock.sendall(chunk)
+        stats.syscalls += 1
+        stats.bytes_sent += len(chunk)
+        count -= len(chunk)
+
+
+def _send_range(sock, f, offset, count, stats):
+    """파일 구간을 os.sendfile로 보내고, 지원하지 않으면 버퍼 방식으로 나머지를 보냅니다."""
+    if stats.method == 'sendfile' and hasattr(os, 'sendfile'):
+        try:
+            out_fd, in_fd = sock.fileno(), f.fileno()
+            while count > 0:
+                sent = os.sendfile(out_fd, in_fd, offset, count)
+                stats.syscalls += 1
+                if sent == 0:
+                    raise EOFError("전송 도중 파일이 줄어들었습니다.")
+                stats.bytes_sent += sent
+                offset += sent
+                count -= sent
+            return
+        except OSError as e:
+            if e.errno not in _SENDFILE_UNSUPPORTED:
+                raise
+        except AttributeError:  # fileno가 없는 파일 객체
+            pass
+    stats.method = 'buffered'
+    _send_buffered(sock, f, offset, count, stats)
+
+
+def send_file_body(sock, f, stats, frame_size=SENDFILE_FRAME_SIZE):
+    """블로킹 소켓에 파일 전체를 DATA 프레임들과 END 프레임으로 보냅니다.
+
+    프레임 헤더는 sendall로, 본문은 커널에서 소켓으로 바로 복사합니다.
+    """
+    size = os.fstat(f.fileno()).st_size
+    if not hasattr(os, 'sendfile'):
+        stats.method = 'buffered'
+    offset = 0
+    while offset < size:
+        count = min(frame_size, size - offset)
+        sock.sendall(data_header(count))
+        stats.syscalls += 1
+        _send_range(sock, f, offset, count, stats)
+        offset += count
+    sock.sendall(end_frame())
+    stats.syscalls += 1
+    stats.finish()
+
+
+def chunk_range(offset, length, size):
+    """요청한 구간 [offset, offset + length)를 체크섬 조각 경계로 넓히고 파일 안으로 줄여 (시작, 끝)을 돌려줍니다."""
+    start = max(0, min(offset - offset % TRANSFER_CHUNK_SIZE, size))
+    end = offset + length
+    end = min(end + -end % TRANSFER_CHUNK_SIZE, size)
+    return start, max(start, end)
+
+
+def send_file_chunks(sock, f, stats, checksums, offset=0, end=None):
+    """블로킹 소켓에 파일의 offset 이후(end가 있으면 end 앞까지)를 CHUNK 프레임들과 END 프레임으로 보냅니다.
+
+    checksums는 TRANSFER_CHUNK_SIZE 단위 조각들의 CRC32 목록이고, offset과 end는 조각 경계(또는 파일 끝)여야 합니다.
+    """
+    size = os.fstat(f.fileno()).st_size if end is None else end
+    if not hasattr(os, 'sendfile'):
+        stats.method = 'buffered'
+    while offset < size:
+        count = min(TRANSFER_CHUNK_SIZE, size - offset)
+        sock.sendall(chunk_header(offset, count, checksums[offset // TRANSFER_CHUNK_SIZE]))
+        stats.syscalls += 1
+        _send_range(sock, f, offset, count, stats)
+        offset += count
+    sock.sendall(end_frame())
+    stats.syscalls += 1
+    stats.finish()
+
+
+def send_file_chunks_deflated(sock, f, stats, checksums, offset, deflater):
+    """send_file_chunks와 같은 CHUNK 프레임들을 연결의 파일 본문 압축 스트림으로 압축해 보냅니다."""
+    stats.method = 'deflate'
+    size = os.fstat(f.fileno()).st_size
+    f.seek(offset)
+    while offset < size:
+        data = f.read(min(TRANSFER_CHUNK_SIZE, size - offset))
+        if not data:
+            raise EOFError("전송 도중 파일이 줄어들었습니다.")
+        frame = chunk_header(offset, len(data), checksums[offset // TRANSFER_CHUNK_SIZE]) + data
+        sock.sendall(deflater.pack(frame, body=True))
+        stats.syscalls += 1
+        stats.bytes_sent += len(data)
+        offset += len(data)
+    sock.sendall(end_frame())
+    stats.syscalls += 1
+    stats.finish()
+
+
+async def _send_range_async(writer, f, offset, count, stats):
+    """파일 구간을 loop.sendfile로 보냅니다. 제로 카피를 쓸 수 없으면 asyncio의 버퍼 방식으로 대체합니다."""
+    loop = asyncio.get_running_loop()
+    try:
+        sent = await loop.sendfile(writer.transport, f, offset, count,
+                                   fallback=stats.method == 'buffered')
+    except asyncio.SendfileNotAvailableError:
+        stats.method = 'buffered'
+        sent = await loop.sendfile(writer.transport, f, offset, count, fallback=True)
+    stats.syscalls += 1
+    if sent != count:
+        raise EOFError("전송 도중 파일이 줄어들었습니다.")
+    stats.bytes_sent += sent
+
+
+async def send_file_body_async(writer, f, stats, frame_size=SENDFILE_FRAME_SIZE):
+    """send_file_body의 asyncio 버전. 본문은 loop.sendfile로 보냅니다.
+
+    loop.sendfile은 내부에서 os.sendfile을 반복 호출하므로 syscalls에는 loop.sendfile 호출 수를 셉니다.
+    제로 카피를 쓸 수 없는 트랜스포트(TLS 등)에서는 asyncio의 버퍼 방식으로 대체합니다.
+    """
+    size = os.fstat(f.fileno()).st_size
+    offset = 0
+    while offset < size:
+        count = min(frame_size, size - offset)
+        writer.write(data_header(count))
+        await writer.drain()
+        stats.syscalls += 1
+        await _send_range_async(writer, f, offset, count, stats)
+        offset += count
+    writer.write(end_frame())
+    await writer.drain()
+    stats.syscalls += 1
+    stats.finish()
+
+
+async def send_file_chunks_async(writer, f, stats, checksums, offset=0, end=None):
+    """send_file_chunks의 asyncio 버전."""
+    size = os.fstat(f.fileno()).st_size if end is None else end
+    while offset < size:
+        count = min(TRANSFER_CHUNK_SIZE, size - offset)
+        writer.write(chunk_header(offset, count, checksums[offset // TRANSFER_CHUNK_SIZE]))
+        await writer.drain()
+        stats.syscalls += 1
+        await _send_range_async(writer, f, offset, count, stats)
+        offset += count
+    writer.write(end_frame())
+    await writer.drain()
+    stats.syscalls += 1
+    stats.finish()
+
+
+async def send_file_chunks_deflated_async(writer, f, stats, checksums, offset, deflater):
+    """send_file_chunks_deflated의 asyncio 버전. 읽기와 압축은 이벤트 루프를 막지 않도록 스레드 풀에서 합니다."""
+    loop = asyncio.get_running_loop()
+    stats.method = 'deflate'
+    size = os.fstat(f.fileno()).st_size
+    f.seek(offset)
+    while offset < size:
+        data = await loop.run_in_executor(None, f.read, min(TRANSFER_CHUNK_SIZE, size - offset))
+        if not data:
+            raise EOFError("전송 도중 파일이 줄어들었습니다.")
+        frame = chunk_header(offset, len(data), checksums[offset // TRANSFER_CHUNK_SIZE]) + data
+        writer.write(await loop.run_in_executor(None, deflater.pack, frame, True))
+        await writer.drain()
+        stats.syscalls += 1
+        stats.bytes_sent += len(data)
+        offset += len(data)
+    writer.write(end_frame())
+    await writer.drain()
+    stats.syscalls += 1
+    stats.finish()
+
+
+RELAY_TIMEOUT = 5.0  # 가장 느린 수신자를 기다리는 최대 시간(초). 넘기면 그 수신자는 중계에서 제외 (연결은 유지)
+
+
+class UploadCredit:
+    """업로더에게 "CREDIT:n"으로 더 보내도 되는 양을 알려 주는 연결별 흐름 제어 (스레드 방식).
+
+    n은 연결이 열린 뒤 보낼 수 있는 본문 페이로드의 누적 바이트 수 상한입니다. 서버가 본문 프레임을 읽을 때마다
+    consume이 불리고, 남은 크레딧이 창의 절반 이하로 내려가면 읽은 양 + window로 상한을 올려 알립니다.
+    서버가 읽지 않으면(디스크나 중계 창이 막히면) 크레딧도 늘지 않으므로, 업로더가 앞서 보내 둔 본문은
+    소켓 버퍼를 포함해 window를 넘지 않습니다.
+    rate_limit(업로드 속도 제한)가 있으면 초과한 만큼 늦게 읽으므로 크레딧도 그 속도로만 늘어납니다.
+    """
+
+    def __init__(self, conn, window=TRANSFER_WINDOW, rate_limit=None):
+        self.conn = conn
+        self.window = window
+        self.rate_limit = rate_limit
+        self.consumed = 0  # 지금까지 읽은 본문 페이로드 바이트 수
+        self.limit = INITIAL_CREDIT  # 업로더에게 허락한 누적 바이트 수
+
+    def grant(self, nbytes):
+        """읽은 양을 반영하고, 크레딧을 늘려야 하면 보낼 CREDIT 프레임을 돌려줍니다."""
+        self.consumed += nbytes
+        if self.limit - self.consumed > self.window // 2:
+            return None
+        self.limit = self.consumed + self.window
+        return text_frame(f"CREDIT:{self.limit}")
+
+    def pace(self, nbytes):
+        """속도 제한에 걸렸으면 (기다릴 시간, 제한에 걸리기 시작했다면 보낼 THROTTLED 프레임)을 돌려줍니다."""
+        if self.rate_limit is None:
+            return 0, None
+        return self.rate_limit.charge(nbytes)
+
+    def consume(self, nbytes):
+        delay, notice = self.pace(nbytes)
+        if notice is not None:
+            self.conn.send(notice, droppable=True)
+        if delay:
+            time.sleep(delay) # 수신 스레드만 쉼 (이 연결의 본문을 늦게 읽음)
+        frame = self.grant(nbytes)
+        if frame is not None:
+            self.conn.send(frame, wait=True)
+
+
+class AsyncUploadCredit(UploadCredit):
+    """UploadCredit의 asyncio 버전."""
+
+    async def consume(self, nbytes):
+        delay, notice = self.pace(nbytes)
+        if notice is not None:
+            await self.conn.send(notice, droppable=True)
+        if delay:
+            await asyncio.sleep(delay)
+        frame = self.grant(nbytes)
+        if frame is not None:
+            await self.conn.send(frame, wait=True)
+
+
+class StreamRelay:
+    """업로더가 보낸 프레임을 받는 즉시 여러 수신자에게 흘려보내는 중계기 (스레드 방식).
+
+    프레임은 한 번만 인코딩되어 모든 수신자가 공유하고, 메모리에는 가장 느린 수신자가 아직
+    보내지 못한 프레임들만 남습니다. 남은 프레임이 window 바이트를 넘으면 업로더 쪽 push가 기다리므로
+    이미지가 아무리 커도 전송 한 건이 쓰는 메모리는 일정합니다.
+    timeout 넘게 따라오지 못한 수신자(긴 다운로드를 받는 중인 경우 등)는 중계에서 빠지지만 연결은 끊지 않습니다.
+    보내던 본문은 END 프레임으로 닫고 "FILE_SKIPPED:이름"으로 알립니다. (skipped_frames)
+    """
+
+    def __init__(self, window=TRANSFER_WINDOW, timeout=RELAY_TIMEOUT, name=""):
+        self.window = window
+        self.timeout = timeout
+        self.name = name  # 건너뛰었다고 알릴 때 쓰는 파일명
+        self.frames = {}  # 프레임 번호 -> 인코딩된 프레임
+        self.size = 0  # frames에 남아 있는 바이트 수
+        self.next_seq = 0  # 다음에 들어올 프레임 번호
+        self.positions = {}  # 수신자 -> 다음에 보낼 프레임 번호
+        self.done = False
+        self.cond = Condition()
+
+    def add_reader(self, key):
+        with self.cond:
+            self.positions[key] = 0
+
+    def remove_reader(self, key):
+        with self.cond:
+            self.positions.pop(key, None)
+            self._evict()
+            self.cond.notify_all()
+
+    def _evict(self):
+        """모든 수신자가 이미 보낸 프레임을 메모리에서 지웁니다."""
+        low = min(self.positions.values(), default=self.next_seq)
+        for seq in [seq for seq in self.frames if seq < low]:
+            self.size -= len(self.frames.pop(seq))
+
+    def push(self, frame):
+        """프레임 하나를 창에 추가합니다. 창이 가득 차면 자리가 날 때까지 기다립니다."""
+        with self.cond:
+            deadline = time.monotonic() + self.timeout
+            while self.positions and self.size >= self.window:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:  # 가장 느린 수신자를 중계에서 제외
+                    low = min(self.positions.values())
+                    for key in [key for key, pos in self.positions.items() if pos == low]:
+                        del self.positions[key]
+                    self._evict()
+                    break
+                self.cond.wait(remaining)
+            self.frames[self.next_seq] = frame
+            self.size += len(frame)
+            self.next_seq += 1
+            self._evict()
+            self.cond.notify_all()
+
+    def finish(self):
+        with self.cond:
+            self.done = True
+            self.cond.notify_all()
+
+    def skipped_frames(self, started):
+        """중계에서 빠진 수신자에게 보낼 프레임. 헤더를 이미 보냈으면(started) END 프레임으로 본문부터 닫습니다."""
+        notice = text_frame(f"FILE_SKIPPED:{self.name}")
+        return end_frame() + notice if started else notice
+
+    def reader(self, key):
+        """수신자의 송신 스레드에서 실행할 송신 작업을 만듭니다."""
+        def job(sock):
+            started = False  # 프레임을 하나라도 보냈는지
+            try:
+                while True:
+                    with self.cond:
+                        while key in self.positions and self.positions[key] >= self.next_seq and not self.done:
+                            self.cond.wait()
+                        if key not in self.positions:  # 너무 느려 중계에서 빠짐
+                            break
+                        pos = self.positions[key]
+                        if pos >= self.next_seq:  # 모든 프레임을 보냈음
+                            return
+                        frame = self.frames[pos]
+                    sock.sendall(frame)
+                    started = True
+                    with self.cond:
+                        if key in self.positions:
+                            self.positions[key] = pos + 1
+                            self._evict()
+                            self.cond.notify_all()
+                sock.sendall(self.skipped_frames(started))
+            finally:
+                self.remove_reader(key)
+        return job
+
+
+class AsyncStreamRelay(StreamRelay):
+    """StreamRelay의 asyncio 버전. 모든 메서드는 이벤트 루프 안에서만 호출됩니다."""
+
+    def __init__(self, window=TRANSFER_WINDOW, timeout=RELAY_TIMEOUT, name=""):
+        super().__init__(window, timeout, name)
+        self.changed = asyncio.Event()  # 프레임이 추가되거나 수신자 위치가 바뀔 때마다 설정
+
+    def _notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def add_reader(self, key):
+        self.positions[key] = 0
+
+    def remove_reader(self, key):
+        self.positions.pop(key, None)
+        self._evict()
+        self._notify()
+
+    async def _wait_changed(self, timeout=None):
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def push(self, frame):
+        deadline = time.monotonic() + self.timeout
+        while self.positions and self.size >= self.window:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                low = min(self.positions.values())
+                for key in [key for key, pos in self.positions.items() if pos == low]:
+                    del self.positions[key]
+                self._evict()
+                break
+            await self._wait_changed(remaining)
+        self.frames[self.next_seq] = frame
+        self.size += len(frame)
+        self.next_seq += 1
+        self._evict()
+        self._notify()
+
+    def finish(self):
+        self.done = True
+        self._notify()
+
+    def reader(self, key):
+        async def job(writer):
+            started = False
+            try:
+                while True:
+                    while key in self.positions and self.positions[key] >= self.next_seq and not self.done:
+                        await self._wait_changed()
+                    if key not in self.positions:
+                        break
+                    pos = self.positions[key]
+                    if pos >= self.next_seq:
+                        return
+                    writer.write(self.frames[pos])
+                    started = True
+                    await writer.drain()
+                    if key in self.positions:
+                        self.positions[key] = pos + 1
+                        self._evict()
+                        self._notify()
+                writer.write(self.skipped_frames(started))
+                await writer.drain()
+            finally:
+                self.remove_reader(key)
+        return job
@@ -0,0 +1,108 @@
+"""방별 "입력 중" 상태를 서버에서 모아 정해진 간격으로 한 번에 알리는 타이핑 상태 관리.
+
+클라이언트가 보내는 TYPING:/TYPING_STOP: 이벤트는 더 이상 그대로 중계하지 않고 여기에 반영만 합니다.
+서버는 TYPING_TICK마다 상태가 바뀐 방에만 "TYPING_STATE:이름<TAB>이름..." 하나를 보내므로,
+키 입력이 아무리 잦아도 방마다 초당 보내는 타이핑 메시지 수는 1/TYPING_TICK개를 넘지 않습니다.
+TYPING_TTL 동안 새 이벤트가 없으면(클라이언트가 조용해졌거나 연결이 끊겼으면) 입력 중 상태는 저절로 사라집니다.
+"""
+import time
+from threading import Lock
+
+TYPING_TICK = 0.25  # 방마다 타이핑 상태를 모아 보내는 간격(초)
+TYPING_TTL = 6.0  # 새 TYPING 이벤트 없이 입력 중 상태가 유지되는 시간(초). 클라이언트는 이보다 자주 다시 보냄
+TYPING_SEPARATOR = "\t"  # TYPING_STATE 메시지의 이름 구분자
+
+
+def typing_state_message(names):
+    """입력 중인 이름 목록을 "TYPING_STATE:..." 메시지로 만듭니다. (빈 목록이면 아무도 입력 중이 아님)"""
+    return "TYPING_STATE:" + TYPING_SEPARATOR.join(names)
+
+
+class TypingTracker:
+    """방 이름 -> {입력 중인 이름: [만료 시각, 다른 워커에 마지막으로 알린 시각]}.
+
+    스레드 방식과 asyncio 방식 서버가 함께 사용합니다. owner(연결)별로 어느 방의 어느 이름으로
+    입력 중인지 기억해 두었다가 연결이 끊기거나 방을 옮기면 지웁니다.
+    """
+
+    def __init__(self, ttl=TYPING_TTL):
+        self.ttl = ttl
+        self.rooms = {}
+        self.owners = {}  # 연결 -> (방 이름, 이름)
+        self.sent = {}  # 방 이름 -> 마지막으로 보낸 이름 튜플
+        self.dirty = set()  # 마지막 틱 이후 상태가 바뀌었을 수 있는 방
+        self.lock = Lock()
+
+    def update(self, room, name, typing, owner=None):
+        """이벤트 하나를 반영합니다. 다른 워커에게도 알려야 하면 True를 돌려줍니다.
+
+        입력 시작/중단처럼 상태가 바뀐 경우와, 입력이 계속되는 동안 TTL의 절반마다 한 번씩만 True입니다.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if owner is not None:
+                previous = self.owners.pop(owner, None)
+                if previous is not None and previous != (room, name): # 같은 연결이 방이나 이름을 바꿈
+                    self._remove(*previous)
+                if typing:
+                    self.owners[owner] = (room, name)
+            typers = self.rooms.setdefault(room, {})
+            entry = typers.get(name)
+            if not typing:
+                if entry is None:
+                    if not typers:
+                        del self.rooms[room]
+                    return False
+                self._remove(room, name)
+                return True
+            if entry is None:
+                typers[name] = [now + self.ttl, now]
+                self.dirty.add(room)
+                return True
+            entry[0] = now + self.ttl
+            if now - entry[1] >= self.ttl / 2:
+                entry[1] = now
+                return True
+            return False
+
+    def drop(self, owner):
+        """연결이 입력 중으로 남겨 둔 상태를 지우고 (방 이름, 이름)을 돌려줍니다. 없으면 None."""
+        with self.lock:
+            previous = self.owners.pop(owner, None)
+            if previous is not None:
+                self._remove(*previous)
+            return previous
+
+    def _remove(self, room, name):
+        typers = self.rooms.get(room)
+        if typers is not None and typers.pop(name, None) is not None:
+            self.dirty.add(room)
+            if not typers:
+                del self.rooms[room]
+
+    def names(self, room):
+        """방에서 지금 입력 중인 이름들 (새로 입장한 연결에게 보낼 때)."""
+        with self.lock:
+            return tuple(sorted(self.rooms.get(room, ())))
+
+    def tick(self):
+        """만료된 상태를 지우고, 마지막으로 보낸 뒤 바뀐 방들의 [(방 이름, 이름 튜플)]을 돌려줍니다."""
+        now = time.monotonic()
+        changes = []
+        with self.lock:
+            for room, typers in list(self.rooms.items()):
+                for name in [name for name, (expires, _) in typers.items() if expires <= now]:
+                    self._remove(room, name)
+            for owner, (room, name) in list(self.owners.items()):
+                if name not in self.rooms.get(room, ()): # 만료되어 지워진 상태
+                    del self.owners[owner]
+            for room in self.dirty:
+                names = tuple(sorted(self.rooms.get(room, ())))
+                if names != self.sent.get(room, ()):
+                    changes.append((room, names))
+                    if names:
+                        self.sent[room] = names
+                    else:
+                        self.sent.pop(room, None)
+            self.dirty.clear()
+        return changes